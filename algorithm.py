@@ -1,5 +1,8 @@
 import datetime
-from ml_predictor import MLModel  # For type hinting if needed
+import numpy as np
+from road_graph import RoadGraph
+from traffic_state import (TrafficState, Decisions, ROAD_INDEX, CLASS_INDEX, PHASE_A, PHASE_B,
+                           PHASE_EMERGENCY, PHASE_NAMES, PHASE_ROADS, CONGESTION_LEVELS)
 
 def get_adjacent_ids(inter_id, rows, cols):
     row = (inter_id - 1) // cols
@@ -32,6 +35,17 @@ def compute_phase_green_times(roads_counts, total_cycle=120):
     green_B = (phase_B / total) * total_cycle
     return [green_A, green_B]
 
+def compute_phase_green_times_arrays(cars, total_cycle=120):
+    """Vectorized compute_phase_green_times for a cars array shaped intersections x roads."""
+    total = cars.sum(axis=1)
+    phase_A = np.maximum(cars[:, 0], cars[:, 1])
+    phase_B = np.maximum(cars[:, 2], cars[:, 3])
+    safe_total = np.where(total == 0, 1, total)
+    green = np.empty((len(cars), 2), dtype=np.float64)
+    green[:, 0] = np.where(total == 0, total_cycle / 2, (phase_A / safe_total) * total_cycle)
+    green[:, 1] = np.where(total == 0, total_cycle / 2, (phase_B / safe_total) * total_cycle)
+    return green
+
 def fuzzy_green_time(car_count):
     if car_count < 10:
         return 30
@@ -40,174 +54,259 @@ def fuzzy_green_time(car_count):
     else:
         return 90
 
-def optimize_intersections(traffic_data, prediction_data, config, current_time, rl_agent=None, ml_model=None):
-    operation_mode = config.get("operation_mode", "normal")
+def fuzzy_green_time_arrays(car_counts):
+    return np.where(car_counts < 10, 30, np.where(car_counts < 20, 60, 90))
+
+def optimize_arrays(state, config, current_time, rl_agent=None, ml_model=None, graph=None,
+                    operation_mode=None, rows=None):
+    """
+    Vectorized decision pass over a TrafficState. Produces the same phases,
+    durations, green times and congestion levels as the dict-based
+    optimize_intersections, as a Decisions object of per-intersection arrays.
+    `operation_mode` overrides the mode in config and `graph` is the
+    RoadGraph of the state's intersections (compiled from config if None).
+    With `rows`, only those intersections are decided; neighbour counts
+    still come from the whole state.
+    """
+    operation_mode = operation_mode or config.get("operation_mode", "normal")
     use_fuzzy_logic = config.get("use_fuzzy_logic", False)
-    results = {}
-
-    # Process each intersection.
-    for inter_no, roads in traffic_data.items():
-        # Emergency mode: if any road detects an ambulance.
-        emergency_detected = False
-        emergency_road = None
-        for road, counts in roads.items():
-            if counts.get("ambulance", 0) > 0:
-                emergency_detected = True
-                emergency_road = road
-                break
-        if emergency_detected:
-            emergency_phase = "A" if emergency_road in ["north", "south"] else "B"
-            results[inter_no] = {
-                "phase": "EMERGENCY",
-                "roads": roads,
-                "dynamic_duration": 15,
-                "emergency_phase": emergency_phase
-            }
-            continue
-
-        # Compute reactive counts.
-        count_A = sum(roads.get(r, {}).get("car", 0) for r in ["north", "south"])
-        count_B = sum(roads.get(r, {}).get("car", 0) for r in ["east", "west"])
-        pred_A = sum(prediction_data[inter_no].get(r, {}).get("car", 0) for r in ["north", "south"])
-        pred_B = sum(prediction_data[inter_no].get(r, {}).get("car", 0) for r in ["east", "west"])
-        effective_A = 0.5 * count_A + 0.5 * pred_A
-        effective_B = 0.5 * count_B + 0.5 * pred_B
-
-        # In normal mode, include adjacent intersections' data.
-        if operation_mode == "normal" and "grid" in config:
-            rows = config["grid"]["rows"]
-            cols = config["grid"]["cols"]
-            current_id = int(inter_no)
-            adj_ids = get_adjacent_ids(current_id, rows, cols)
-            adjacent_weight = 0.5
-            for adj in adj_ids:
-                adj_str = str(adj)
-                if adj_str in traffic_data:
-                    adj_count_A = sum(traffic_data[adj_str].get(r, {}).get("car", 0) for r in ["north", "south"])
-                    adj_count_B = sum(traffic_data[adj_str].get(r, {}).get("car", 0) for r in ["east", "west"])
-                    effective_A += adjacent_weight * adj_count_A
-                    effective_B += adjacent_weight * adj_count_B
-
-        # Force phase switch if one phase is empty (cars + schoolbuses).
-        phase_A_total = sum(roads.get(r, {}).get("car", 0) + roads.get(r, {}).get("schoolbus", 0)
-                            for r in ["north", "south"])
-        phase_B_total = sum(roads.get(r, {}).get("car", 0) + roads.get(r, {}).get("schoolbus", 0)
-                            for r in ["east", "west"])
-        if phase_A_total == 0 and phase_B_total > 0:
-            chosen_phase = "B"
-            print(f"Intersection {inter_no}: No vehicles in north-south; switching to Phase B.")
-        elif phase_B_total == 0 and phase_A_total > 0:
-            chosen_phase = "A"
-            print(f"Intersection {inter_no}: No vehicles in east-west; switching to Phase A.")
-        else:
-            if use_fuzzy_logic and operation_mode == "normal":
-                fuzzy_time_A = fuzzy_green_time(effective_A)
-                fuzzy_time_B = fuzzy_green_time(effective_B)
-                chosen_phase = "A" if fuzzy_time_A >= fuzzy_time_B else "B"
-            else:
-                chosen_phase = "A" if effective_A >= effective_B else "B"
-
-        # Compute reactive duration.
-        base_duration = config.get("base_duration", 10)
-        extension_factor = config.get("extension_factor", 0.5)
-        max_extension = config.get("max_extension", 20)
-        effective_count = effective_A if chosen_phase == "A" else effective_B
-        reactive_duration = base_duration + min(effective_count * extension_factor, max_extension)
-
-        # School release adjustment for intersection "3" on road "west".
-        if inter_no == "3":
-            if "15:25" <= current_time.strftime("%H:%M") <= "15:35":
-                reactive_duration *= 1.5
-
-        if operation_mode == "ml" and ml_model is not None:
-            effective_count = effective_A if chosen_phase == "A" else effective_B
-            dynamic_duration = ml_model.predict_optimal_green(effective_count, current_time)
+    full_state = state
+    if rows is not None:
+        state = state.take(rows)
+    n = len(state)
+    decisions = Decisions(n)
+    counts = state.counts
+    cars = counts[:, :, CLASS_INDEX["car"]]
+    ambulances = counts[:, :, CLASS_INDEX["ambulance"]]
+    schoolbuses = counts[:, :, CLASS_INDEX["schoolbus"]]
+
+    # Emergency mode: if any road detects an ambulance. The first road with an
+    # ambulance, in north/south/east/west order, picks the emergency phase.
+    has_ambulance = ambulances > 0
+    emergency = has_ambulance.any(axis=1)
+    emergency_road = has_ambulance.argmax(axis=1)
+    decisions.emergency_phase[:] = np.where(emergency_road < 2, PHASE_A, PHASE_B)
+
+    # Compute reactive counts.
+    count_A = cars[:, 0] + cars[:, 1]
+    count_B = cars[:, 2] + cars[:, 3]
+    pred_A = state.predictions[:, 0] + state.predictions[:, 1]
+    pred_B = state.predictions[:, 2] + state.predictions[:, 3]
+    effective_A = 0.5 * count_A + 0.5 * pred_A
+    effective_B = 0.5 * count_B + 0.5 * pred_B
+
+    # In normal mode, include adjacent intersections' data.
+    if operation_mode == "normal":
+        if graph is None:
+            graph = RoadGraph.from_config(full_state.inter_ids, config)
+        if graph is not None and graph.edge_count:
+            all_cars = full_state.cars()
+            effective_A = effective_A + graph.neighbour_sum(all_cars[:, 0] + all_cars[:, 1], rows)
+            effective_B = effective_B + graph.neighbour_sum(all_cars[:, 2] + all_cars[:, 3], rows)
+
+    # Force phase switch if one phase is empty (cars + schoolbuses).
+    phase_totals = cars + schoolbuses
+    phase_A_total = phase_totals[:, 0] + phase_totals[:, 1]
+    phase_B_total = phase_totals[:, 2] + phase_totals[:, 3]
+    only_B = (phase_A_total == 0) & (phase_B_total > 0)
+    only_A = (phase_B_total == 0) & (phase_A_total > 0)
+    if use_fuzzy_logic and operation_mode == "normal":
+        prefer_A = fuzzy_green_time_arrays(effective_A) >= fuzzy_green_time_arrays(effective_B)
+    else:
+        prefer_A = effective_A >= effective_B
+    chosen = np.where(only_B, PHASE_B, np.where(only_A, PHASE_A, np.where(prefer_A, PHASE_A, PHASE_B)))
+    decisions.forced_phase[:] = np.where(emergency, -1, np.where(only_B, PHASE_B, np.where(only_A, PHASE_A, -1)))
+
+    # Compute reactive duration.
+    base_duration = config.get("base_duration", 10)
+    extension_factor = config.get("extension_factor", 0.5)
+    max_extension = config.get("max_extension", 20)
+    effective_count = np.where(chosen == PHASE_A, effective_A, effective_B)
+    reactive_duration = base_duration + np.minimum(effective_count * extension_factor, max_extension)
+
+    # School release adjustment for intersection "3" on road "west".
+    if "15:25" <= current_time.strftime("%H:%M") <= "15:35" and "3" in state.index:
+        reactive_duration[state.index["3"]] *= 1.5
+
+    dynamic_duration = reactive_duration
+    if operation_mode == "ml" and ml_model is not None:
+        dynamic_duration = reactive_duration.copy()
+        normal_rows = np.flatnonzero(~emergency)
+        if len(normal_rows):
+            dynamic_duration[normal_rows] = ml_model.predict_optimal_green_batch(effective_count[normal_rows], current_time)
+
+    decisions.phase[:] = np.where(emergency, PHASE_EMERGENCY, chosen)
+    decisions.dynamic_duration[:] = np.where(emergency, 15, dynamic_duration)
+    decisions.green_times[:] = compute_phase_green_times_arrays(cars, total_cycle=120)
+    total_cars = cars.sum(axis=1)
+    decisions.congestion[:] = np.where(total_cars > 50, 2, np.where(total_cars > 20, 1, 0))
+
+    # Non-emergency intersections always run one entire phase; emergency ones
+    # open the phase of the ambulance unless the RL agent overrides them.
+    signal_phase = np.where(emergency, decisions.emergency_phase, chosen)
+
+    # If RL mode is chosen, use the RL agent's durations everywhere and its
+    # signals where no phase is enforced.
+    if operation_mode == "rl" and rl_agent is not None:
+        ns = cars[:, 0] + cars[:, 1]
+        ew = cars[:, 2] + cars[:, 3]
+        actions, rl_durations = rl_agent.get_optimal_actions(ns, ew, config)
+        signal_phase = np.where(emergency, np.where(actions == 0, PHASE_A, PHASE_B), signal_phase)
+        decisions.dynamic_duration[:] = rl_durations
+        decisions.rl_override = True
+    decisions.green[:] = PHASE_ROADS[signal_phase] & state.present
+    return decisions
+
+def signal_mode(decisions, operation_mode):
+    if decisions.rl_override:
+        return "DRL Optimized"
+    return "ML Predictive" if operation_mode == "ml" else "Normal"
+
+def report_forced_phases(inter_ids, forced_phase):
+    for i in np.flatnonzero(forced_phase >= 0):
+        if forced_phase[i] == PHASE_B:
+            print(f"Intersection {inter_ids[i]}: No vehicles in north-south; switching to Phase B.")
         else:
-            dynamic_duration = reactive_duration
+            print(f"Intersection {inter_ids[i]}: No vehicles in east-west; switching to Phase A.")
+
+def road_signals(inter_no, roads, predictions, duration, lane_green_times, congestion, green, mode):
+    """Output items of one intersection, one per road."""
+    dynamic_duration = round(duration, 1)
+    congestion_level = CONGESTION_LEVELS[congestion]
+    output = []
+    for road_no, counts in roads.items():
+        # Note: Accident detection is reported but does not change the signal.
+        output.append({
+            "intersection": inter_no,
+            "road": road_no,
+            "cars": counts.get("car", 0),
+            "ambulances": counts.get("ambulance", 0),
+            "schoolbuses": counts.get("schoolbus", 0),
+            "accidents": counts.get("accident", 0),
+            "predicted_cars": round(predictions[road_no]["car"], 1),
+            "signal": "GREEN" if road_no in ROAD_INDEX and green[ROAD_INDEX[road_no]] else "RED",
+            "dynamic_green_duration": dynamic_duration,
+            "lane_green_times": lane_green_times,
+            "congestion_level": congestion_level,
+            "mode": mode
+        })
+        if counts.get("accident", 0) > 0:
+            print(f"ALERT: Accident detected at Intersection {inter_no}, Road {road_no}")
+    return output
+
+def optimize_intersections(traffic_data, prediction_data, config, current_time, rl_agent=None, ml_model=None,
+                           operation_mode=None):
+    """
+    Dict-based interface kept for existing callers: converts the nested dicts
+    to a TrafficState, runs optimize_arrays and expands the result back into
+    one output item per road.
+    """
+    operation_mode = operation_mode or config.get("operation_mode", "normal")
+    state = TrafficState.from_dicts(traffic_data, prediction_data)
+    decisions = optimize_arrays(state, config, current_time, rl_agent, ml_model, operation_mode=operation_mode)
+    report_forced_phases(state.inter_ids, decisions.forced_phase)
 
-        results[inter_no] = {
-            "phase": chosen_phase,
-            "roads": roads,
-            "dynamic_duration": dynamic_duration
-        }
+    mode = signal_mode(decisions, operation_mode)
+    durations = decisions.dynamic_duration.tolist()
+    green_times = decisions.green_times.tolist()
+    congestion = decisions.congestion.tolist()
+    green = decisions.green.tolist()
 
     # Build final output signals.
     output = []
-    for inter_no, data in results.items():
-        phase = data["phase"]
-        roads = data["roads"]
-        dynamic_duration = data["dynamic_duration"]
-        lane_green_times = compute_phase_green_times(roads, total_cycle=120)
-        total_cars = sum(roads.get(r, {}).get("car", 0) for r in ["north", "south", "east", "west"])
-        if total_cars > 50:
-            congestion_level = "high"
-        elif total_cars > 20:
-            congestion_level = "medium"
-        else:
-            congestion_level = "low"
-        for road_no, counts in roads.items():
-            if phase == "EMERGENCY":
-                emergency_phase = data.get("emergency_phase")
-                if emergency_phase == "A":
-                    signal = "GREEN" if road_no in ["north", "south"] else "RED"
-                else:
-                    signal = "GREEN" if road_no in ["east", "west"] else "RED"
-            else:
-                if phase == "A" and road_no in ["north", "south"]:
-                    signal = "GREEN"
-                elif phase == "B" and road_no in ["east", "west"]:
-                    signal = "GREEN"
-                else:
-                    signal = "RED"
-            # Note: Accident detection is reported but does not change the signal.
-            out_item = {
-                "intersection": inter_no,
-                "road": road_no,
-                "cars": counts.get("car", 0),
-                "ambulances": counts.get("ambulance", 0),
-                "schoolbuses": counts.get("schoolbus", 0),
-                "accidents": counts.get("accident", 0),
-                "predicted_cars": round(prediction_data[inter_no][road_no]["car"], 1),
-                "signal": signal,
-                "dynamic_green_duration": round(dynamic_duration, 1),
-                "lane_green_times": lane_green_times,
-                "congestion_level": congestion_level
-            }
-            output.append(out_item)
-            if counts.get("accident", 0) > 0:
-                print(f"ALERT: Accident detected at Intersection {inter_no}, Road {road_no}")
-
-    # If RL mode is chosen, override outputs with RL agent recommendations.
-    if operation_mode == "rl" and rl_agent is not None:
-        rl_signals = rl_agent.get_optimal_signals(traffic_data, config)
-        for inter_id, roads in rl_signals.items():
-            for road, rl_data in roads.items():
-                for out in output:
-                    if out["intersection"] == inter_id and out["road"] == road:
-                        out["signal"] = rl_data["signal"]
-                        out["dynamic_green_duration"] = rl_data["dynamic_duration"]
-                        out["mode"] = "DRL Optimized"
-
-    # Enforce that one entire phase is active.
-    for inter_no, data in results.items():
-        if data.get("phase") == "EMERGENCY":
-            continue
-        computed_phase = data["phase"]
-        for out_item in output:
-            if out_item["intersection"] == inter_no:
-                if computed_phase == "A":
-                    out_item["signal"] = "GREEN" if out_item["road"] in ["north", "south"] else "RED"
-                elif computed_phase == "B":
-                    out_item["signal"] = "GREEN" if out_item["road"] in ["east", "west"] else "RED"
-
-    # Set a mode field for non-RL outputs.
-    for item in output:
-        if "mode" not in item:
-            if operation_mode == "ml":
-                item["mode"] = "ML Predictive"
-            elif operation_mode == "normal":
-                item["mode"] = "Normal"
-            else:
-                item["mode"] = "Normal"  # fallback for RL mode if not overridden
-
-    return output, {k: v["phase"] for k, v in results.items()}
+    for i, (inter_no, roads) in enumerate(traffic_data.items()):
+        output.extend(road_signals(inter_no, roads, prediction_data[inter_no], durations[i], green_times[i],
+                                   congestion[i], green[i], mode))
+
+    return output, {inter_no: PHASE_NAMES[decisions.phase[i]] for i, inter_no in enumerate(state.inter_ids)}
+
+class IncrementalOptimizer:
+    """
+    optimize_intersections for a controller that decides every frame. The
+    road graph is compiled once per set of intersections, and only the
+    intersections whose counts or predictions changed, or whose neighbours'
+    counts changed, are decided again; the others keep their cached output
+    items. A change of the operation mode, fuzzy logic, the school release
+    window or (in ML mode) the minute invalidates everything, and RL mode,
+    whose agent samples part of its input, always decides every intersection.
+    Returned output items are shared between frames and must not be modified.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.graph = None
+        self.state = None
+        self.context = None
+        self.inputs = {}
+        self.signals = {}
+        self.phases = {}
+        self.stats = {"decided": 0, "reused": 0}
+
+    def context_key(self, current_time, operation_mode):
+        hhmm = current_time.strftime("%H:%M")
+        return (operation_mode, self.config.get("use_fuzzy_logic", False), "15:25" <= hhmm <= "15:35",
+                hhmm if operation_mode == "ml" else None)
+
+    def reset(self, traffic_data):
+        inter_ids = list(traffic_data.keys())
+        self.state = TrafficState(inter_ids)
+        self.graph = RoadGraph.from_config(inter_ids, self.config)
+        self.inputs = {}
+        self.signals = {}
+        self.phases = {}
+
+    def changed_rows(self, traffic_data, prediction_data):
+        rows = []
+        for i, (inter_no, roads) in enumerate(traffic_data.items()):
+            predictions = prediction_data[inter_no]
+            previous = self.inputs.get(inter_no)
+            if previous is None or previous[0] != roads or previous[1] != predictions:
+                # Copies, since the caller updates its prediction dicts in place.
+                self.inputs[inter_no] = ({road_no: dict(counts) for road_no, counts in roads.items()},
+                                         {road_no: dict(pred) for road_no, pred in predictions.items()})
+                self.state.set_row(i, inter_no, roads, predictions)
+                rows.append(i)
+        return np.array(rows, dtype=np.int64)
+
+    def optimize(self, traffic_data, prediction_data, current_time, rl_agent=None, ml_model=None,
+                 operation_mode=None):
+        """Same arguments (minus config) and result as optimize_intersections."""
+        operation_mode = operation_mode or self.config.get("operation_mode", "normal")
+        context = self.context_key(current_time, operation_mode)
+        if self.state is None or self.state.inter_ids != list(traffic_data.keys()):
+            self.reset(traffic_data)
+        elif context != self.context:
+            self.inputs = {}
+        self.context = context
+
+        rows = self.changed_rows(traffic_data, prediction_data)
+        if operation_mode == "rl":
+            rows = np.arange(len(self.state))
+        elif operation_mode == "normal" and self.graph is not None and len(rows):
+            # Neighbour counts feed into normal-mode decisions.
+            rows = self.graph.influenced(rows)
+        if len(rows):
+            decisions = optimize_arrays(self.state, self.config, current_time, rl_agent, ml_model, self.graph,
+                                        operation_mode, rows)
+            inter_ids = [self.state.inter_ids[i] for i in rows]
+            report_forced_phases(inter_ids, decisions.forced_phase)
+            mode = signal_mode(decisions, operation_mode)
+            durations = decisions.dynamic_duration.tolist()
+            green_times = decisions.green_times.tolist()
+            congestion = decisions.congestion.tolist()
+            green = decisions.green.tolist()
+            for k, inter_no in enumerate(inter_ids):
+                self.signals[inter_no] = road_signals(inter_no, traffic_data[inter_no], prediction_data[inter_no],
+                                                      durations[k], green_times[k], congestion[k], green[k], mode)
+                self.phases[inter_no] = PHASE_NAMES[decisions.phase[k]]
+        self.stats["decided"] += len(rows)
+        self.stats["reused"] += len(self.state) - len(rows)
+
+        output = []
+        for inter_no in traffic_data:
+            output.extend(self.signals[inter_no])
+        return output, dict(self.phases)
+
+    def format_stats(self):
+        total = self.stats["decided"] + self.stats["reused"]
+        ratio = self.stats["reused"] / total if total else 0.0
+        return f"reused {ratio:.0%} of intersection decisions"
@@ -0,0 +1,66 @@
+import hashlib
+import json
+import os
+
+# Bump when the layout of cached artifacts changes.
+ARTIFACT_VERSION = 1
+
+class ArtifactCache:
+    """
+    Versioned on-disk cache for trained models. Every artifact is stored under
+    a key derived from its training parameters, the source code of the
+    modules that produce it and ARTIFACT_VERSION, so a change to any of them
+    simply misses the cache and triggers retraining. torch and joblib are
+    only imported when an artifact of that kind is read or written.
+    """
+    def __init__(self, path="artifacts"):
+        self.path = path
+
+    @classmethod
+    def from_config(cls, config):
+        cache_config = config.get("artifact_cache", {})
+        if not cache_config.get("enabled", True):
+            return None
+        return cls(cache_config.get("path", "artifacts"))
+
+    def key(self, name, params, sources=()):
+        digest = hashlib.sha256()
+        digest.update(json.dumps({"name": name, "version": ARTIFACT_VERSION, "params": params},
+                                 sort_keys=True, default=str).encode())
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        for source in sources:
+            with open(os.path.join(base_dir, source), "rb") as f:
+                digest.update(f.read())
+        return digest.hexdigest()[:16]
+
+    def file_for(self, name, key, extension):
+        return os.path.join(self.path, f"{name}-{key}.{extension}")
+
+    def load_torch(self, name, key):
+        path = self.file_for(name, key, "pt")
+        if not os.path.exists(path):
+            return None
+        import torch
+        return torch.load(path, map_location="cpu")
+
+    def save_torch(self, name, key, state):
+        import torch
+        self.write(self.file_for(name, key, "pt"), lambda tmp: torch.save(state, tmp))
+
+    def load_object(self, name, key):
+        path = self.file_for(name, key, "joblib")
+        if not os.path.exists(path):
+            return None
+        import joblib
+        return joblib.load(path)
+
+    def save_object(self, name, key, obj):
+        import joblib
+        self.write(self.file_for(name, key, "joblib"), lambda tmp: joblib.dump(obj, tmp))
+
+    def write(self, path, writer):
+        # Write to a temporary file first so a crash never leaves a truncated artifact.
+        os.makedirs(self.path, exist_ok=True)
+        tmp = path + ".tmp"
+        writer(tmp)
+        os.replace(tmp, path)
@@ -0,0 +1,431 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import main
+from algorithm import optimize_intersections, IncrementalOptimizer
+from model import VehicleDetector
+from signal_codec import SignalEncoder
+from traffic_state import ROADS
+
+GRID_ROI_WIDTH, GRID_ROI_HEIGHT = 100, 50
+
+def parse_grid(text):
+    rows, cols = text.lower().split("x")
+    return int(rows), int(cols)
+
+def grid_config(rows, cols):
+    return {"rows": rows, "cols": cols, "roi_width": GRID_ROI_WIDTH, "roi_height": GRID_ROI_HEIGHT}
+
+def synthetic_traffic(rows, cols, seed=0, accident_rate=0.01, ambulance_rate=0.02, schoolbus_rate=0.05):
+    """
+    Random but reproducible traffic_data and prediction_data for a rows x cols
+    grid, shaped like the output of RoiCounter and SignalController.
+    """
+    rng = np.random.default_rng(seed)
+    n = rows * cols
+    cars = rng.poisson(rng.uniform(0, 12, size=(n, 1)), size=(n, len(ROADS)))
+    rare = {"ambulance": ambulance_rate, "schoolbus": schoolbus_rate, "accident": accident_rate}
+    extra = {name: rng.random((n, len(ROADS))) < rate for name, rate in rare.items()}
+    predictions = np.maximum(cars + rng.normal(0, 2, size=cars.shape), 0)
+    traffic_data, prediction_data = {}, {}
+    for i in range(n):
+        inter_no = str(i + 1)
+        traffic_data[inter_no] = {}
+        prediction_data[inter_no] = {}
+        for r, road in enumerate(ROADS):
+            counts = {"car": int(cars[i, r])}
+            counts.update({name: int(flags[i, r]) for name, flags in extra.items()})
+            traffic_data[inter_no][road] = counts
+            prediction_data[inter_no][road] = {"car": float(predictions[i, r]), "ambulance": 0,
+                                               "schoolbus": 0, "accident": 0}
+    return traffic_data, prediction_data
+
+class StubBoxes:
+    """Mimics ultralytics Boxes: per-box iteration plus whole-array xyxy/conf/cls."""
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy, self.conf, self.cls = xyxy, conf, cls
+
+    def __len__(self):
+        return len(self.conf)
+
+    def __iter__(self):
+        for i in range(len(self.conf)):
+            yield StubBoxes(self.xyxy[i:i + 1], self.conf[i:i + 1], self.cls[i:i + 1])
+
+class StubResult:
+    def __init__(self, boxes, speed):
+        self.boxes = boxes
+        self.speed = speed
+
+class StubModel:
+    """
+    Deterministic stand-in for a YOLO model. Every call draws boxes from a
+    generator seeded with the call number, so runs are repeatable, and
+    optionally sleeps to emulate inference time.
+    """
+    def __init__(self, seed=0, boxes_per_image=6, inference_ms=0.0):
+        self.seed = seed
+        self.boxes_per_image = boxes_per_image
+        self.inference_ms = inference_ms
+        self.calls = 0
+
+    def __call__(self, images, **kwargs):
+        images = images if isinstance(images, list) else [images]
+        rng = np.random.default_rng((self.seed, self.calls))
+        self.calls += 1
+        if self.inference_ms:
+            time.sleep(self.inference_ms * len(images) / 1000)
+        results = []
+        for image in images:
+            height, width = image.shape[:2]
+            count = rng.poisson(self.boxes_per_image)
+            x1 = rng.uniform(0, width * 0.8, count)
+            y1 = rng.uniform(0, height * 0.8, count)
+            x2 = np.minimum(x1 + rng.uniform(8, 40, count), width)
+            y2 = np.minimum(y1 + rng.uniform(8, 40, count), height)
+            boxes = StubBoxes(np.column_stack([x1, y1, x2, y2]), rng.uniform(0.5, 1.0, count),
+                              rng.choice(4, count, p=[0.01, 0.03, 0.9, 0.06]).astype(np.float64))
+            speed = {"preprocess": 0.0, "inference": self.inference_ms, "postprocess": 0.0}
+            results.append(StubResult(boxes, speed))
+        return results
+
+class StubDetector(VehicleDetector):
+    """VehicleDetector on top of StubModel; no weights or GPU needed."""
+    def __init__(self, seed=0, boxes_per_image=6, inference_ms=0.0):
+        self.model_path = None
+        self.model = StubModel(seed, boxes_per_image, inference_ms)
+        self.rng = np.random.default_rng(seed)
+
+def write_synthetic_video(path, frames=120, width=640, height=360, fps=10.0, seed=0):
+    """Writes a short video of moving rectangles for offline runs of the frame loop."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    positions = rng.uniform(0, 1, size=(40, 2)) * [width, height]
+    velocities = rng.normal(0, 6, size=(40, 2))
+    colors = rng.integers(0, 255, size=(40, 3))
+    for _ in range(frames):
+        frame = np.full((height, width, 3), 60, dtype=np.uint8)
+        positions = (positions + velocities) % [width, height]
+        for (x, y), color in zip(positions.astype(int), colors):
+            cv2.rectangle(frame, (x, y), (x + 20, y + 12), tuple(int(c) for c in color), -1)
+        writer.write(frame)
+    writer.release()
+
+def percentile_summary(latencies):
+    latencies = np.asarray(latencies) * 1000
+    total = latencies.sum() / 1000
+    return {
+        "iterations": int(len(latencies)),
+        "throughput_per_s": round(len(latencies) / total, 3) if total > 0 else None,
+        "mean_ms": round(float(latencies.mean()), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 4),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 4)
+    }
+
+def measure(func, iterations, warmup=2, memory_iterations=3):
+    """Times `iterations` calls of func; peak Python memory comes from a separate traced pass."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(warmup):
+            func()
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - start)
+        tracemalloc.start()
+        for _ in range(memory_iterations):
+            func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    summary = percentile_summary(latencies)
+    summary["peak_memory_kb"] = round(peak / 1024, 1)
+    return summary
+
+@contextlib.contextmanager
+def scratch_directory():
+    """Runs the block in a temporary working directory, removed afterwards."""
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="traffic_bench_")
+    try:
+        os.chdir(workdir)
+        yield workdir
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def benchmark_config(rows, cols, operation_mode="normal", use_fuzzy_logic=False):
+    config = main.load_config("config.json") if os.path.exists("config.json") else {}
+    config.update({"grid": grid_config(rows, cols), "operation_mode": operation_mode,
+                   "use_fuzzy_logic": use_fuzzy_logic,
+                   "last_school_bus_green": datetime.datetime.now()})
+    return config
+
+def run_component_benchmarks(grids, iterations, selected, results):
+    rl_agent = None
+    ml_model = None
+    for rows, cols in grids:
+        suffix = f"[{rows}x{cols}]"
+        traffic_data, prediction_data = synthetic_traffic(rows, cols)
+        now = datetime.datetime.now()
+
+        if selected("grid"):
+            results["grid" + suffix] = measure(
+                lambda: main.compute_intersections_from_grid(grid_config(rows, cols), 1920, 1080), iterations)
+
+        for mode, fuzzy in (("normal", False), ("fuzzy", True), ("ml", False), ("rl", False)):
+            if not selected("optimize_" + mode):
+                continue
+            if mode == "ml" and ml_model is None:
+                from ml_predictor import MLModel
+                ml_model = MLModel()
+                ml_model.train_model()
+            if mode == "rl" and rl_agent is None:
+                from rl_agent import RLAgent
+                rl_agent = RLAgent(inference_only=True)
+            config = benchmark_config(rows, cols, "normal" if mode == "fuzzy" else mode, fuzzy)
+            results[f"optimize_{mode}" + suffix] = measure(
+                lambda: optimize_intersections(traffic_data, prediction_data, config, now,
+                                               rl_agent if mode == "rl" else None,
+                                               ml_model if mode == "ml" else None), iterations)
+
+        if selected("optimize_incremental"):
+            # Steady traffic where one road in a hundred changes per frame.
+            config = benchmark_config(rows, cols)
+            optimizer = IncrementalOptimizer(config)
+            rng = np.random.default_rng(1)
+            inter_ids = list(traffic_data)
+
+            def incremental_step():
+                for _ in range(max(1, len(inter_ids) * len(ROADS) // 100)):
+                    road = traffic_data[inter_ids[rng.integers(len(inter_ids))]][ROADS[rng.integers(len(ROADS))]]
+                    road["car"] = int(rng.integers(0, 20))
+                optimizer.optimize(traffic_data, prediction_data, now)
+            results["optimize_incremental" + suffix] = measure(incremental_step, iterations)
+
+        if selected("rl_signals"):
+            if rl_agent is None:
+                from rl_agent import RLAgent
+                rl_agent = RLAgent(inference_only=True)
+            config = benchmark_config(rows, cols, "rl")
+            results["rl_signals" + suffix] = measure(
+                lambda: rl_agent.get_optimal_signals(traffic_data, config), iterations)
+
+        if selected("log_congestion"):
+            # The congestion log main.py would open with config.json, written to a scratch directory.
+            config = benchmark_config(rows, cols)
+            with scratch_directory():
+                congestion_log = main.open_congestion_log(config)
+                try:
+                    results["log_congestion" + suffix] = measure(
+                        lambda: congestion_log.append(traffic_data, now), iterations)
+                finally:
+                    congestion_log.close()
+
+        if selected("serialize_json") or selected("serialize_binary"):
+            # One frame of signal output, as the old console dump and as a binary keyframe.
+            config = benchmark_config(rows, cols)
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                output_signals, _ = IncrementalOptimizer(config).optimize(traffic_data, prediction_data, now)
+            if selected("serialize_json"):
+                results["serialize_json" + suffix] = measure(lambda: json.dumps(output_signals, indent=2), iterations)
+                results["serialize_json" + suffix]["bytes"] = len(json.dumps(output_signals, indent=2))
+            if selected("serialize_binary"):
+                results["serialize_binary" + suffix] = measure(lambda: SignalEncoder().encode(output_signals),
+                                                                iterations)
+                results["serialize_binary" + suffix]["bytes"] = len(SignalEncoder().encode(output_signals))
+
+def run_training_benchmark(episodes, results):
+    from rl_agent import RLAgent
+    agent = RLAgent()
+    stats = {}
+
+    def train():
+        stats.update(agent.train_agent(episodes=episodes) or {})
+    summary = measure(train, iterations=3, warmup=0, memory_iterations=1)
+    if stats.get("steps"):
+        summary["steps_per_s"] = round(stats["steps"] / (summary["mean_ms"] / 1000), 1)
+    results[f"rl_train_agent[{episodes} episodes]"] = summary
+
+class LocalBackend:
+    """
+    A stand-in for the telemetry backend on 127.0.0.1, served from its own
+    thread and event loop, so the frame loop never leaves the machine.
+    """
+    def __init__(self):
+        self.received = 0
+        self.received_bytes = 0
+        self.url = None
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    async def signal_data(self, request):
+        from aiohttp import web
+        self.received_bytes += len(await request.read())
+        self.received += 1
+        return web.json_response({"ok": True})
+
+    async def setup(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_post("/traffic/signal-data", self.signal_data)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/"
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.setup(), self.loop).result()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+def run_frame_loop_benchmark(frames, inference_ms, results):
+    """Runs main.main end to end on a synthetic video with the stub detector, headless."""
+    workdir = tempfile.mkdtemp(prefix="traffic_bench_")
+    cwd = os.getcwd()
+    config = benchmark_config(2, 2)
+    config.update({"train_rl_agent": False, "operation_mode": "normal"})
+    config["display"] = dict(config.get("display", {}), headless=True, preview_video=None)
+    config["pipeline"] = dict(config.get("pipeline", {}), drop_policy="block", stats_interval=0)
+    config["startup"] = dict(config.get("startup", {}), profile=False)
+    # Keep the instrumentation but do not open the metrics port or dump files.
+    config["metrics"] = dict(config.get("metrics", {}), port=None, json_path=None)
+    frame_times = []
+
+    class TimedLog:
+        def __init__(self, log):
+            self.log = log
+
+        def append(self, traffic_data, current_time):
+            frame_times.append(time.perf_counter())
+            self.log.append(traffic_data, current_time)
+
+        def close(self):
+            return self.log.close()
+
+    original = main.load_config, main.create_detector, main.open_congestion_log
+    try:
+        os.chdir(workdir)
+        write_synthetic_video(os.path.join("data", "sample_video8.mp4"), frames)
+        main.load_config = lambda path: config
+        main.create_detector = lambda cfg: StubDetector(inference_ms=inference_ms)
+        main.open_congestion_log = lambda cfg: TimedLog(original[2](cfg))
+
+        backend = LocalBackend().start()
+        config["uploader"] = dict(config.get("uploader", {}), url=backend.url,
+                                  spool_dir=os.path.join(workdir, "spool"))
+        try:
+            tracemalloc.start()
+            start = time.perf_counter()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                asyncio.run(main.main(main.parse_args(["--headless"])))
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        finally:
+            backend.stop()
+    finally:
+        main.load_config, main.create_detector, main.open_congestion_log = original
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    if len(frame_times) < 2:
+        raise RuntimeError("The frame loop produced fewer than two frames.")
+    summary = percentile_summary(np.diff(frame_times))
+    summary.update({"frames": len(frame_times), "frames_per_s": round(len(frame_times) / elapsed, 2),
+                    "uploads_received": backend.received,
+                    "upload_bytes": backend.received_bytes, "peak_memory_kb": round(peak / 1024, 1)})
+    results[f"main_loop[{frames} frames]"] = summary
+
+def compare(results, baseline, tolerance):
+    """Names whose p50 latency grew by more than `tolerance` (a fraction) over the baseline."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or not previous.get("p50_ms"):
+            continue
+        ratio = current["p50_ms"] / previous["p50_ms"]
+        current["baseline_ratio"] = round(ratio, 3)
+        if ratio > 1 + tolerance:
+            regressions.append((name, previous["p50_ms"], current["p50_ms"], ratio))
+    return regressions
+
+def print_results(results):
+    print(f"{'benchmark':<34}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>12}{'peak KB':>10}{'vs base':>9}")
+    for name, r in results.items():
+        ratio = f"{r['baseline_ratio']:.2f}x" if "baseline_ratio" in r else "-"
+        print(f"{name:<34}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+              f"{r['throughput_per_s'] or 0:>12.1f}{r['peak_memory_kb']:>10.1f}{ratio:>9}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline, CPU-only benchmarks of the traffic pipeline.")
+    parser.add_argument("--grids", default="2x2,10x10,30x30",
+                        help="Comma-separated grid sizes (rows x cols) for the component benchmarks.")
+    parser.add_argument("--iterations", type=int, default=50, help="Timed calls per component benchmark.")
+    parser.add_argument("--only", help="Comma-separated benchmark names to run (e.g. optimize_ml,main_loop).")
+    parser.add_argument("--train-episodes", type=int, default=50, help="Episodes for the train_agent benchmark.")
+    parser.add_argument("--frames", type=int, default=120, help="Frames of synthetic video for main_loop.")
+    parser.add_argument("--inference-ms", type=float, default=0.0,
+                        help="Simulated detector inference time per image in main_loop.")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the results.")
+    parser.add_argument("--baseline", default="bench_baseline.json", help="Baseline results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed p50 slowdown over the baseline before flagging a regression.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline.")
+    return parser.parse_args(argv)
+
+def run(args):
+    only = set(args.only.split(",")) if args.only else None
+    selected = lambda name: only is None or name in only
+    grids = [parse_grid(text) for text in args.grids.split(",")]
+    results = {}
+    run_component_benchmarks(grids, args.iterations, selected, results)
+    if selected("rl_train_agent"):
+        run_training_benchmark(args.train_episodes, results)
+    if selected("main_loop"):
+        run_frame_loop_benchmark(args.frames, args.inference_ms, results)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+    print_results(results)
+
+    report = {
+        "meta": {"created": datetime.datetime.now().isoformat(timespec="seconds"),
+                 "python": platform.python_version(), "numpy": np.__version__,
+                 "machine": platform.machine(), "processor": platform.processor(),
+                 "cpus": os.cpu_count(), "args": vars(args)},
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+    if args.save_baseline:
+        shutil.copy(args.output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+    for name, before, after, ratio in regressions:
+        print(f"REGRESSION: {name} p50 {before:.3f} ms -> {after:.3f} ms ({ratio:.2f}x)")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -0,0 +1,272 @@
+import datetime
+import json
+import os
+import shutil
+import time
+import numpy as np
+from traffic_state import ROADS, CLASSES, ROAD_INDEX
+from utils import log_congestion
+
+# One fixed-width record per road per logged frame.
+RECORD_DTYPE = np.dtype([("timestamp", "<f8"), ("intersection", "<u4"), ("road", "u1")] +
+                        [(name, "<u2") for name in CLASSES])
+
+def to_epoch(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return float(value)
+
+def build_index(records):
+    """Time range and per-intersection record counts of a block of records."""
+    if len(records) == 0:
+        return {"records": 0, "start": None, "end": None, "intersections": {}}
+    codes, counts = np.unique(records["intersection"], return_counts=True)
+    return {
+        "records": int(len(records)),
+        "start": float(records["timestamp"][0]),
+        "end": float(records["timestamp"][-1]),
+        "intersections": {str(int(code)): int(count) for code, count in zip(codes, counts)}
+    }
+
+def merge_index(index, other):
+    if other["records"] == 0:
+        return index
+    if index["records"] == 0:
+        return other
+    merged = dict(index["intersections"])
+    for code, count in other["intersections"].items():
+        merged[code] = merged.get(code, 0) + count
+    return {"records": index["records"] + other["records"], "start": index["start"],
+            "end": other["end"], "intersections": merged}
+
+class CongestionStore:
+    """
+    Append-only binary store for per-frame road counts.
+    Records are collected in an in-memory buffer and written in bulk to the
+    active segment file, which stays open between writes, once the buffer
+    holds `buffer_records` records or `flush_interval` seconds after the
+    last write, so little history is lost if the process is killed. Segments rotate
+    once they reach `segment_bytes`; sealing a segment writes a small JSON
+    index (time range and records per intersection) next to it.
+    Intersection ids are mapped to integer codes kept in ids.json; roads
+    outside ROADS are not stored.
+    """
+    def __init__(self, path="congestion_store", buffer_records=4096, segment_bytes=64 * 1024 * 1024,
+                 flush_interval=5.0):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        os.makedirs(path, exist_ok=True)
+        self.ids_path = os.path.join(path, "ids.json")
+        self.ids = []
+        if os.path.exists(self.ids_path):
+            with open(self.ids_path) as f:
+                self.ids = json.load(f)
+        self.codes = {inter_id: code for code, inter_id in enumerate(self.ids)}
+        self.buffer_records = buffer_records
+        self.flush_interval = flush_interval
+        self.flushed_at = time.monotonic()
+        self.rows = []
+        self.chunks = []
+        self.buffered = 0
+        self.file = None
+        self.segment_path = None
+        self.segment_index = None
+        existing = [name for name in os.listdir(path) if name.startswith("segment_") and name.endswith(".bin")]
+        self.next_segment = max((int(name[8:14]) for name in existing), default=0) + 1
+
+    @classmethod
+    def from_config(cls, config):
+        store_config = config.get("congestion_store", {})
+        return cls(store_config.get("path", "congestion_store"),
+                   store_config.get("buffer_records", 4096),
+                   store_config.get("segment_bytes", 64 * 1024 * 1024),
+                   store_config.get("flush_interval", 5.0))
+
+    def code(self, inter_id):
+        code = self.codes.get(inter_id)
+        if code is None:
+            code = len(self.ids)
+            self.ids.append(inter_id)
+            self.codes[inter_id] = code
+            with open(self.ids_path + ".tmp", "w") as f:
+                json.dump(self.ids, f)
+            os.replace(self.ids_path + ".tmp", self.ids_path)
+        return code
+
+    def append(self, traffic_data, current_time):
+        timestamp = to_epoch(current_time)
+        rows = self.rows
+        before = len(rows)
+        for inter_no, roads in traffic_data.items():
+            code = self.code(inter_no)
+            for road_no, counts in roads.items():
+                if road_no not in ROAD_INDEX:
+                    continue
+                rows.append((timestamp, code, ROAD_INDEX[road_no]) +
+                            tuple(counts.get(name, 0) for name in CLASSES))
+        self.buffered += len(rows) - before
+        self.flush_if_due()
+
+    def append_state(self, state, current_time):
+        """Appends a whole TrafficState at once; only roads that exist are stored."""
+        inter_rows, road_cols = np.nonzero(state.present)
+        records = np.zeros(len(inter_rows), dtype=RECORD_DTYPE)
+        records["timestamp"] = to_epoch(current_time)
+        codes = np.array([self.code(inter_id) for inter_id in state.inter_ids], dtype=np.uint32)
+        records["intersection"] = codes[inter_rows] if len(codes) else 0
+        records["road"] = road_cols
+        for c, name in enumerate(CLASSES):
+            records[name] = state.counts[inter_rows, road_cols, c]
+        self.pack_rows()
+        self.chunks.append(records)
+        self.buffered += len(records)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if self.buffered >= self.buffer_records or time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def pack_rows(self):
+        if self.rows:
+            self.chunks.append(np.array(self.rows, dtype=RECORD_DTYPE))
+            self.rows = []
+
+    def flush(self):
+        self.pack_rows()
+        chunks, self.chunks, self.buffered = self.chunks, [], 0
+        self.flushed_at = time.monotonic()
+        if chunks:
+            self.write(np.concatenate(chunks) if len(chunks) > 1 else chunks[0])
+
+    def write(self, records):
+        if self.file is None:
+            self.segment_path = os.path.join(self.path, f"segment_{self.next_segment:06d}.bin")
+            self.next_segment += 1
+            self.file = open(self.segment_path, "ab")
+            self.segment_index = build_index(records[:0])
+        self.file.write(records.tobytes())
+        self.file.flush()
+        self.segment_index = merge_index(self.segment_index, build_index(records))
+        if self.file.tell() >= self.segment_bytes:
+            self.close_segment()
+
+    def seal(self):
+        """Flushes the buffer and closes the active segment. Returns its path, if any."""
+        self.flush()
+        return self.close_segment()
+
+    def close_segment(self):
+        if self.file is None:
+            return None
+        self.file.close()
+        with open(self.segment_path[:-4] + ".idx.json", "w") as f:
+            json.dump(self.segment_index, f)
+        sealed = self.segment_path
+        self.file = None
+        self.segment_path = None
+        return sealed
+
+    def close(self):
+        return self.seal()
+
+class CongestionReader:
+    """
+    Queries a CongestionStore directory. Segments are memory-mapped, the time
+    range is located with a binary search on the (sorted) timestamps and the
+    per-segment indexes skip segments that cannot match.
+    """
+    def __init__(self, path="congestion_store"):
+        self.path = path
+        ids_path = os.path.join(path, "ids.json")
+        self.ids = []
+        if os.path.exists(ids_path):
+            with open(ids_path) as f:
+                self.ids = json.load(f)
+        self.codes = {inter_id: code for code, inter_id in enumerate(self.ids)}
+
+    def segments(self):
+        if not os.path.isdir(self.path):
+            return []
+        segments = []
+        for name in sorted(os.listdir(self.path)):
+            if not (name.startswith("segment_") and name.endswith(".bin")):
+                continue
+            bin_path = os.path.join(self.path, name)
+            idx_path = bin_path[:-4] + ".idx.json"
+            if os.path.exists(idx_path):
+                with open(idx_path) as f:
+                    index = json.load(f)
+            else:
+                # Active or unsealed segment: index it on the fly.
+                index = build_index(self.records(bin_path))
+            segments.append((bin_path, index))
+        return segments
+
+    def records(self, bin_path):
+        count = os.path.getsize(bin_path) // RECORD_DTYPE.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.memmap(bin_path, dtype=RECORD_DTYPE, mode="r", shape=(count,))
+
+    def query(self, intersection=None, start=None, end=None):
+        """Records of one intersection (or all) with start <= timestamp < end, as one array."""
+        start, end = to_epoch(start), to_epoch(end)
+        code = None
+        if intersection is not None:
+            code = self.codes.get(str(intersection))
+            if code is None:
+                return np.zeros(0, dtype=RECORD_DTYPE)
+        parts = []
+        for bin_path, index in self.segments():
+            if index["records"] == 0:
+                continue
+            if start is not None and index["end"] < start:
+                continue
+            if end is not None and index["start"] >= end:
+                continue
+            if code is not None and str(code) not in index["intersections"]:
+                continue
+            records = self.records(bin_path)
+            timestamps = records["timestamp"]
+            lo = 0 if start is None else np.searchsorted(timestamps, start, side="left")
+            hi = len(records) if end is None else np.searchsorted(timestamps, end, side="left")
+            selected = records[lo:hi]
+            if code is not None:
+                selected = selected[selected["intersection"] == code]
+            parts.append(np.array(selected))
+        if not parts:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.concatenate(parts)
+
+    def iter_traffic_data(self, records):
+        """Regroups records into (timestamp, traffic_data) pairs as written by log_congestion."""
+        if len(records) == 0:
+            return
+        boundaries = np.flatnonzero(np.diff(records["timestamp"])) + 1
+        for block in np.split(records, boundaries):
+            traffic_data = {}
+            for record in block:
+                roads = traffic_data.setdefault(self.ids[record["intersection"]], {})
+                roads[ROADS[record["road"]]] = {name: int(record[name]) for name in CLASSES}
+            yield float(block["timestamp"][0]), traffic_data
+
+class TextCongestionLog:
+    """The original congestion_log.txt format, used when the binary store is disabled."""
+    def __init__(self, path="congestion_log.txt"):
+        self.path = path
+
+    def append(self, traffic_data, current_time):
+        log_congestion(traffic_data, current_time)
+
+    def close(self):
+        # At session end, save a copy of the congestion log.
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        shutil.copy(self.path, f"session_log_{timestamp}.txt")
+        return f"session_log_{timestamp}.txt"
+
+def open_congestion_log(config):
+    if config.get("congestion_store", {}).get("enabled", False):
+        return CongestionStore.from_config(config)
+    return TextCongestionLog()
@@ -0,0 +1,219 @@
+import argparse
+import glob
+import os
+import shutil
+import sys
+import time
+import cv2
+import numpy as np
+from main import load_config
+from model import TorchBackend, BACKENDS, CONFIDENCE_THRESHOLD, exported_path, parse_boxes, letterbox, CLASS_NAMES
+
+def sample_frames(video_paths, count):
+    """Up to `count` frames spread evenly over the videos, at native resolution like main.py."""
+    frames = []
+    per_video = max(1, count // max(len(video_paths), 1))
+    for path in video_paths:
+        cap = cv2.VideoCapture(path)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or per_video
+        for index in np.linspace(0, total - 1, per_video).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ret, frame = cap.read()
+            if ret:
+                frames.append(frame)
+        cap.release()
+    return frames[:count]
+
+def export(weights, backend, imgsz):
+    """Exports the PyTorch weights with ultralytics and returns the exported model path."""
+    from ultralytics import YOLO
+    produced = YOLO(weights).export(format=backend, imgsz=imgsz, dynamic=True)
+    target = exported_path(weights, backend)
+    if backend == "openvino":
+        produced = os.path.join(produced, os.path.basename(target)) if os.path.isdir(produced) else produced
+    if os.path.abspath(produced) != os.path.abspath(target):
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        shutil.move(produced, target)
+    return target
+
+def calibration_batches(frames, imgsz, stride=32):
+    # The same letterboxing as the (dynamic) exported model gets at inference time, one frame per batch.
+    for frame in frames:
+        yield letterbox([frame], imgsz, stride)[0]
+
+def quantize_onnx(weights, frames, imgsz):
+    """Static INT8 (QDQ) quantization calibrated on frames from the sample videos."""
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    source = exported_path(weights, "onnx")
+    target = exported_path(weights, "onnx", int8=True)
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            import onnxruntime
+            self.input_name = onnxruntime.InferenceSession(source, providers=["CPUExecutionProvider"]) \
+                .get_inputs()[0].name
+            self.batches = calibration_batches(frames, imgsz)
+
+        def get_next(self):
+            batch = next(self.batches, None)
+            return None if batch is None else {self.input_name: batch}
+
+    # Keep the detection head's decoding (DFL, sigmoid, concat of boxes and
+    # scores) in float: quantizing pixel coordinates and scores together would
+    # wipe out the scores. Its convolutions are still quantized.
+    import onnx
+    graph = onnx.load(source).graph
+    head = max(int(node.name.split("/")[1].split(".")[1]) for node in graph.node
+               if node.name.startswith("/model."))
+    excluded = [node.name for node in graph.node
+                if node.name.startswith(f"/model.{head}/") and (node.op_type != "Conv" or "/dfl/" in node.name)]
+
+    prepared = target + ".prep.onnx"
+    try:
+        quant_pre_process(source, prepared)
+    except Exception as e:
+        # Symbolic shape inference does not always cope with dynamic axes; it is only an optimisation.
+        print(f"Skipping quantization pre-processing: {e}")
+        shutil.copy(source, prepared)
+    quantize_static(prepared, target, FrameReader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True,
+                    nodes_to_exclude=excluded)
+    os.remove(prepared)
+    return target
+
+def quantize_openvino(weights, frames, imgsz):
+    """INT8 post-training quantization with NNCF, calibrated on frames from the sample videos."""
+    import nncf
+    import openvino
+    source = exported_path(weights, "openvino")
+    target = exported_path(weights, "openvino", int8=True)
+    model = openvino.Core().read_model(source)
+    dataset = nncf.Dataset(list(calibration_batches(frames, imgsz)))
+    quantized = nncf.quantize(model, dataset, preset=nncf.QuantizationPreset.MIXED,
+                              subset_size=len(frames))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    openvino.save_model(quantized, target)
+    return target
+
+def iou_matrix(a, b):
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+def match(reference, candidate, iou_threshold=0.5):
+    """Greedy one-to-one matching of same-class boxes; returns the number of matches."""
+    if len(reference) == 0 or len(candidate) == 0:
+        return 0
+    corners = lambda d: np.stack([d["x1"], d["y1"], d["x2"], d["y2"]], axis=1).astype(np.float64)
+    ious = iou_matrix(corners(reference), corners(candidate))
+    ious[reference["class_id"][:, None] != candidate["class_id"][None, :]] = 0
+    matched = 0
+    while True:
+        r, c = np.unravel_index(ious.argmax(), ious.shape)
+        if ious[r, c] < iou_threshold:
+            return matched
+        matched += 1
+        ious[r, :] = 0
+        ious[:, c] = 0
+
+def validate(reference_backend, candidate_backend, frames, iou_threshold=0.5, conf=CONFIDENCE_THRESHOLD):
+    """Detection parity of candidate against reference on the given frames, plus timings."""
+    totals = {"reference": 0, "candidate": 0, "matched": 0, "same_counts": 0}
+    per_class = np.zeros((2, len(CLASS_NAMES)), dtype=np.int64)
+    timings = {"reference": 0.0, "candidate": 0.0}
+    for frame in frames:
+        detections = {}
+        for name, backend in (("reference", reference_backend), ("candidate", candidate_backend)):
+            start = time.perf_counter()
+            result = backend(frame)[0]
+            timings[name] += time.perf_counter() - start
+            detections[name] = parse_boxes(result.boxes, conf)
+        reference, candidate = detections["reference"], detections["candidate"]
+        totals["reference"] += len(reference)
+        totals["candidate"] += len(candidate)
+        totals["matched"] += match(reference, candidate, iou_threshold)
+        reference_counts = np.bincount(reference["class_id"], minlength=len(CLASS_NAMES))[:len(CLASS_NAMES)]
+        candidate_counts = np.bincount(candidate["class_id"], minlength=len(CLASS_NAMES))[:len(CLASS_NAMES)]
+        per_class += np.stack([reference_counts, candidate_counts])
+        totals["same_counts"] += int((reference_counts == candidate_counts).all())
+    n = max(len(frames), 1)
+    return {
+        **totals,
+        "frames": len(frames),
+        "recall": totals["matched"] / totals["reference"] if totals["reference"] else 1.0,
+        "precision": totals["matched"] / totals["candidate"] if totals["candidate"] else 1.0,
+        "same_counts": totals["same_counts"] / n,
+        "per_class": {CLASS_NAMES[i]: (int(per_class[0, i]), int(per_class[1, i])) for i in CLASS_NAMES},
+        "reference_ms": timings["reference"] * 1000 / n,
+        "candidate_ms": timings["candidate"] * 1000 / n
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export the detector to ONNX or OpenVINO (optionally INT8) and check parity with PyTorch.")
+    parser.add_argument("--config", default="config.json", help="Path to the configuration file.")
+    parser.add_argument("--format", choices=sorted(BACKENDS), help="Backend to export; defaults to detector.backend.")
+    parser.add_argument("--weights", help="PyTorch weights; defaults to detector.weights.")
+    parser.add_argument("--imgsz", type=int, help="Input size; defaults to detector.imgsz or 640.")
+    parser.add_argument("--int8", action="store_true", help="Also write an INT8-quantized model.")
+    parser.add_argument("--videos", default="data/*.mp4", help="Videos used for calibration and validation.")
+    parser.add_argument("--frames", type=int, default=60, help="Frames sampled for validation.")
+    parser.add_argument("--calibration-frames", type=int, default=100, help="Frames used for INT8 calibration.")
+    parser.add_argument("--threads", type=int, help="Inference threads of the exported backend.")
+    parser.add_argument("--min-recall", type=float, default=0.95, help="Required share of PyTorch boxes matched.")
+    parser.add_argument("--min-precision", type=float, default=0.95, help="Required share of exported boxes matched.")
+    parser.add_argument("--conf", type=float, default=CONFIDENCE_THRESHOLD,
+                        help="Confidence threshold of the compared detections (the pipeline uses 0.7).")
+    parser.add_argument("--validate-only", action="store_true", help="Skip the export and only validate.")
+    return parser.parse_args(argv)
+
+def run(args):
+    detector_config = load_config(args.config).get("detector", {}) if os.path.exists(args.config) else {}
+    backend = args.format or detector_config.get("backend")
+    if backend not in BACKENDS:
+        print("Choose an export format with --format (onnx or openvino).")
+        return 2
+    weights = args.weights or detector_config.get("weights", "models/best.pt")
+    imgsz = args.imgsz or detector_config.get("imgsz") or 640
+    threads = args.threads or detector_config.get("threads")
+    videos = sorted(glob.glob(args.videos))
+    if not videos:
+        print(f"No videos match {args.videos}.")
+        return 2
+
+    paths = [exported_path(weights, backend)]
+    if not args.validate_only:
+        print(f"Exporting {weights} to {backend} (imgsz={imgsz}) ...")
+        export(weights, backend, imgsz)
+        if args.int8:
+            print(f"Quantizing to INT8 on {args.calibration_frames} calibration frames ...")
+            calibration = sample_frames(videos, args.calibration_frames)
+            quantize = quantize_onnx if backend == "onnx" else quantize_openvino
+            quantize(weights, calibration, imgsz)
+    if args.int8:
+        paths.append(exported_path(weights, backend, int8=True))
+
+    frames = sample_frames(videos, args.frames)
+    reference = TorchBackend(weights, imgsz, threads)
+    failed = False
+    for path in paths:
+        candidate = BACKENDS[backend](path, imgsz, threads)
+        report = validate(reference, candidate, frames, conf=args.conf)
+        ok = report["recall"] >= args.min_recall and report["precision"] >= args.min_precision
+        failed |= not ok
+        print(f"{path}: {'PASS' if ok else 'FAIL'} on {report['frames']} frames")
+        print(f"  recall {report['recall']:.3f}  precision {report['precision']:.3f}  "
+              f"identical per-class counts on {report['same_counts']:.0%} of frames")
+        print(f"  boxes torch/{backend}: " + ", ".join(f"{name} {ref}/{cand}"
+                                                      for name, (ref, cand) in report["per_class"].items()))
+        print(f"  {report['reference_ms']:.1f} ms/frame torch, {report['candidate_ms']:.1f} ms/frame {backend}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -1,15 +1,23 @@
+# Imported first so that the startup profile covers the imports below.
+from startup import StartupProfiler, LazyComponent
+import argparse
 import cv2
 import json
+import os
 import time
-import datetime
 import asyncio
-import aiohttp
-import shutil
-from model import VehicleDetector
-from algorithm import optimize_intersections
-from utils import draw_roi, draw_detections, log_congestion
-from rl_agent import RLAgent
-from ml_predictor import MLModel
+import queue
+import signal
+import metrics
+from artifact_cache import ArtifactCache
+from congestion_store import open_congestion_log
+from model import create_detector
+from pipeline import Pipeline, END
+from processing import FramePacket, RoiCounter, SignalController
+from signal_codec import SignalLogger
+from utils import annotate_frame, scale_for_display, BackgroundVideoWriter
+
+DEFAULT_URL = "https://api.ibreakstuff.upayan.dev/"
 
 def load_config(path="config.json"):
     with open(path, "r") as f:
@@ -44,24 +52,107 @@ def compute_intersections_from_grid(grid_config, frame_width, frame_height):
             inter_id += 1
     return intersections
 
-async def send_data(session, url, data):
-    try:
-        async with session.post(url + "traffic/signal-data", json={"data": data}, timeout=5) as response:
-            if response.status == 204:
-                print("Data sent successfully")
-            else:
-                print(f"Failed to send data. Status code: {response.status}")
-                print(f"Response text: {await response.text()}")
-    except aiohttp.ClientConnectorError as e:
-        print(f"Connection error: {e}")
-    except asyncio.TimeoutError:
-        print("Request timed out")
-    except Exception as e:
-        print(f"An error occurred while sending data: {e}")
-
-async def main():
-    url = "https://api.ibreakstuff.upayan.dev/"
-    config = load_config("config.json")
+# torch and sklearn are imported inside the loaders so that they are only
+# paid for when the operation mode actually needs the DRL agent or ML model.
+def load_rl_agent(config, retrain=False, cache=None):
+    from rl_agent import RLAgent
+    # Trained models are reused from the artifact cache unless their training
+    # parameters or code changed, or retraining is requested explicitly.
+    cache = cache or ArtifactCache.from_config(config)
+
+    # Instantiate and (optionally) train the DRL agent.
+    rl_agent = RLAgent()
+    if config.get("train_rl_agent", False):
+        rl_params = {
+            "episodes": config.get("rl_training_episodes", 1000),
+            "num_envs": config.get("rl_num_envs", 16),
+            "environment": config.get("rl_environment", "random"),
+            "simulator": config.get("simulator", {}),
+            "target_update": config.get("rl_target_update", 100),
+            "input_dim": rl_agent.input_dim,
+            "output_dim": rl_agent.output_dim,
+            "gamma": rl_agent.gamma,
+            "epsilon": rl_agent.epsilon
+        }
+        key = cache.key("dqn", rl_params, ["rl_agent.py", "simulator.py"]) if cache else None
+        state = cache.load_torch("dqn", key) if cache and not retrain else None
+        if state is not None:
+            rl_agent.model.load_state_dict(state)
+            rl_agent.sync_target()
+            print(f"Loaded DRL agent from cache ({key}).")
+        else:
+            print("Training DRL Agent ...")
+            env = None
+            if rl_params["environment"] == "simulator":
+                # Queue simulation where actions have consequences, instead of random states.
+                from simulator import SimulatorEnv
+                env = SimulatorEnv(rl_params["num_envs"], config)
+            rl_agent.train_agent(episodes=rl_params["episodes"],
+                                 num_envs=rl_params["num_envs"],
+                                 target_update=rl_params["target_update"],
+                                 env=env)
+            print("DRL Training complete.")
+            if cache:
+                cache.save_torch("dqn", key, rl_agent.model.state_dict())
+    if config.get("rl_inference_only", False):
+        rl_agent.freeze()
+    return rl_agent
+
+def load_ml_model(config, retrain=False, cache=None):
+    from ml_predictor import MLModel
+    cache = cache or ArtifactCache.from_config(config)
+
+    # Instantiate and train the ML predictor.
+    ml_model = MLModel()
+    key = cache.key("green_time_regressor", {}, ["ml_predictor.py"]) if cache else None
+    regressor = cache.load_object("green_time_regressor", key) if cache and not retrain else None
+    if regressor is not None:
+        ml_model.model = regressor
+        ml_model.trained = True
+        print(f"Loaded ML predictor from cache ({key}).")
+    else:
+        ml_model.train_model()
+        if cache:
+            cache.save_object("green_time_regressor", key, ml_model.model)
+    return ml_model
+
+def create_models(config, retrain=False):
+    cache = ArtifactCache.from_config(config)
+    return load_rl_agent(config, retrain, cache), load_ml_model(config, retrain, cache)
+
+def create_lazy_models(config, retrain=False, profiler=None):
+    """
+    The DRL agent and ML model as LazyComponents keyed by operation mode.
+    With startup.lazy_models (the default) only the model of the initial mode
+    is loaded here; the other one is loaded in the background on the first
+    switch to its mode. Otherwise both are loaded up front.
+    """
+    models = {
+        "rl": LazyComponent("DRL agent", lambda: load_rl_agent(config, retrain), profiler),
+        "ml": LazyComponent("ML predictor", lambda: load_ml_model(config, retrain), profiler)
+    }
+    lazy = config.get("startup", {}).get("lazy_models", True)
+    for mode, component in models.items():
+        if not lazy or mode == config.get("operation_mode", "normal"):
+            component.load()
+    return models
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Intelligent Traffic Management System")
+    parser.add_argument("--config", default="config.json", help="Path to the configuration file.")
+    parser.add_argument("--headless", action="store_true", default=None,
+                        help="Run without a display window and skip all drawing.")
+    parser.add_argument("--preview-every", type=int, help="Annotate only one frame in N.")
+    parser.add_argument("--preview-video", help="Write annotated preview frames to this video file.")
+    parser.add_argument("--retrain", action="store_true", help="Retrain the DRL and ML models even if cached.")
+    return parser.parse_args(argv)
+
+async def main(args=None):
+    args = args or parse_args([])
+    config = load_config(args.config)
+    profiler = StartupProfiler(config.get("startup", {}).get("profile", True))
+    registry = metrics.configure(config)
+    url = config.get("uploader", {}).get("url", DEFAULT_URL)
     # Uncomment the following two lines if you want to use a video file.
     video_path = "data/sample_video8.mp4"
     cap = cv2.VideoCapture(video_path)
@@ -79,140 +170,178 @@ async def main():
     else:
         intersections_config = config.get("intersections", {})
 
-    detector = VehicleDetector()
-    scale_factor = 1.5
-    min_phase_duration = config.get("min_phase_duration", 5)  # minimum wait of 5 sec
-    last_phase_state = {}
-    last_phase_switch_time = {}
-    config["last_school_bus_green"] = config.get("last_school_bus_green", datetime.datetime.now())
-
-    # Initialize prediction data for each intersection.
-    prediction_data = {}
-    for inter_no, inter_data in intersections_config.items():
-        prediction_data[inter_no] = {}
-        for road_no in inter_data.get("roads", {}).keys():
-            prediction_data[inter_no][road_no] = {"car": 0, "ambulance": 0, "schoolbus": 0, "accident": 0}
-    alpha = config.get("prediction_alpha", 0.7)
-
-    # Instantiate and (optionally) train the DRL agent.
-    rl_agent = RLAgent()
-    if config.get("train_rl_agent", False):
-        print("Training DRL Agent ...")
-        rl_agent.train_agent(episodes=config.get("rl_training_episodes", 1000))
-        print("DRL Training complete.")
+    with profiler.stage("detector"):
+        detector = create_detector(config)
+    # Frames are processed at native resolution; only the display is scaled.
+    roi_counter = RoiCounter(detector, intersections_config, config)
 
-    # Instantiate and train the ML predictor.
-    ml_model = MLModel()
-    ml_model.train_model()
+    models = create_lazy_models(config, args.retrain, profiler)
+    controller = SignalController(config, intersections_config, models["rl"], models["ml"])
 
     # Define available modes and set the initial mode.
     modes = ["normal", "ml", "rl"]
     operation_mode = config.get("operation_mode", "normal")
     mode_index = modes.index(operation_mode)
 
-    async with aiohttp.ClientSession() as session:
-        while True:
+    # Capture, detection and decision run in their own threads connected by
+    # bounded queues; rendering and uploading stay on the event loop.
+    pipeline_config = config.get("pipeline", {})
+    # A file can be read at any pace, so none of its frames are dropped; live
+    # sources follow drop_policy and may skip frames to stay current.
+    drop_policy = "block" if isinstance(video_path, str) and os.path.isfile(video_path) \
+        else pipeline_config.get("drop_policy", "latest")
+    pipeline = Pipeline(pipeline_config.get("queue_size", 2), drop_policy)
+    if roi_counter.quality is not None:
+        roi_counter.quality.skip_late = drop_policy != "block"
+    stats_interval = pipeline_config.get("stats_interval", 10)
+    frame_index = 0
+
+    def capture():
+        nonlocal frame_index
+        with registry.timer("capture.read"):
             ret, frame = cap.read()
-            if not ret:
-                print("End of video stream.")
-                break
-            frame = cv2.resize(frame, None, fx=scale_factor, fy=scale_factor, interpolation=cv2.INTER_LINEAR)
-
-            # Gather traffic counts from each ROI.
-            traffic_data = {}
-            for inter_no, inter_data in intersections_config.items():
-                traffic_data[inter_no] = {}
-                for road_no, roi in inter_data.get("roads", {}).items():
-                    x, y, w, h = [int(coord * scale_factor) for coord in roi]
-                    if w <= 0 or h <= 0 or y < 0 or x < 0 or y+h > frame.shape[0] or x+w > frame.shape[1]:
-                        print(f"Skipping invalid ROI for Intersection {inter_no}, Road {road_no}")
-                        traffic_data[inter_no][road_no] = {"car": 0, "ambulance": 0, "schoolbus": 0, "accident": 0}
-                        continue
-                    roi_frame = frame[y:y+h, x:x+w]
-                    if roi_frame.size == 0:
-                        print(f"Empty ROI for Intersection {inter_no}, Road {road_no}")
-                        traffic_data[inter_no][road_no] = {"car": 0, "ambulance": 0, "schoolbus": 0, "accident": 0}
-                        continue
-                    detections = detector.detect_vehicles(roi_frame)
-                    counts = {"car": 0, "ambulance": 0, "schoolbus": 0, "accident": 0}
-                    for detection in detections:
-                        if detection['class'] in counts:
-                            counts[detection['class']] += 1
-                    traffic_data[inter_no][road_no] = counts
-                    draw_detections(roi_frame, detections)
-                    frame[y:y+h, x:x+w] = roi_frame
-
-                    # Update prediction data using an exponential moving average.
-                    prev_pred = prediction_data[inter_no][road_no]["car"]
-                    current_count = counts["car"]
-                    new_pred = alpha * current_count + (1 - alpha) * prev_pred
-                    prediction_data[inter_no][road_no]["car"] = new_pred
-
-            current_time = datetime.datetime.now()
-            # Call the optimization algorithm. Pass ml_model or rl_agent based on the current mode.
-            output_signals, computed_phases = optimize_intersections(
-                traffic_data, prediction_data, config, current_time,
-                rl_agent if operation_mode == "rl" else None,
-                ml_model if operation_mode == "ml" else None
-            )
-            current_time_sec = time.time()
-            final_phases = {}
-            for inter_no, new_phase in computed_phases.items():
-                if inter_no not in last_phase_state:
-                    last_phase_state[inter_no] = new_phase
-                    last_phase_switch_time[inter_no] = current_time_sec
-                    final_phases[inter_no] = new_phase
-                else:
-                    prev_phase = last_phase_state[inter_no]
-                    if new_phase != prev_phase:
-                        if current_time_sec - last_phase_switch_time[inter_no] >= min_phase_duration:
-                            last_phase_state[inter_no] = new_phase
-                            last_phase_switch_time[inter_no] = current_time_sec
-                            final_phases[inter_no] = new_phase
-                        else:
-                            final_phases[inter_no] = prev_phase
-                    else:
-                        final_phases[inter_no] = prev_phase
-
-            # Append the current mode to each output.
-            for signal in output_signals:
-                signal["mode"] = ( "DRL Optimized" if operation_mode == "rl"
-                                   else ("ML Predictive" if operation_mode == "ml" else "Normal") )
-
-            # Log congestion history every cycle.
-            log_congestion(traffic_data, current_time)
-            print(json.dumps(output_signals, indent=2))
-            asyncio.create_task(send_data(session, url, output_signals))
-
-            for inter_no, inter_data in intersections_config.items():
-                for road_no, roi in inter_data.get("roads", {}).items():
-                    x, y, w, h = [int(coord * scale_factor) for coord in roi]
-                    decision = next((item for item in output_signals if item["intersection"] == inter_no and item["road"] == road_no), None)
-                    signal = decision["signal"] if decision else "UNKNOWN"
-                    dynamic_duration = decision.get("dynamic_green_duration") if decision else None
-                    counts = traffic_data[inter_no].get(road_no, {"car": 0, "ambulance": 0, "schoolbus": 0, "accident": 0})
-                    mode = decision.get("mode", "Normal") if decision else "Normal"
-                    draw_roi(frame, (x, y, w, h), inter_no, road_no, counts, signal, dynamic_duration, mode)
-
-            cv2.imshow("Intelligent Traffic Management System", frame)
-            key = cv2.waitKey(30) & 0xFF
-            if key == ord('q'):
-                break
-            # Press 't' to cycle through the modes.
-            if key == ord('t'):
-                mode_index = (mode_index + 1) % len(modes)
-                operation_mode = modes[mode_index]
-                config["operation_mode"] = operation_mode  # update config for consistency
-                print(f"Operation Mode switched to {operation_mode}")
-            await asyncio.sleep(0)
-
-        # At session end, save a copy of the congestion log.
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        shutil.copy("congestion_log.txt", f"session_log_{timestamp}.txt")
-        print(f"Session log saved as session_log_{timestamp}.txt")
+        if not ret:
+            print("End of video stream.")
+            return END
+        frame_index += 1
+        return FramePacket(frame_index, frame)
+
+    pipeline.add_stage("capture", capture)
+    pipeline.add_stage("detection", roi_counter.process)
+    pipeline.add_stage("decision", controller.process)
+
+    # Display settings; CLI flags take precedence over config.json.
+    display_config = config.get("display", {})
+    headless = args.headless if args.headless is not None else display_config.get("headless", False)
+    preview_every = max(1, args.preview_every or display_config.get("preview_every", 1))
+    preview_video = args.preview_video or display_config.get("preview_video")
+    wait_ms = display_config.get("wait_ms", 30)
+    scale_factor = display_config.get("scale", 1.5)
+    show_window = not headless
+    writer = None
+    if preview_video:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        writer = BackgroundVideoWriter(preview_video, fps / preview_every)
+    rendered = 0
+    congestion_log = open_congestion_log(config)
+    signal_logger = SignalLogger.from_config(config)
+
+    with profiler.stage("uploader"):
+        import aiohttp
+        from uploader import TelemetryUploader
+
+    pipeline.start()
+    last_stats_time = time.time()
+
+    # SIGINT and SIGTERM end the loop like the end of the stream, so the
+    # session is still sealed and flushed; a second signal acts as before.
+    stop_requested = False
+
+    def request_stop(signum, frame):
+        nonlocal stop_requested
+        stop_requested = True
+        print(f"Received signal {signum}; stopping ...")
+        signal.signal(signum, previous_handlers[signum])
+    previous_handlers = {signum: signal.signal(signum, request_stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+
+    async with aiohttp.ClientSession() as session:
+        uploader = TelemetryUploader.from_config(session, url, config).start()
+        try:
+            while not stop_requested:
+                try:
+                    packet = await asyncio.to_thread(pipeline.output.get, 0.1)
+                except queue.Empty:
+                    continue
+                if packet is END:
+                    break
+                if not profiler.reported:
+                    profiler.report()
+                frame = packet.frame
+                traffic_data = packet.traffic_data
+                output_signals = packet.output_signals
+
+                # Log congestion history every cycle.
+                with registry.timer("log_congestion"):
+                    congestion_log.append(traffic_data, packet.current_time)
+                signal_logger.log(output_signals)
+                with registry.timer("upload.submit"):
+                    uploader.submit(output_signals)
+                registry.tick()
+                latency = time.time() - packet.captured_at
+                registry.observe("frame.latency", latency)
+                if roi_counter.quality is not None:
+                    # Time spent waiting for the detection stage is not the detector's to make up.
+                    roi_counter.quality.observe(packet.decided_at - packet.detection_started_at)
+
+                # Annotate and show only every preview_every-th frame; headless
+                # runs skip drawing and the GUI entirely.
+                rendered += 1
+                if (show_window or writer is not None) and rendered % preview_every == 0:
+                    with registry.timer("render.annotate"):
+                        frame = scale_for_display(frame, scale_factor)
+                        annotate_frame(frame, intersections_config, scale_factor, packet.crops,
+                                       packet.detections, traffic_data, output_signals)
+                    if writer is not None:
+                        writer.write(frame)
+                    if show_window:
+                        with registry.timer("render.display"):
+                            cv2.imshow("Intelligent Traffic Management System", frame)
+                            key = cv2.waitKey(wait_ms) & 0xFF
+                        if key == ord('q'):
+                            break
+                        # Press 't' to cycle through the modes.
+                        if key == ord('t'):
+                            mode_index = (mode_index + 1) % len(modes)
+                            operation_mode = modes[mode_index]
+                            config["operation_mode"] = operation_mode  # update config for consistency
+                            print(f"Operation Mode switched to {operation_mode}")
+                            if operation_mode in models:
+                                models[operation_mode].load_in_background()
+                if stats_interval and time.time() - last_stats_time >= stats_interval:
+                    print(f"Pipeline: {pipeline.format_stats()}")
+                    if roi_counter.motion_gate is not None:
+                        print(f"Motion gate: {roi_counter.motion_gate.format_stats()}")
+                    if roi_counter.tracker is not None:
+                        print(f"Tracking: {roi_counter.tracker.format_stats()}")
+                    if roi_counter.quality is not None:
+                        print(f"Quality: {roi_counter.quality.format_stats()}")
+                    if controller.optimizer is not None:
+                        print(f"Decisions: {controller.optimizer.format_stats()}")
+                    print(f"Uploader: {uploader.format_stats()}")
+                    if uploader.encoder is not None:
+                        print(f"Wire format: {uploader.encoder.format_stats()}")
+                    last_stats_time = time.time()
+                await asyncio.sleep(0)
+        finally:
+            pipeline.stop()
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            # At session end, seal the congestion history (or copy the text log),
+            # before anything else can fail or be interrupted.
+            saved = congestion_log.close()
+            if saved:
+                print(f"Session log saved as {saved}")
+            await uploader.close()
+            print(f"Uploader: {uploader.format_stats()}")
+            if uploader.encoder is not None:
+                print(f"Wire format: {uploader.encoder.format_stats()}")
+            print(f"Pipeline: {pipeline.format_stats()}")
+            if roi_counter.motion_gate is not None:
+                print(f"Motion gate: {roi_counter.motion_gate.format_stats()}")
+            if roi_counter.tracker is not None:
+                print(f"Tracking: {roi_counter.tracker.format_stats()}")
+            if roi_counter.quality is not None:
+                print(f"Quality: {roi_counter.quality.format_stats()}")
+            if controller.optimizer is not None:
+                print(f"Decisions: {controller.optimizer.format_stats()}")
+            registry.close()
     await asyncio.gather(*asyncio.all_tasks() - {asyncio.current_task()})
     cap.release()
-    cv2.destroyAllWindows()
+    if writer is not None:
+        writer.close()
+        print(f"Preview saved to {preview_video} ({writer.written} frames, {writer.dropped} dropped)")
+    if show_window:
+        cv2.destroyAllWindows()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(main(parse_args()))
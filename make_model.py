@@ -1,41 +1,37 @@
-import json
+import argparse
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score
 import joblib
+from training_data import CongestionAggregates
 
-def train_model():
-    try:
-        with open("congestion_data.json", "r") as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        print("Error: congestion_data.json not found. Make sure you run main.py first.")
-        return
-    except json.JSONDecodeError:
-        print("Error: congestion_data.json is not a valid JSON file.")
-        return
+def train_model(log_path="congestion_log.txt", store_path="congestion_store",
+                state_path="training_aggregates", rebuild=False):
+    # Bring the per-time-slot aggregates up to date with only the new log data.
+    aggregates = CongestionAggregates(state_path) if rebuild else CongestionAggregates.load(state_path)
+    new_lines = aggregates.ingest_text_log(log_path)
+    new_frames = aggregates.ingest_store(store_path)
+    aggregates.save()
+    print(f"Ingested {new_lines} new log lines and {new_frames} new stored frames.")
 
     # Prepare data for ML training.
-    model_data = []
-    for inter_no, time_data in data.items():
-        for time_slot, congestion_values in time_data.items():
-            # Use the average congestion or a sample of congestion based on the time that you have
-            avg_congestion = sum(congestion_values) / len(congestion_values)
-            model_data.append({
-                "intersection": inter_no,
-                "time_slot": time_slot,
-                "congestion": avg_congestion
-            })
-   
+    inter_ids, hours, minutes, congestion = aggregates.training_rows()
+    if len(congestion) < 2:
+        print("Error: not enough congestion history yet. Make sure you run main.py first.")
+        return
+
     #Convert to what the model can take into account
-    df = pd.DataFrame(model_data)
-     # Example: Extracting hour and minute as features
-    df['hour'] = df['time_slot'].apply(lambda x: int(x.split(':')[0]))
-    df['minute'] = df['time_slot'].apply(lambda x: int(x.split(':')[1]))
+    df = pd.DataFrame({
+        "intersection": inter_ids,
+        "hour": hours,
+        "minute": minutes,
+        "congestion": congestion
+    })
     #The higher the congestions means that you have to pass through other congestion, so we are creating that mapping
     X = df[["congestion","hour", "minute"]]
-    y = df["congestion"]
+    # The classifier needs discrete labels, so the average congestion is rounded to whole cars.
+    y = df["congestion"].round().astype(int)
     #Splitting the test to verify that the prediction is valid or not
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
     #Making the data structure the model can understand, it seems it has high variance.
@@ -51,4 +47,10 @@ def train_model():
     print ("Traffic model dumped")
 
 if __name__ == "__main__":
-    train_model()
+    parser = argparse.ArgumentParser(description="Train the congestion model from the logged history.")
+    parser.add_argument("--log", default="congestion_log.txt", help="Text congestion log written by log_congestion.")
+    parser.add_argument("--store", default="congestion_store", help="Binary congestion store directory.")
+    parser.add_argument("--state", default="training_aggregates", help="Where the incremental aggregates are kept.")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore saved aggregates and re-read all history.")
+    args = parser.parse_args()
+    train_model(args.log, args.store, args.state, args.rebuild)
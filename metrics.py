@@ -0,0 +1,242 @@
+import bisect
+import collections
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the Prometheus latency histogram buckets.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PREFIX = "traffic_"
+_NULL_TIMER = nullcontext()
+
+def escape(value):
+    """Label value escaped for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Histogram:
+    """Cumulative Prometheus buckets plus a rolling window of recent samples for percentiles."""
+    def __init__(self, window=1024):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = collections.deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def summary(self):
+        recent = sorted(self.recent)
+        if not recent:
+            return {"count": self.count}
+        pick = lambda q: recent[min(len(recent) - 1, int(q * len(recent)))] * 1000
+        return {"count": self.count, "mean_ms": round(self.sum / self.count * 1000, 3),
+                "p50_ms": round(pick(0.5), 3), "p95_ms": round(pick(0.95), 3),
+                "p99_ms": round(pick(0.99), 3), "max_ms": round(recent[-1] * 1000, 3)}
+
+class Timer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+class Metrics:
+    """
+    Thread-safe registry of stage latency histograms, counters and gauges.
+    Latencies are recorded with `timer(stage)` or `observe(stage, seconds)`,
+    counters with `inc(name, **labels)` and the frame rate with `tick()`.
+    """
+    enabled = True
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = collections.defaultdict(float)
+        self.gauges = {}
+        self.frame_times = collections.deque(maxlen=120)
+        self.started = time.time()
+        self.server = None
+        self.dump_thread = None
+        self.stop_event = threading.Event()
+
+    def timer(self, stage):
+        return Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram(self.window)
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def tick(self):
+        """Marks one processed frame; the fps gauge covers the last 120 frames."""
+        now = time.perf_counter()
+        with self.lock:
+            self.frame_times.append(now)
+            frames = len(self.frame_times)
+            if frames > 1:
+                self.gauges[("fps", ())] = (frames - 1) / (now - self.frame_times[0])
+
+    def count_detections(self, key, counts):
+        inter_no, road_no = key
+        for name, value in counts.items():
+            if value:
+                self.inc("roi_detections_total", value, intersection=inter_no, road=road_no, **{"class": name})
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "uptime_s": round(time.time() - self.started, 1),
+                "stages": {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in self.counters.items()],
+                "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                           for (name, labels), value in self.gauges.items()]
+            }
+
+    def prometheus(self):
+        def label_text(labels):
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+        lines = [f"# TYPE {PREFIX}stage_seconds histogram"]
+        with self.lock:
+            for stage, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), histogram.buckets):
+                    cumulative += count
+                    lines.append(f'{PREFIX}stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{PREFIX}stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{PREFIX}stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            for kind, values in (("counter", self.counters), ("gauge", self.gauges)):
+                # Every family's samples must directly follow its TYPE line.
+                families = collections.defaultdict(list)
+                for (name, labels), value in values.items():
+                    families[name].append((labels, value))
+                for name in sorted(families):
+                    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                    for labels, value in families[name]:
+                        lines.append(f"{PREFIX}{name}{label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host="127.0.0.1", port=9108):
+        """Serves /metrics (Prometheus text) and /metrics.json from a daemon thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = metrics.prometheus().encode(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(metrics.snapshot()).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"Metrics available at http://{host}:{self.server.server_address[1]}/metrics")
+
+    def dump(self, path):
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def start_dumping(self, path, interval=30.0):
+        def run():
+            while not self.stop_event.wait(interval):
+                self.dump(path)
+        self.dump_path = path
+        self.dump_thread = threading.Thread(target=run, name="metrics-dump", daemon=True)
+        self.dump_thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.dump_thread is not None:
+            self.dump(self.dump_path)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+class NullMetrics:
+    """Used while metrics are disabled: every call is a no-op."""
+    enabled = False
+
+    def timer(self, stage):
+        return _NULL_TIMER
+
+    def observe(self, stage, seconds):
+        pass
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def set_gauge(self, name, value, **labels):
+        pass
+
+    def tick(self):
+        pass
+
+    def count_detections(self, key, counts):
+        pass
+
+    def close(self):
+        pass
+
+# The process-wide registry; instrumented code calls metrics.registry.<method>.
+registry = NullMetrics()
+
+def configure(config):
+    """Installs the registry described by the "metrics" section of config.json."""
+    global registry
+    metrics_config = config.get("metrics", {})
+    if not metrics_config.get("enabled", False):
+        registry = NullMetrics()
+        return registry
+    registry = Metrics(metrics_config.get("window", 1024))
+    if metrics_config.get("port") is not None:
+        host = metrics_config.get("host", "127.0.0.1")
+        try:
+            registry.serve(host, metrics_config["port"])
+        except OSError as e:
+            # Diagnostics must never keep the controller from starting.
+            print(f"Warning: cannot serve metrics on {host}:{metrics_config['port']} ({e}); metrics disabled.")
+            registry = NullMetrics()
+            return registry
+    if metrics_config.get("json_path"):
+        registry.start_dumping(metrics_config["json_path"], metrics_config.get("dump_interval", 30.0))
+    return registry
@@ -2,10 +2,28 @@ import numpy as np
 from sklearn.linear_model import LinearRegression
 import datetime
 
+MIN_GREEN, MAX_GREEN = 10, 120
+
+def hour_of_day(current_time):
+    return current_time.hour + current_time.minute / 60.0
+
 class MLModel:
-    def __init__(self):
+    """
+    Predicts the optimal green time from [effective_count, hour].
+    predict_optimal_green_batch scores all intersections of a frame at once.
+    For a linear regressor it evaluates the fitted coefficients directly;
+    other regressors go through a lookup table per minute of the day over
+    effective counts quantized to `lut_step`, built on first use. Counts
+    beyond `lut_max_count` are predicted exactly.
+    """
+    def __init__(self, lut_step=0.25, lut_max_count=200):
         self.model = LinearRegression()
         self.trained = False
+        self.lut_step = lut_step
+        self.lut_max_count = lut_max_count
+        self.prepared_for = None
+        self.coefficients = None
+        self.lookup = {}
 
     def train_model(self):
         # Simulate historical data.
@@ -21,12 +39,49 @@ class MLModel:
             y[i] = optimal_green
         self.model.fit(X, y)
         self.trained = True
+        self.prepared_for = None
 
-    def predict_optimal_green(self, effective_count, current_time):
+    def prepare(self):
+        # Re-derive the fast path whenever the regressor was refitted or replaced.
         if not self.trained:
             self.train_model()
-        hour = current_time.hour + current_time.minute / 60.0
-        X_new = np.array([[effective_count, hour]])
-        prediction = self.model.predict(X_new)[0]
-        prediction = max(10, min(120, prediction))
-        return prediction
+        if self.prepared_for is self.model:
+            return
+        coef = getattr(self.model, "coef_", None)
+        if isinstance(self.model, LinearRegression) and coef is not None and np.ndim(coef) == 1:
+            self.coefficients = (float(coef[0]), float(coef[1]), float(self.model.intercept_))
+        else:
+            self.coefficients = None
+        self.lookup = {}
+        self.prepared_for = self.model
+
+    def lookup_column(self, minute, hour):
+        column = self.lookup.get(minute)
+        if column is None:
+            counts = np.arange(0, self.lut_max_count + self.lut_step, self.lut_step)
+            X = np.column_stack([counts, np.full(len(counts), hour)])
+            column = np.clip(self.model.predict(X), MIN_GREEN, MAX_GREEN)
+            self.lookup[minute] = column
+        return column
+
+    def predict_optimal_green_batch(self, effective_counts, current_time):
+        """Clamped green times for an array of effective counts at current_time."""
+        self.prepare()
+        counts = np.asarray(effective_counts, dtype=np.float64)
+        hour = hour_of_day(current_time)
+        if self.coefficients is not None:
+            count_coef, hour_coef, intercept = self.coefficients
+            return np.clip(counts * count_coef + (hour * hour_coef + intercept), MIN_GREEN, MAX_GREEN)
+        column = self.lookup_column(current_time.hour * 60 + current_time.minute, hour)
+        slots = np.rint(counts / self.lut_step).astype(np.int64)
+        in_table = (slots >= 0) & (slots < len(column))
+        predictions = np.empty(len(counts))
+        predictions[in_table] = column[slots[in_table]]
+        if not in_table.all():
+            outside = counts[~in_table]
+            X = np.column_stack([outside, np.full(len(outside), hour)])
+            predictions[~in_table] = np.clip(self.model.predict(X), MIN_GREEN, MAX_GREEN)
+        return predictions
+
+    def predict_optimal_green(self, effective_count, current_time):
+        return float(self.predict_optimal_green_batch([effective_count], current_time)[0])
@@ -1,26 +1,368 @@
 import cv2
 import os
-from ultralytics import YOLO
-import random
+import time
+import numpy as np
+import metrics
+from traffic_state import CLASSES
+
+CLASS_NAMES = {0: 'accident', 1: 'ambulance', 2: 'car', 3: 'schoolbus'}
+CLASS_IDS = {name: class_id for class_id, name in CLASS_NAMES.items()}
+AMBULANCE = 1
+CONFIDENCE_THRESHOLD = 0.7
+
+# One row per detected box. `speed` is only set for ambulances (0 otherwise).
+DETECTION_DTYPE = np.dtype([("x1", "<i4"), ("y1", "<i4"), ("x2", "<i4"), ("y2", "<i4"),
+                            ("confidence", "<f4"), ("class_id", "<u2"), ("speed", "<f4")])
+
+def empty_detections():
+    return np.zeros(0, dtype=DETECTION_DTYPE)
+
+def to_numpy(values):
+    # Ultralytics returns torch tensors (possibly on the GPU); stubs may use arrays.
+    if hasattr(values, "cpu"):
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+def parse_boxes(boxes, threshold=CONFIDENCE_THRESHOLD, rng=np.random):
+    """Filters and converts a whole Boxes object at once into a DETECTION_DTYPE array."""
+    if boxes is None or len(boxes) == 0:
+        return empty_detections()
+    conf = to_numpy(boxes.conf).reshape(-1)
+    keep = conf >= threshold
+    count = int(keep.sum())
+    detections = np.zeros(count, dtype=DETECTION_DTYPE)
+    if count == 0:
+        return detections
+    xyxy = to_numpy(boxes.xyxy).reshape(-1, 4)[keep].astype(np.int32)
+    detections["x1"], detections["y1"], detections["x2"], detections["y2"] = xyxy.T
+    detections["confidence"] = conf[keep]
+    detections["class_id"] = to_numpy(boxes.cls).reshape(-1)[keep]
+    ambulances = detections["class_id"] == AMBULANCE
+    detections["speed"][ambulances] = rng.uniform(40, 80, int(ambulances.sum()))
+    return detections
+
+def class_counts(detections):
+    """Per-class counts of a detection array, keyed like traffic_data."""
+    counts = np.bincount(detections["class_id"], minlength=len(CLASS_NAMES))
+    return {name: int(counts[CLASS_IDS[name]]) for name in CLASSES}
+
+def detections_to_dicts(detections):
+    """The former list-of-dicts detection format, for callers that still need it."""
+    result = []
+    for x1, y1, x2, y2, conf, class_id, speed in detections.tolist():
+        class_name = CLASS_NAMES.get(class_id, 'unknown')
+        detection = {'bbox': (x1, y1, x2, y2), 'confidence': conf, 'class': class_name}
+        if class_id == AMBULANCE:
+            detection["speed"] = speed
+        result.append(detection)
+    return result
+
+class RoiIndex:
+    """
+    The bounds of a fixed set of ROIs as one array, built once per frame size
+    so that `contains` tests all detection centres against all ROIs at once.
+    """
+    def __init__(self, rois, frame_shape):
+        self.rois = dict(rois)
+        self.keys = list(self.rois)
+        self.bounds = np.array([self.rois[key] for key in self.keys], dtype=np.int64).reshape(-1, 4)
+        self.frame_shape = tuple(frame_shape[:2])
+
+    def contains(self, px, py):
+        """Boolean matrix, ROIs x points, of which ROI contains which point."""
+        x, y, w, h = (self.bounds[:, i:i + 1] for i in range(4))
+        return (x <= px) & (px < x + w) & (y <= py) & (py < y + h)
+
+def exported_path(weights, backend, int8=False):
+    """Where export_model.py writes (and the detector looks for) an exported model."""
+    stem = os.path.splitext(weights)[0] + ("_int8" if int8 else "")
+    if backend == "onnx":
+        return stem + ".onnx"
+    if backend == "openvino":
+        return os.path.join(stem + "_openvino_model", os.path.basename(stem) + ".xml")
+    return weights
+
+class ArrayBoxes:
+    """Boxes of one image as NumPy arrays, shaped like ultralytics' Boxes."""
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy, self.conf, self.cls = xyxy, conf, cls
+
+    def __len__(self):
+        return len(self.conf)
+
+class ArrayResult:
+    def __init__(self, boxes, speed):
+        self.boxes = boxes
+        self.speed = speed
+
+class TorchBackend:
+    """The PyTorch model through ultralytics.YOLO, as before."""
+    name = "torch"
+
+    def __init__(self, weights, imgsz=None, threads=None):
+        # Imported here so that modules which only need RoiIndex or CLASS_NAMES
+        # do not pay for loading ultralytics and torch.
+        from ultralytics import YOLO
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.imgsz = imgsz
+        self.model = YOLO(weights)
+
+    def __call__(self, images):
+        if self.imgsz:
+            return self.model(images, imgsz=self.imgsz)
+        return self.model(images)
+
+    def set_imgsz(self, imgsz):
+        self.imgsz = imgsz
+        return True
+
+def letterbox(images, size, stride=None):
+    """
+    Letterboxes BGR images into one float32 RGB CHW batch: a `size` square,
+    or with `stride` the smallest stride-aligned rectangle that fits them.
+    Returns the batch and, per image, the (ratio, pad_x, pad_y, width, height)
+    needed to map boxes back.
+    """
+    scaled = []
+    for image in images:
+        height, width = image.shape[:2]
+        ratio = min(size / height, size / width)
+        scaled.append((ratio, round(width * ratio), round(height * ratio)))
+    if stride:
+        # Like ultralytics' rectangular inference: pad only up to the next
+        # multiple of the stride instead of to a full square.
+        batch_w = max(w + (size - w) % stride for _, w, _ in scaled)
+        batch_h = max(h + (size - h) % stride for _, _, h in scaled)
+    else:
+        batch_w = batch_h = size
+    batch = np.full((len(images), batch_h, batch_w, 3), 114, dtype=np.uint8)
+    transforms = []
+    for i, (image, (ratio, new_w, new_h)) in enumerate(zip(images, scaled)):
+        # Same rounding as ultralytics' LetterBox, so boxes map back identically.
+        pad_x, pad_y = round((batch_w - new_w) / 2 - 0.1), round((batch_h - new_h) / 2 - 0.1)
+        resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR) if ratio != 1 else image
+        batch[i, pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+        transforms.append((ratio, pad_x, pad_y, image.shape[1], image.shape[0]))
+    # BGR HWC uint8 -> RGB CHW float in [0, 1].
+    batch = batch[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255.0, transforms
+
+class ExportedBackend:
+    """
+    Runs an exported YOLO detection model without ultralytics. Images are
+    letterboxed to `imgsz` (a square for static exports, the smallest
+    stride-aligned rectangle for dynamic ones) and batched; raw outputs
+    (batch x (4 + classes) x anchors) are decoded and go through per-class
+    NMS, while end-to-end exports (batch x boxes x 6) are used as they are.
+    Results mimic ultralytics' so the rest of VehicleDetector is unchanged.
+    """
+    name = None
+
+    def __init__(self, imgsz=640, conf=0.25, iou=0.7, max_det=300, stride=32):
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+        self.stride = stride
+        self.fixed_batch = None
+        self.dynamic = False
+
+    def __call__(self, images):
+        images = images if isinstance(images, list) else [images]
+        start = time.perf_counter()
+        batch, transforms = self.preprocess(images)
+        preprocessed = time.perf_counter()
+        if self.fixed_batch:
+            outputs = np.concatenate([self.infer(batch[i:i + self.fixed_batch])
+                                      for i in range(0, len(batch), self.fixed_batch)])
+        else:
+            outputs = self.infer(batch)
+        inferred = time.perf_counter()
+        boxes = [self.postprocess(output, transform) for output, transform in zip(outputs, transforms)]
+        done = time.perf_counter()
+        # Per-image milliseconds, as ultralytics reports them.
+        n = len(images)
+        speed = {"preprocess": (preprocessed - start) * 1000 / n, "inference": (inferred - preprocessed) * 1000 / n,
+                 "postprocess": (done - inferred) * 1000 / n}
+        return [ArrayResult(image_boxes, speed) for image_boxes in boxes]
+
+    def set_imgsz(self, imgsz):
+        # Static exports only accept the size they were exported with.
+        if not self.dynamic:
+            return False
+        self.imgsz = imgsz
+        return True
+
+    def preprocess(self, images):
+        return letterbox(images, self.imgsz, self.stride if self.dynamic else None)
+
+    def postprocess(self, output, transform):
+        if output.ndim == 2 and output.shape[-1] == 6:
+            # End-to-end export: x1, y1, x2, y2, confidence, class, already suppressed.
+            keep = output[:, 4] >= self.conf
+            xyxy, conf, cls = output[keep, :4], output[keep, 4], output[keep, 5]
+        else:
+            predictions = output.T
+            scores = predictions[:, 4:]
+            cls = scores.argmax(axis=1)
+            conf = scores[np.arange(len(cls)), cls]
+            keep = conf >= self.conf
+            xywh, conf, cls = predictions[keep, :4], conf[keep], cls[keep]
+            xyxy = np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1)
+            if len(conf):
+                boxes = np.concatenate([xyxy[:, :2], xyxy[:, 2:] - xyxy[:, :2]], axis=1)
+                selected = cv2.dnn.NMSBoxesBatched(boxes.tolist(), conf.tolist(), cls.tolist(),
+                                                   self.conf, self.iou, top_k=self.max_det)
+                selected = np.asarray(selected, dtype=np.int64).reshape(-1)
+                xyxy, conf, cls = xyxy[selected], conf[selected], cls[selected]
+        ratio, pad_x, pad_y, width, height = transform
+        xyxy = (xyxy - [pad_x, pad_y, pad_x, pad_y]) / ratio
+        xyxy = np.clip(xyxy, 0, [width, height, width, height])
+        return ArrayBoxes(xyxy.astype(np.float32), conf.astype(np.float32), cls.astype(np.float32))
+
+class OnnxBackend(ExportedBackend):
+    name = "onnx"
+
+    def __init__(self, path, imgsz=640, threads=None, **kwargs):
+        super().__init__(imgsz, **kwargs)
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        if isinstance(model_input.shape[0], int):
+            self.fixed_batch = model_input.shape[0]
+        if isinstance(model_input.shape[2], int):
+            # Static exports only accept the size they were exported with.
+            self.imgsz = model_input.shape[2]
+        else:
+            self.dynamic = True
+
+    def infer(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+class OpenVinoBackend(ExportedBackend):
+    name = "openvino"
+
+    def __init__(self, path, imgsz=640, threads=None, **kwargs):
+        super().__init__(imgsz, **kwargs)
+        import openvino
+        core = openvino.Core()
+        model = core.read_model(path)
+        model_input = model.inputs[0].get_partial_shape()
+        if model_input[0].is_static:
+            self.fixed_batch = model_input[0].get_length()
+        if model_input[2].is_static:
+            self.imgsz = model_input[2].get_length()
+        else:
+            self.dynamic = True
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        self.model = core.compile_model(model, "CPU", config)
+        self.output = self.model.output(0)
+
+    def infer(self, batch):
+        return self.model(batch)[self.output]
+
+BACKENDS = {"onnx": OnnxBackend, "openvino": OpenVinoBackend}
+
+def create_backend(detector_config):
+    """
+    Builds the inference backend named in the "detector" section of
+    config.json: "torch" (default), "onnx" or "openvino", optionally the
+    INT8 variant written by export_model.py.
+    """
+    backend = detector_config.get("backend", "torch")
+    weights = detector_config.get("weights", "models/best.pt")
+    imgsz = detector_config.get("imgsz")
+    threads = detector_config.get("threads")
+    if backend == "torch":
+        return TorchBackend(os.path.join(os.getcwd(), weights), imgsz, threads)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown detector backend '{backend}'")
+    path = exported_path(weights, backend, detector_config.get("int8", False))
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run export_model.py --format {backend} first")
+    return BACKENDS[backend](path, imgsz or 640, threads,
+                             conf=detector_config.get("conf", 0.25), iou=detector_config.get("iou", 0.7))
+
+def create_detector(config):
+    return VehicleDetector(backend=create_backend(config.get("detector", {})))
 
 class VehicleDetector:
-    def __init__(self, model_path='models/best.pt'):
+    # Source of the simulated ambulance speeds; a Generator makes them reproducible.
+    rng = np.random
+
+    def __init__(self, model_path='models/best.pt', backend=None):
         self.model_path = os.path.join(os.getcwd(), model_path)
-        self.model = YOLO(self.model_path)
+        self.model = backend if backend is not None else TorchBackend(self.model_path)
+
+    def set_input_size(self, imgsz):
+        """Changes the inference size where the backend allows it; returns whether it did."""
+        set_imgsz = getattr(self.model, "set_imgsz", None)
+        return bool(set_imgsz and set_imgsz(imgsz))
+
+    def run_model(self, images):
+        results = self.model(images)
+        registry = metrics.registry
+        if registry.enabled and results:
+            # Ultralytics reports per-image milliseconds for each stage.
+            speed = getattr(results[0], "speed", None) or {}
+            for stage in ("preprocess", "inference", "postprocess"):
+                registry.observe("detector." + stage, speed.get(stage, 0.0) * len(results) / 1000)
+        return results
+
     def detect_vehicles(self, frame):
-        results = self.model(frame)
-        detections = []
-        for result in results:
-            for box in result.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                conf = float(box.conf[0])
-                cls = int(box.cls[0])
-                class_names = {0: 'accident', 1: 'ambulance', 2: 'car', 3: 'schoolbus'}
-                class_name = class_names.get(cls, 'unknown')
-                if conf < 0.7:
-                    continue
-                detection = {'bbox': (x1, y1, x2, y2), 'confidence': conf, 'class': class_name}
-                if class_name == "ambulance":
-                    detection["speed"] = random.uniform(40, 80)
-                detections.append(detection)
-        return detections
+        results = self.run_model(frame)
+        with metrics.registry.timer("detector.parse"):
+            return self._parse_results(results)
+
+    def detect_batch(self, crops):
+        """
+        Runs a single inference call over all ROI crops of a frame.
+        `crops` maps a key such as (intersection, road) to its image; the result
+        maps the same keys to the detections of that crop.
+        """
+        keys = list(crops.keys())
+        if not keys:
+            return {}
+        results = self.run_model([crops[key] for key in keys])
+        with metrics.registry.timer("detector.parse"):
+            return {key: parse_boxes(result.boxes, rng=self.rng) for key, result in zip(keys, results)}
+
+    def detect_full_frame(self, frame, roi_index):
+        """
+        Runs one pass over the whole frame and assigns each box to the ROIs that
+        contain its centre. Boxes are returned in ROI-local coordinates, clipped
+        to the ROI, so they can be drawn on the crop like per-ROI detections.
+        """
+        results = self.run_model(frame)
+        with metrics.registry.timer("detector.parse"):
+            return self._assign_to_rois(self._parse_results(results), roi_index)
+
+    def _assign_to_rois(self, detections, roi_index):
+        cx = (detections["x1"] + detections["x2"]) / 2
+        cy = (detections["y1"] + detections["y2"]) / 2
+        inside = roi_index.contains(cx, cy)
+        assigned = {}
+        for r, key in enumerate(roi_index.keys):
+            x, y, w, h = roi_index.bounds[r]
+            local = detections[inside[r]]
+            local["x1"] = np.maximum(local["x1"] - x, 0)
+            local["y1"] = np.maximum(local["y1"] - y, 0)
+            local["x2"] = np.minimum(local["x2"] - x, w)
+            local["y2"] = np.minimum(local["y2"] - y, h)
+            assigned[key] = local
+        return assigned
+
+    def _parse_results(self, results):
+        parsed = [parse_boxes(result.boxes, rng=self.rng) for result in results]
+        if len(parsed) == 1:
+            return parsed[0]
+        return np.concatenate(parsed) if parsed else empty_detections()
@@ -0,0 +1,51 @@
+import cv2
+import numpy as np
+
+class MotionGate:
+    """
+    Cheap per-ROI change detector used to skip inference on static ROIs.
+    Each crop is reduced to a small grayscale thumbnail and compared with the
+    thumbnail taken the last time that ROI went through the detector, so slow
+    changes still add up until they cross the threshold.
+    """
+    def __init__(self, threshold=4.0, thumbnail_size=32, refresh_interval=15):
+        self.threshold = threshold
+        self.thumbnail_size = thumbnail_size
+        # Force a detection after this many consecutive skipped frames so that
+        # ambulances and accidents are never missed for long.
+        self.refresh_interval = refresh_interval
+        self.reference = {}
+        self.skipped_in_row = {}
+        self.stats = {}
+
+    def thumbnail(self, crop):
+        if crop.ndim == 3:
+            crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        size = (self.thumbnail_size, self.thumbnail_size)
+        return cv2.resize(crop, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def needs_detection(self, key, crop):
+        thumb = self.thumbnail(crop)
+        stats = self.stats.setdefault(key, {"checked": 0, "skipped": 0})
+        stats["checked"] += 1
+        reference = self.reference.get(key)
+        skipped = self.skipped_in_row.get(key, 0)
+        if (reference is None or skipped >= self.refresh_interval
+                or np.abs(thumb - reference).mean() > self.threshold):
+            self.reference[key] = thumb
+            self.skipped_in_row[key] = 0
+            return True
+        self.skipped_in_row[key] = skipped + 1
+        stats["skipped"] += 1
+        return False
+
+    def skip_ratio(self):
+        checked = sum(s["checked"] for s in self.stats.values())
+        skipped = sum(s["skipped"] for s in self.stats.values())
+        return skipped / checked if checked else 0.0
+
+    def format_stats(self):
+        busiest = sorted(self.stats.items(), key=lambda item: item[1]["skipped"] - item[1]["checked"])[:3]
+        detail = ", ".join(f"I{inter_no} {road_no} {s['skipped']}/{s['checked']}"
+                           for (inter_no, road_no), s in busiest)
+        return f"skipped {self.skip_ratio():.0%} of ROI detections (least skipped: {detail})"
@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import datetime
+import multiprocessing as mp
+import os
+import queue
+import time
+import aiohttp
+import cv2
+from algorithm import get_adjacent_ids
+from congestion_store import open_congestion_log
+from main import DEFAULT_URL, load_config, compute_intersections_from_grid, create_models
+from processing import FramePacket, RoiCounter, SignalController
+from uploader import TelemetryUploader
+
+def parse_source(source):
+    # Camera indices are given as plain integers, everything else is a path or URL.
+    return int(source) if str(source).isdigit() else source
+
+def put_latest(slot, item, attempts=10):
+    """Puts item into a one-item queue, replacing the one the aggregator has not read yet."""
+    for _ in range(attempts):
+        try:
+            slot.put_nowait(item)
+            return True
+        except queue.Full:
+            try:
+                slot.get_nowait()
+            except queue.Empty:
+                time.sleep(0.001)
+    return False
+
+def camera_worker(source_index, source, config, slot, stop_event, num_threads):
+    """
+    Runs in its own process: reads one video source, detects vehicles in every
+    ROI and keeps its latest per-road counts in its own slot for the aggregator.
+    """
+    from model import create_detector
+    if config.get("detector", {}).get("backend", "torch") == "torch":
+        import torch
+        torch.set_num_threads(num_threads)
+    cv2.setNumThreads(1)
+
+    cap = cv2.VideoCapture(parse_source(source))
+    if not cap.isOpened():
+        print(f"Camera {source_index}: could not open {source}")
+        put_latest(slot, (source_index, None, None, None))
+        return
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    intersections_config = compute_intersections_from_grid(config["grid"], frame_width, frame_height)
+    # Exported backends get the same per-worker thread budget as torch.
+    detector_config = dict(config.get("detector", {}))
+    detector_config["threads"] = detector_config.get("threads") or num_threads
+    detector = create_detector(dict(config, detector=detector_config))
+    roi_counter = RoiCounter(detector, intersections_config, config)
+
+    frame_index = 0
+    while not stop_event.is_set():
+        ret, frame = cap.read()
+        if not ret:
+            print(f"Camera {source_index}: end of stream.")
+            break
+        frame_index += 1
+        packet = roi_counter.process(FramePacket(frame_index, frame))
+        if roi_counter.quality is not None:
+            roi_counter.quality.observe(time.time() - packet.detection_started_at)
+        # Only the newest counts matter; a slow source never loses them to faster ones.
+        put_latest(slot, (source_index, time.time(), packet.traffic_data, list(packet.crops.keys())))
+    cap.release()
+    put_latest(slot, (source_index, None, None, None))
+
+class MultiCameraRunner:
+    """
+    Starts one detection process per video source and merges their counts
+    into a single optimize_intersections call on a fixed decision interval.
+    Intersection ids are renumbered globally: source k owns ids
+    k * rows * cols + 1 ... (k + 1) * rows * cols. Sources that stop
+    reporting for longer than stale_after seconds are left out of the merge
+    so one slow or dead stream never holds back the others.
+    """
+    def __init__(self, sources, config):
+        self.sources = list(sources)
+        self.config = config
+        runner_config = config.get("multi_camera", {})
+        self.decision_interval = runner_config.get("decision_interval", 0.5)
+        self.stale_after = runner_config.get("stale_after", 5.0)
+        self.num_threads = runner_config.get("threads_per_worker") or max(1, (os.cpu_count() or 1) // len(self.sources))
+        self.per_source = config["grid"]["rows"] * config["grid"]["cols"]
+        self.latest = {}
+        self.finished = set()
+        self.stale = set()
+
+        # Every source uses the same grid, so global ROIs and adjacency only
+        # need an id offset per source. Grid sizes are nominal here; the real
+        # ROI geometry is computed by each worker from its own frame size.
+        local_config = compute_intersections_from_grid(config["grid"], 1, 1)
+        rows, cols = config["grid"]["rows"], config["grid"]["cols"]
+        self.intersections_config = {}
+        adjacency = {}
+        for source_index in range(len(self.sources)):
+            for local_id, inter_data in local_config.items():
+                global_id = self.global_id(source_index, local_id)
+                self.intersections_config[global_id] = inter_data
+                adjacency[global_id] = [self.global_id(source_index, adj)
+                                        for adj in get_adjacent_ids(int(local_id), rows, cols)]
+        self.decision_config = dict(config)
+        self.decision_config["adjacency"] = adjacency
+
+    def global_id(self, source_index, local_id):
+        return str(source_index * self.per_source + int(local_id))
+
+    def drain(self, slots):
+        for slot in slots:
+            try:
+                source_index, timestamp, traffic_data, keys = slot.get_nowait()
+            except queue.Empty:
+                continue
+            if timestamp is None:
+                self.finished.add(source_index)
+                self.latest.pop(source_index, None)
+            else:
+                self.latest[source_index] = (timestamp, traffic_data, keys)
+
+    def merge(self, now):
+        traffic_data = {}
+        keys = []
+        for source_index, (timestamp, source_data, source_keys) in self.latest.items():
+            if now - timestamp > self.stale_after:
+                if source_index not in self.stale:
+                    print(f"Camera {source_index}: no data for {now - timestamp:.1f}s, leaving it out.")
+                    self.stale.add(source_index)
+                continue
+            self.stale.discard(source_index)
+            for local_id, roads in source_data.items():
+                traffic_data[self.global_id(source_index, local_id)] = roads
+            keys.extend((self.global_id(source_index, local_id), road_no) for local_id, road_no in source_keys)
+        return traffic_data, keys
+
+    async def run(self, url):
+        rl_agent, ml_model = create_models(self.config)
+        controller = SignalController(self.decision_config, self.intersections_config, rl_agent, ml_model)
+        congestion_log = open_congestion_log(self.config)
+
+        ctx = mp.get_context("spawn")
+        # One latest-value slot per source, so sources cannot crowd each other out.
+        slots = [ctx.Queue(maxsize=1) for _ in self.sources]
+        stop_event = ctx.Event()
+        workers = []
+        for source_index, source in enumerate(self.sources):
+            first_id = self.global_id(source_index, 1)
+            last_id = self.global_id(source_index, self.per_source)
+            print(f"Camera {source_index}: {source} -> intersections {first_id}..{last_id}")
+            worker = ctx.Process(target=camera_worker, name=f"camera-{source_index}",
+                                 args=(source_index, source, self.config, slots[source_index], stop_event,
+                                       self.num_threads),
+                                 daemon=True)
+            worker.start()
+            workers.append(worker)
+
+        async with aiohttp.ClientSession() as session:
+            uploader = TelemetryUploader.from_config(session, url, self.config).start()
+            try:
+                while len(self.finished) < len(workers):
+                    await asyncio.sleep(self.decision_interval)
+                    self.drain(slots)
+                    for source_index, worker in enumerate(workers):
+                        # A clean exit is reported through the queue; anything else is a crash.
+                        if worker.exitcode not in (None, 0) and source_index not in self.finished:
+                            print(f"Camera {source_index}: worker exited with code {worker.exitcode}.")
+                            self.finished.add(source_index)
+                            self.latest.pop(source_index, None)
+                    traffic_data, keys = self.merge(time.time())
+                    if not traffic_data:
+                        continue
+                    current_time = datetime.datetime.now()
+                    controller.update_predictions(traffic_data, keys)
+                    output_signals, _ = controller.decide(traffic_data, current_time)
+                    congestion_log.append(traffic_data, current_time)
+                    print(f"Decision over {len(traffic_data)} intersections from "
+                          f"{len(self.latest) - len(self.stale)}/{len(workers)} cameras")
+                    uploader.submit(output_signals)
+            finally:
+                stop_event.set()
+                for worker in workers:
+                    worker.join(timeout=5)
+                    if worker.is_alive():
+                        worker.terminate()
+                await uploader.close()
+                print(f"Uploader: {uploader.format_stats()}")
+                saved = congestion_log.close()
+                if saved:
+                    print(f"Session log saved as {saved}")
+            await asyncio.gather(*asyncio.all_tasks() - {asyncio.current_task()})
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the traffic controller over several cameras at once.")
+    parser.add_argument("sources", nargs="*", help="Video files, stream URLs or camera indices.")
+    parser.add_argument("--config", default="config.json", help="Path to the configuration file.")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = load_config(args.config)
+    sources = args.sources or config.get("multi_camera", {}).get("sources", [])
+    if not sources:
+        print("Error: no video sources given.")
+    else:
+        asyncio.run(MultiCameraRunner(sources, config).run(config.get("uploader", {}).get("url", DEFAULT_URL)))
@@ -0,0 +1,146 @@
+import collections
+import queue
+import threading
+import time
+import metrics
+
+# Marks the end of the stream; always forwarded, never dropped.
+END = object()
+
+class BoundedQueue:
+    """
+    Fixed-capacity queue between two pipeline stages.
+    With the "latest" policy a full queue drops its oldest item so consumers
+    always work on the newest frame; with "block" producers wait for space.
+    """
+    def __init__(self, name, maxsize=2, policy="latest"):
+        if policy not in ("latest", "block"):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.put_count = 0
+        self.dropped = 0
+
+    def put(self, item, stop_event=None):
+        with self.cond:
+            if self.policy == "latest" or item is END:
+                while item is not END and len(self.items) >= self.maxsize:
+                    self.items.popleft()
+                    self.dropped += 1
+            else:
+                while len(self.items) >= self.maxsize:
+                    if stop_event is not None and stop_event.is_set():
+                        return False
+                    self.cond.wait(0.1)
+            self.items.append(item)
+            self.put_count += 1
+            self.cond.notify_all()
+        return True
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items, timeout):
+                raise queue.Empty
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    def __len__(self):
+        return len(self.items)
+
+class Stage(threading.Thread):
+    """
+    Worker thread running `func` on every item of `in_queue` and forwarding
+    the result to `out_queue`. A stage without an input queue is a source:
+    `func()` is called repeatedly and returns END when the stream is over.
+    Returning None from `func` drops the item.
+    """
+    def __init__(self, name, func, in_queue=None, out_queue=None, stop_event=None):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.stop_event = stop_event or threading.Event()
+        self.processed = 0
+        self.busy_time = 0.0
+        self.error = None
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                if self.in_queue is None:
+                    start = time.perf_counter()
+                    item = self.func()
+                else:
+                    try:
+                        item = self.in_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if item is END:
+                        break
+                    start = time.perf_counter()
+                    item = self.func(item)
+                if item is END:
+                    break
+                elapsed = time.perf_counter() - start
+                self.busy_time += elapsed
+                self.processed += 1
+                metrics.registry.observe("stage." + self.name, elapsed)
+                if item is not None and self.out_queue is not None:
+                    self.out_queue.put(item, self.stop_event)
+        except Exception as e:
+            self.error = e
+            print(f"Pipeline stage '{self.name}' failed: {e}")
+        if self.out_queue is not None:
+            self.out_queue.put(END)
+
+class Pipeline:
+    """
+    Chain of stages connected by bounded queues. The first stage added is the
+    source; results of the last stage are read from `pipeline.output`, which
+    always blocks so nothing the last stage produced is dropped.
+    """
+    def __init__(self, queue_size=2, policy="latest"):
+        self.queue_size = queue_size
+        self.policy = policy
+        self.stop_event = threading.Event()
+        self.stages = []
+        self.queues = []
+        self.output = None
+
+    def add_stage(self, name, func):
+        out_queue = BoundedQueue(name, self.queue_size, self.policy)
+        stage = Stage(name, func, self.output, out_queue, self.stop_event)
+        self.stages.append(stage)
+        self.queues.append(out_queue)
+        self.output = out_queue
+        return stage
+
+    def start(self):
+        if self.output is not None:
+            self.output.policy = "block"
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        for stage in self.stages:
+            stage.join(timeout)
+
+    def stats(self):
+        stats = {}
+        for stage, out_queue in zip(self.stages, self.queues):
+            stats[stage.name] = {
+                "processed": stage.processed,
+                "busy_ms": round(stage.busy_time / max(stage.processed, 1) * 1000, 2),
+                "queue_depth": len(out_queue),
+                "dropped": out_queue.dropped
+            }
+        return stats
+
+    def format_stats(self):
+        return " | ".join(f"{name}: done={s['processed']} avg={s['busy_ms']}ms depth={s['queue_depth']} dropped={s['dropped']}"
+                          for name, s in self.stats().items())
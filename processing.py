@@ -0,0 +1,266 @@
+import time
+import datetime
+import cv2
+import metrics
+from model import RoiIndex, class_counts, empty_detections
+from motion import MotionGate
+from tracker import TrackerBank
+from quality import QualityController
+from algorithm import optimize_intersections, IncrementalOptimizer
+from startup import LazyComponent
+
+def empty_counts():
+    return {"car": 0, "ambulance": 0, "schoolbus": 0, "accident": 0}
+
+class FramePacket:
+    """State of one frame as it travels through the pipeline stages."""
+    def __init__(self, index, frame):
+        self.index = index
+        self.frame = frame
+        self.captured_at = time.time()
+        self.detection_started_at = None
+        self.crops = {}
+        self.detections = {}
+        self.traffic_data = None
+        self.output_signals = None
+        self.phases = None
+        self.current_time = None
+        self.decided_at = None
+        self.flow = None
+
+class RoiCounter:
+    """
+    Turns a frame into per-road vehicle counts using the ROIs of every
+    intersection. ROIs are in native frame coordinates and are cropped as
+    views of the captured frame; their validity is checked once per frame
+    size. Detection runs through VehicleDetector in the configured
+    detection_mode ("batch", "full_frame" or "per_roi"); with roi_scale != 1
+    only the crops are resized for the detector. When the motion gate is
+    enabled, ROIs whose pixels have not changed reuse their last counts.
+    With tracking enabled, counts come from per-ROI tracks that are updated
+    whenever the detector runs on an ROI (every few frames, see TrackerBank)
+    and propagated in between. With quality control enabled, the detector
+    input size, the frames it runs on and the ROIs it refreshes per frame
+    follow the latency budget (see QualityController).
+    """
+    def __init__(self, detector, intersections_config, config):
+        self.detector = detector
+        self.intersections_config = intersections_config
+        self.detection_mode = config.get("detection_mode", "batch")
+        self.roi_scale = config.get("roi_scale", 1.0)
+        gate_config = config.get("motion_gate", {})
+        self.motion_gate = None
+        if gate_config.get("enabled", False):
+            self.motion_gate = MotionGate(gate_config.get("threshold", 4.0),
+                                          gate_config.get("thumbnail_size", 32),
+                                          gate_config.get("refresh_interval", 15))
+        tracking_config = config.get("tracking", {})
+        self.tracker = TrackerBank(tracking_config) if tracking_config.get("enabled", False) else None
+        quality_config = config.get("quality", {})
+        self.quality = QualityController.from_config(config) if quality_config.get("enabled", False) else None
+        self.last_counts = {}
+        self.last_detections = {}
+        self.rois = {(inter_no, road_no): roi
+                     for inter_no, inter_data in intersections_config.items()
+                     for road_no, roi in inter_data.get("roads", {}).items()}
+        self.frame_shape = None
+        self.crops = {}
+        self.slices = {}
+        self.roi_index = None
+
+    def update_layout(self, frame_shape):
+        """Validates the ROIs against a new frame size and precomputes their slices."""
+        height, width = frame_shape[:2]
+        self.crops = {}
+        self.slices = {}
+        for (inter_no, road_no), roi in self.rois.items():
+            x, y, w, h = [int(coord) for coord in roi]
+            if w <= 0 or h <= 0 or y < 0 or x < 0 or y+h > height or x+w > width:
+                print(f"Skipping invalid ROI for Intersection {inter_no}, Road {road_no}")
+                continue
+            self.crops[(inter_no, road_no)] = (x, y, w, h)
+            self.slices[(inter_no, road_no)] = (slice(y, y+h), slice(x, x+w))
+        self.roi_index = RoiIndex(self.crops, frame_shape) if self.detection_mode == "full_frame" else None
+        self.frame_shape = frame_shape[:2]
+
+    def detect_crops(self, views):
+        """Runs the detector on the given crops, resized by roi_scale if it is not 1."""
+        scale = self.roi_scale
+        if scale != 1:
+            views = {key: cv2.resize(view, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+                     for key, view in views.items()}
+        if self.detection_mode == "batch":
+            detections_by_roi = self.detector.detect_batch(views)
+        else:
+            detections_by_roi = {key: self.detector.detect_vehicles(view) for key, view in views.items()}
+        if scale != 1:
+            # Back to native crop coordinates.
+            for detections in detections_by_roi.values():
+                for field in ("x1", "y1", "x2", "y2"):
+                    detections[field] = detections[field] / scale
+        return detections_by_roi
+
+    def process(self, packet):
+        packet.detection_started_at = time.time()
+        frame = packet.frame
+        if self.frame_shape != frame.shape[:2]:
+            self.update_layout(frame.shape)
+        views = {key: frame[rows, cols] for key, (rows, cols) in self.slices.items()}
+
+        # Only ROIs that are due for detection, fit the quality level's share
+        # and changed since their last detection go to the detector.
+        pending = views
+        if self.tracker is not None:
+            pending = {key: view for key, view in views.items() if self.tracker.due(key, packet.index)}
+        if self.quality is not None:
+            self.quality.apply(self.detector)
+            if self.quality.skip_detection(packet):
+                pending = {}
+            elif self.detection_mode != "full_frame":
+                pending = self.quality.select(pending, len(views), packet.index)
+        if self.motion_gate is not None:
+            with metrics.registry.timer("detection.motion_gate"):
+                pending = {key: view for key, view in pending.items()
+                           if self.motion_gate.needs_detection(key, view)}
+
+        # Run detection for every pending ROI, either as one full-frame pass,
+        # as a single batched call, or one call per ROI.
+        if not pending:
+            detections_by_roi = {}
+        elif self.detection_mode == "full_frame":
+            detections_by_roi = self.detector.detect_full_frame(frame, self.roi_index)
+        else:
+            detections_by_roi = self.detect_crops(pending)
+
+        for key, detections in detections_by_roi.items():
+            counts = class_counts(detections)
+            self.last_counts[key] = counts
+            self.last_detections[key] = detections
+            metrics.registry.count_detections(key, counts)
+
+        if self.tracker is not None:
+            with metrics.registry.timer("detection.track"):
+                for key, (x, y, w, h) in self.crops.items():
+                    tracked = self.tracker.update(key, (w, h), packet.index, packet.captured_at,
+                                                  detections_by_roi.get(key))
+                    self.last_counts[key] = class_counts(tracked)
+                    self.last_detections[key] = tracked
+                packet.flow = self.tracker.flow(self.intersections_config, packet.captured_at)
+            if metrics.registry.enabled:
+                for inter_no, inter_flow in packet.flow.items():
+                    for phase, phase_flow in inter_flow["phases"].items():
+                        metrics.registry.set_gauge("phase_queue_length", phase_flow["queue_length"],
+                                                   intersection=inter_no, phase=phase)
+                        metrics.registry.set_gauge("phase_throughput_per_min", phase_flow["throughput"],
+                                                   intersection=inter_no, phase=phase)
+
+        traffic_data = {inter_no: {} for inter_no in self.intersections_config}
+        for key in self.rois:
+            inter_no, road_no = key
+            # ROIs the detector has not reached yet (skipped or deferred frames) count as empty.
+            counts = self.last_counts.get(key) if key in self.crops else None
+            traffic_data[inter_no][road_no] = dict(counts) if counts is not None else empty_counts()
+
+        packet.crops = self.crops
+        packet.detections = {key: self.last_detections.get(key, empty_detections()) for key in self.crops}
+        packet.traffic_data = traffic_data
+        return packet
+
+class SignalController:
+    """
+    Keeps the predicted counts and the phase hysteresis state between frames
+    and runs optimize_intersections for the current operation mode.
+    The RL agent and ML model may be LazyComponents; until the one the mode
+    needs is ready, decisions are made in normal mode. With
+    incremental_decisions, only intersections whose inputs changed are
+    decided again each frame.
+    """
+    def __init__(self, config, intersections_config, rl_agent=None, ml_model=None):
+        self.config = config
+        self.rl_agent = rl_agent
+        self.ml_model = ml_model
+        self.alpha = config.get("prediction_alpha", 0.7)
+        self.min_phase_duration = config.get("min_phase_duration", 5)  # minimum wait of 5 sec
+        self.last_phase_state = {}
+        self.last_phase_switch_time = {}
+        self.waiting_for = None
+        self.optimizer = IncrementalOptimizer(config) if config.get("incremental_decisions", False) else None
+        config["last_school_bus_green"] = config.get("last_school_bus_green", datetime.datetime.now())
+
+        # Initialize prediction data for each intersection.
+        self.prediction_data = {}
+        for inter_no, inter_data in intersections_config.items():
+            self.prediction_data[inter_no] = {}
+            for road_no in inter_data.get("roads", {}).keys():
+                self.prediction_data[inter_no][road_no] = empty_counts()
+
+    def update_predictions(self, traffic_data, keys):
+        # Update prediction data using an exponential moving average.
+        alpha = self.alpha
+        for inter_no, road_no in keys:
+            prev_pred = self.prediction_data[inter_no][road_no]["car"]
+            current_count = traffic_data[inter_no][road_no]["car"]
+            predicted = alpha * current_count + (1 - alpha) * prev_pred
+            # Snap to the count once the average has converged, so that the
+            # prediction of a steady road stops changing (see IncrementalOptimizer).
+            if abs(predicted - current_count) < 1e-9:
+                predicted = float(current_count)
+            self.prediction_data[inter_no][road_no]["car"] = predicted
+
+    def resolve_mode(self, operation_mode):
+        """Returns the mode to run this frame with and the model it uses."""
+        model = {"rl": self.rl_agent, "ml": self.ml_model}.get(operation_mode)
+        if isinstance(model, LazyComponent):
+            if not model.ready:
+                if self.waiting_for != operation_mode:
+                    print(f"{model.name} is not ready yet; using normal mode until it is.")
+                    self.waiting_for = operation_mode
+                return "normal", None
+            self.waiting_for = None
+            model = model.get()
+        return operation_mode, model
+
+    def decide(self, traffic_data, current_time=None, current_time_sec=None):
+        operation_mode, model = self.resolve_mode(self.config.get("operation_mode", "normal"))
+        current_time = current_time or datetime.datetime.now()
+        # Call the optimization algorithm. Pass ml_model or rl_agent based on the current mode.
+        rl_agent = model if operation_mode == "rl" else None
+        ml_model = model if operation_mode == "ml" else None
+        if self.optimizer is not None:
+            output_signals, computed_phases = self.optimizer.optimize(
+                traffic_data, self.prediction_data, current_time, rl_agent, ml_model, operation_mode)
+        else:
+            output_signals, computed_phases = optimize_intersections(
+                traffic_data, self.prediction_data, self.config, current_time, rl_agent, ml_model, operation_mode)
+        current_time_sec = time.time() if current_time_sec is None else current_time_sec
+        final_phases = {}
+        for inter_no, new_phase in computed_phases.items():
+            if inter_no not in self.last_phase_state:
+                self.last_phase_state[inter_no] = new_phase
+                self.last_phase_switch_time[inter_no] = current_time_sec
+                final_phases[inter_no] = new_phase
+            else:
+                prev_phase = self.last_phase_state[inter_no]
+                if new_phase != prev_phase:
+                    if current_time_sec - self.last_phase_switch_time[inter_no] >= self.min_phase_duration:
+                        self.last_phase_state[inter_no] = new_phase
+                        self.last_phase_switch_time[inter_no] = current_time_sec
+                        final_phases[inter_no] = new_phase
+                    else:
+                        final_phases[inter_no] = prev_phase
+                else:
+                    final_phases[inter_no] = prev_phase
+
+        # Append the current mode to each output.
+        for signal in output_signals:
+            signal["mode"] = ( "DRL Optimized" if operation_mode == "rl"
+                               else ("ML Predictive" if operation_mode == "ml" else "Normal") )
+        return output_signals, final_phases
+
+    def process(self, packet):
+        self.update_predictions(packet.traffic_data, packet.crops.keys())
+        packet.current_time = datetime.datetime.now()
+        with metrics.registry.timer("decision.optimize"):
+            packet.output_signals, packet.phases = self.decide(packet.traffic_data, packet.current_time)
+        packet.decided_at = time.time()
+        return packet
@@ -0,0 +1,164 @@
+import collections
+import math
+import time
+import numpy as np
+import metrics
+
+# From full quality (level 0) to the cheapest. imgsz None keeps the detector's own input size.
+DEFAULT_LEVELS = [
+    {"imgsz": None, "frame_stride": 1, "roi_fraction": 1.0},
+    {"imgsz": 512, "frame_stride": 1, "roi_fraction": 1.0},
+    {"imgsz": 416, "frame_stride": 1, "roi_fraction": 0.5},
+    {"imgsz": 320, "frame_stride": 1, "roi_fraction": 0.5},
+    {"imgsz": 320, "frame_stride": 2, "roi_fraction": 0.25},
+    {"imgsz": 256, "frame_stride": 3, "roi_fraction": 0.25}
+]
+
+class QualityController:
+    """
+    Keeps the frame latency (from the start of detection to the decision)
+    under target_ms by moving along a ladder of quality levels, full quality
+    being level 0. A level sets the detector input size, the frame stride
+    (the detector runs on one frame in frame_stride, the others reuse or
+    propagate the last counts) and the share of ROIs refreshed per frame,
+    least recently refreshed first.
+    After every `window` frames the latency percentile is compared with the
+    target (earlier, as soon as enough frames were late for the percentile
+    to be over it whatever follows): above it the controller steps down a
+    level (two above overload x target), and after recover_windows windows
+    under headroom x target it steps back up one. A step up that misses the
+    target in its first window doubles the windows needed before the next
+    one, so a level that cannot be sustained is not retried every few
+    seconds. With skip_late, frames already older than the target when
+    detection starts skip the detector (at most max_skipped in a row), so
+    signal decisions keep their cadence while the controller catches up;
+    sources read under the block policy turn it off, as every frame of
+    those gets the detector it is due.
+    """
+    def __init__(self, target_ms=200.0, levels=None, window=30, percentile=90, headroom=0.6, overload=1.5,
+                 recover_windows=3, max_skipped=5, full_imgsz=640, skip_late=True):
+        self.target = target_ms / 1000.0
+        self.levels = levels or DEFAULT_LEVELS
+        self.percentile = percentile
+        self.headroom = headroom
+        self.overload = overload
+        self.recover_windows = recover_windows
+        self.max_skipped = max_skipped
+        self.skip_late = skip_late
+        self.full_imgsz = full_imgsz
+        self.level = 0
+        self.latencies = collections.deque(maxlen=max(1, window))
+        self.late_frames = 0
+        self.good_windows = 0
+        self.needed_windows = recover_windows
+        self.probation = False
+        self.skipped = 0
+        self.applied_imgsz = None
+        self.last_refresh = {}
+        self.stats = {"frames": 0, "strided": 0, "late": 0, "deferred": 0, "adjustments": 0}
+
+    @classmethod
+    def from_config(cls, config):
+        quality_config = config.get("quality", {})
+        return cls(target_ms=quality_config.get("target_ms", 200.0),
+                   levels=quality_config.get("levels"),
+                   window=quality_config.get("window", 30),
+                   percentile=quality_config.get("percentile", 90),
+                   headroom=quality_config.get("headroom", 0.6),
+                   overload=quality_config.get("overload", 1.5),
+                   recover_windows=quality_config.get("recover_windows", 3),
+                   max_skipped=quality_config.get("max_skipped", 5),
+                   full_imgsz=config.get("detector", {}).get("imgsz") or 640)
+
+    def settings(self):
+        return self.levels[self.level]
+
+    def imgsz(self):
+        return self.settings().get("imgsz") or self.full_imgsz
+
+    def describe(self):
+        settings = self.settings()
+        return (f"imgsz {self.imgsz()}, frame stride {settings.get('frame_stride', 1)}, "
+                f"{settings.get('roi_fraction', 1.0):.0%} of ROIs per frame")
+
+    def observe(self, latency):
+        """Records the latency of a finished frame; adjusts the level at the end of a window."""
+        self.latencies.append(latency)
+        self.late_frames += latency > self.target
+        window = self.latencies.maxlen
+        if len(self.latencies) < window and self.late_frames <= window * (1 - self.percentile / 100):
+            return None
+        measured = float(np.percentile(self.latencies, self.percentile))
+        # The next window measures the level chosen now.
+        self.latencies.clear()
+        self.late_frames = 0
+        probation, self.probation = self.probation, False
+        if measured > self.target:
+            self.good_windows = 0
+            if probation:
+                self.needed_windows = min(self.needed_windows * 2, 64 * self.recover_windows)
+            return self.set_level(self.level + (2 if measured > self.overload * self.target else 1), measured)
+        if probation:
+            self.needed_windows = self.recover_windows
+        if measured < self.headroom * self.target:
+            self.good_windows += 1
+            if self.good_windows >= self.needed_windows:
+                self.good_windows = 0
+                self.probation = self.set_level(self.level - 1, measured) is not None
+                return self.level if self.probation else None
+        else:
+            self.good_windows = 0
+        return None
+
+    def set_level(self, level, measured):
+        level = min(max(level, 0), len(self.levels) - 1)
+        if level == self.level:
+            return None
+        previous, self.level = self.level, level
+        self.stats["adjustments"] += 1
+        metrics.registry.set_gauge("quality_level", level)
+        print(f"Quality: level {previous} -> {level} (p{self.percentile} latency {measured * 1000:.0f} ms, "
+              f"target {self.target * 1000:.0f} ms): {self.describe()}")
+        return level
+
+    def apply(self, detector):
+        """Sets the detector input size of the current level, if it changed."""
+        imgsz = self.imgsz()
+        if imgsz != self.applied_imgsz:
+            if not detector.set_input_size(imgsz) and self.applied_imgsz is None:
+                print("Quality: the detector has a fixed input size; only stride and ROIs are adapted.")
+            self.applied_imgsz = imgsz
+
+    def skip_detection(self, packet):
+        """Whether this frame skips the detector: it is off the stride, or already late."""
+        self.stats["frames"] += 1
+        skip = None
+        if packet.index % self.settings().get("frame_stride", 1):
+            skip = "strided"
+        elif (self.skip_late and time.time() - packet.captured_at > self.target
+              and self.skipped < self.max_skipped):
+            skip = "late"
+        if skip is None:
+            self.skipped = 0
+            return False
+        self.stats[skip] += 1
+        self.skipped += 1
+        return True
+
+    def select(self, pending, roi_count, frame_index):
+        """The share of the pending ROIs refreshed this frame, least recently refreshed first."""
+        limit = max(1, math.ceil(self.settings().get("roi_fraction", 1.0) * roi_count))
+        if len(pending) > limit:
+            keys = sorted(pending, key=lambda key: self.last_refresh.get(key, -1))[:limit]
+            self.stats["deferred"] += len(pending) - limit
+            pending = {key: pending[key] for key in keys}
+        for key in pending:
+            self.last_refresh[key] = frame_index
+        return pending
+
+    def format_stats(self):
+        frames = max(self.stats["frames"], 1)
+        return (f"level {self.level} ({self.describe()}), detector skipped on "
+                f"{(self.stats['strided'] + self.stats['late']) / frames:.0%} of frames "
+                f"({self.stats['late']} late), {self.stats['deferred']} ROI refreshes deferred, "
+                f"{self.stats['adjustments']} adjustments")
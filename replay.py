@@ -0,0 +1,167 @@
+import argparse
+import datetime
+import json
+import os
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from congestion_store import open_congestion_log
+from main import load_config, compute_intersections_from_grid, load_rl_agent, load_ml_model
+from processing import FramePacket, RoiCounter, SignalController
+from traffic_state import CLASSES
+
+# Detector of the current worker process, built once by init_worker.
+_worker = None
+
+def init_worker(config, intersections_config, threads):
+    global _worker
+    from model import create_detector
+    cv2.setNumThreads(1)
+    detector_config = dict(config.get("detector", {}))
+    detector_config["threads"] = detector_config.get("threads") or threads
+    detector = create_detector(dict(config, detector=detector_config))
+    _worker = (config, intersections_config, detector)
+
+def process_segment(path, start, end, overlap, fps):
+    """
+    Runs frames [start, end) of the video through RoiCounter in a worker.
+    Decoding starts `overlap` frames earlier so the motion gate and tracker
+    are warmed up at the segment boundary; those frames are not returned.
+    Returns the first frame, the ROI keys, which of them are valid and the
+    counts as an array shaped frames x ROIs x CLASSES.
+    """
+    config, intersections_config, detector = _worker
+    # Offline there is no latency budget: every frame gets full quality.
+    config = dict(config, quality=dict(config.get("quality", {}), enabled=False))
+    roi_counter = RoiCounter(detector, intersections_config, config)
+    keys = list(roi_counter.rois)
+    counts = np.zeros((end - start, len(keys), len(CLASSES)), dtype=np.uint16)
+    first = max(0, start - overlap)
+    cap = cv2.VideoCapture(path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+    read = 0
+    for index in range(first, end):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        packet = FramePacket(index + 1, frame)
+        # Video time, so that tracker throughput is per minute of footage.
+        packet.captured_at = index / fps
+        roi_counter.process(packet)
+        if index >= start:
+            traffic_data = packet.traffic_data
+            counts[index - start] = [[traffic_data[inter_no][road_no][name] for name in CLASSES]
+                                     for inter_no, road_no in keys]
+            read += 1
+    cap.release()
+    return start, keys, [key in roi_counter.crops for key in keys], counts[:read]
+
+def split_frames(total, segment_frames):
+    return [(start, min(start + segment_frames, total)) for start in range(0, total, segment_frames)]
+
+class Replay:
+    """
+    Offline replay of a recorded video as fast as the machine allows.
+    The video is cut into frame ranges that worker processes decode (seeking
+    to their first frame) and run through detection in parallel. Their counts
+    are merged back in frame order, and the decision pass runs sequentially
+    over them on video time, so phase hysteresis behaves as it would live.
+    Counts go to the congestion log, decisions optionally to a JSON lines file.
+    """
+    def __init__(self, path, config, workers=None, segment_frames=None, overlap=None, start_time=None):
+        self.path = path
+        self.config = config
+        replay_config = config.get("replay", {})
+        self.workers = workers or replay_config.get("workers") or os.cpu_count() or 1
+        self.segment_frames = segment_frames or replay_config.get("segment_frames")
+        self.overlap = overlap if overlap is not None else replay_config.get("overlap", 30)
+        self.start_time = start_time or datetime.datetime.now()
+
+    def probe(self):
+        cap = cv2.VideoCapture(self.path)
+        if not cap.isOpened():
+            raise IOError(f"Could not open {self.path}")
+        info = (int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), cap.get(cv2.CAP_PROP_FPS) or 30.0,
+                int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        cap.release()
+        return info
+
+    def create_controller(self, intersections_config):
+        operation_mode = self.config.get("operation_mode", "normal")
+        rl_agent = load_rl_agent(self.config) if operation_mode == "rl" else None
+        ml_model = load_ml_model(self.config) if operation_mode == "ml" else None
+        self.config["last_school_bus_green"] = self.start_time
+        return SignalController(self.config, intersections_config, rl_agent, ml_model)
+
+    def run(self, decisions_path=None):
+        total, fps, width, height = self.probe()
+        if "grid" in self.config:
+            intersections_config = compute_intersections_from_grid(self.config["grid"], width, height)
+        else:
+            intersections_config = self.config.get("intersections", {})
+        # A few segments per worker keep every core busy until the end.
+        segment_frames = self.segment_frames or max(300, -(-total // (self.workers * 4)))
+        segments = split_frames(total, segment_frames)
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        print(f"Replaying {self.path}: {total} frames at {fps:.1f} fps in {len(segments)} segments "
+              f"on {self.workers} workers")
+
+        controller = self.create_controller(intersections_config)
+        congestion_log = open_congestion_log(self.config)
+        decisions = open(decisions_path, "w") if decisions_path else None
+        started = time.time()
+        frames = 0
+        try:
+            with ProcessPoolExecutor(self.workers, mp_context=mp.get_context("spawn"), initializer=init_worker,
+                                     initargs=(self.config, intersections_config, threads)) as pool:
+                futures = [pool.submit(process_segment, self.path, start, end, self.overlap, fps)
+                           for start, end in segments]
+                # Segments are consumed in order while later ones are still running.
+                for future in futures:
+                    start, keys, valid, counts = future.result()
+                    valid_keys = [key for key, ok in zip(keys, valid) if ok]
+                    for offset, frame_counts in enumerate(counts.tolist()):
+                        seconds = (start + offset) / fps
+                        current_time = self.start_time + datetime.timedelta(seconds=seconds)
+                        traffic_data = {inter_no: {} for inter_no in intersections_config}
+                        for (inter_no, road_no), values in zip(keys, frame_counts):
+                            traffic_data[inter_no][road_no] = dict(zip(CLASSES, values))
+                        controller.update_predictions(traffic_data, valid_keys)
+                        output_signals, _ = controller.decide(traffic_data, current_time,
+                                                              self.start_time.timestamp() + seconds)
+                        congestion_log.append(traffic_data, current_time)
+                        if decisions is not None:
+                            decisions.write(json.dumps({"frame": start + offset, "timestamp": current_time.isoformat(),
+                                                        "signals": output_signals}) + "\n")
+                    frames += len(counts)
+                    elapsed = time.time() - started
+                    print(f"Replayed frames {start}..{start + len(counts)} "
+                          f"({frames / fps / max(elapsed, 1e-9):.1f}x real time)")
+        finally:
+            if decisions is not None:
+                decisions.close()
+            saved = congestion_log.close()
+            if saved:
+                print(f"Session log saved as {saved}")
+        elapsed = time.time() - started
+        print(f"Replayed {frames} frames ({frames / fps:.0f}s of video) in {elapsed:.1f}s")
+        return frames
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded video offline, in parallel segments.")
+    parser.add_argument("video", help="Recorded video file.")
+    parser.add_argument("--config", default="config.json", help="Path to the configuration file.")
+    parser.add_argument("--workers", type=int, help="Worker processes; defaults to replay.workers or the CPU count.")
+    parser.add_argument("--segment-frames", type=int, help="Frames per segment; by default about four per worker.")
+    parser.add_argument("--overlap", type=int, help="Warm-up frames decoded before each segment.")
+    parser.add_argument("--start", type=datetime.datetime.fromisoformat,
+                        help="Wall-clock time of the first frame (ISO format); defaults to now.")
+    parser.add_argument("--decisions", help="Write the decisions of every frame to this JSON lines file.")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    Replay(args.video, load_config(args.config), args.workers, args.segment_frames,
+           args.overlap, args.start).run(args.decisions)
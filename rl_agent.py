@@ -1,3 +1,6 @@
+import copy
+import time
+import warnings
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -16,35 +19,86 @@ class DQN(nn.Module):
         x = torch.relu(self.fc2(x))
         return self.fc3(x)
 
-class ReplayBuffer:
-    def __init__(self, capacity=10000):
+class ArrayReplayBuffer:
+    """
+    Replay buffer backed by preallocated NumPy arrays used as a ring buffer.
+    Whole batches of transitions are written and sampled without building
+    Python tuples.
+    """
+    def __init__(self, capacity=10000, state_dim=4):
         self.capacity = capacity
-        self.buffer = []
+        self.states = np.zeros((capacity, state_dim), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros((capacity, state_dim), dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.float32)
         self.position = 0
-    
+        self.size = 0
+
     def push(self, state, action, reward, next_state, done):
-        if len(self.buffer) < self.capacity:
-            self.buffer.append(None)
-        self.buffer[self.position] = (state, action, reward, next_state, done)
-        self.position = (self.position + 1) % self.capacity
-    
+        self.push_batch(np.asarray(state)[None], np.asarray([action]), np.asarray([reward]),
+                        np.asarray(next_state)[None], np.asarray([done]))
+
+    def push_batch(self, states, actions, rewards, next_states, dones):
+        n = len(states)
+        idx = (self.position + np.arange(n)) % self.capacity
+        self.states[idx] = states
+        self.actions[idx] = actions
+        self.rewards[idx] = rewards
+        self.next_states[idx] = next_states
+        self.dones[idx] = dones
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
     def sample(self, batch_size):
-        return random.sample(self.buffer, batch_size)
-    
+        idx = np.random.randint(0, self.size, batch_size)
+        return self.states[idx], self.actions[idx], self.rewards[idx], self.next_states[idx], self.dones[idx]
+
     def __len__(self):
-        return len(self.buffer)
+        return self.size
+
+class RandomTrafficEnv:
+    """
+    The original training environment, stepped for many copies at once:
+    every step draws new random queue lengths, weather and connectivity, and
+    the reward penalises the queue left waiting on red.
+    """
+    def __init__(self, num_envs=1, seed=None):
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed)
+        self.states = None
+
+    def sample(self):
+        n = self.num_envs
+        return np.column_stack([self.rng.integers(0, 21, n), self.rng.integers(0, 21, n),
+                                self.rng.random(n), self.rng.random(n)]).astype(np.float32)
+
+    def reset(self):
+        self.states = self.sample()
+        return self.states
+
+    def step(self, actions):
+        ns, ew, weather = self.states[:, 0], self.states[:, 1], self.states[:, 2]
+        rewards = np.where(actions == 0, -(ew + weather * 2), -(ns + weather * 2))
+        self.states = self.sample()
+        return self.states, rewards, np.zeros(self.num_envs, dtype=np.float32)
 
 class DeepRLAgent:
-    def __init__(self, input_dim=4, output_dim=2, lr=1e-3, gamma=0.9, epsilon=0.2):
+    def __init__(self, input_dim=4, output_dim=2, lr=1e-3, gamma=0.9, epsilon=0.2, inference_only=False):
         self.input_dim = input_dim
         self.output_dim = output_dim
         self.gamma = gamma
         self.epsilon = epsilon
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.model = DQN(input_dim, output_dim).to(self.device)
+        self.target_model = copy.deepcopy(self.model)
         self.optimizer = optim.Adam(self.model.parameters(), lr=lr)
-        self.replay_buffer = ReplayBuffer(capacity=10000)
+        self.replay_buffer = ArrayReplayBuffer(capacity=10000, state_dim=input_dim)
         self.batch_size = 32
+        # Inference-only agents act greedily and may use a frozen TorchScript model.
+        self.inference_only = inference_only
+        self.inference_model = None
+        self.input_buffer = None
     
     def choose_action(self, state):
         if random.random() < self.epsilon:
@@ -54,53 +108,126 @@ class DeepRLAgent:
             q_values = self.model(state_tensor)
         return int(torch.argmax(q_values).item())
     
-    def update(self):
+    def choose_actions(self, states):
+        """Epsilon-greedy actions for a batch of states with one forward pass."""
+        state_tensor = torch.as_tensor(states, dtype=torch.float32, device=self.device)
+        with torch.no_grad():
+            actions = self.model(state_tensor).argmax(dim=1).cpu().numpy()
+        explore = np.random.random(len(actions)) < self.epsilon
+        actions[explore] = np.random.randint(0, self.output_dim, int(explore.sum()))
+        return actions
+
+    def sync_target(self):
+        self.target_model.load_state_dict(self.model.state_dict())
+
+    def update(self, batch_size=None):
         if len(self.replay_buffer) < self.batch_size:
             return
-        transitions = self.replay_buffer.sample(self.batch_size)
-        batch = list(zip(*transitions))
-        states = torch.FloatTensor(np.array(batch[0])).to(self.device)
-        actions = torch.LongTensor(batch[1]).unsqueeze(1).to(self.device)
-        rewards = torch.FloatTensor(batch[2]).unsqueeze(1).to(self.device)
-        next_states = torch.FloatTensor(np.array(batch[3])).to(self.device)
-        dones = torch.FloatTensor(batch[4]).unsqueeze(1).to(self.device)
-        
+        states, actions, rewards, next_states, dones = self.replay_buffer.sample(batch_size or self.batch_size)
+        states = torch.as_tensor(states, device=self.device)
+        actions = torch.as_tensor(actions, device=self.device).unsqueeze(1)
+        rewards = torch.as_tensor(rewards, device=self.device).unsqueeze(1)
+        next_states = torch.as_tensor(next_states, device=self.device)
+        dones = torch.as_tensor(dones, device=self.device).unsqueeze(1)
+
         q_values = self.model(states).gather(1, actions)
         with torch.no_grad():
-            next_q_values = self.model(next_states).max(1)[0].unsqueeze(1)
+            next_q_values = self.target_model(next_states).max(1)[0].unsqueeze(1)
         target = rewards + self.gamma * next_q_values * (1 - dones)
         loss = nn.MSELoss()(q_values, target)
         self.optimizer.zero_grad()
         loss.backward()
         self.optimizer.step()
-    
-    def train_agent(self, episodes=1000, steps_per_episode=10):
-        for episode in range(episodes):
-            state = np.array([random.randint(0,20), random.randint(0,20), random.random(), random.random()])
-            for _ in range(steps_per_episode):
-                action = self.choose_action(state)
-                ns, ew, weather, conn = state
-                reward = - (ew + weather * 2) if action == 0 else - (ns + weather * 2)
-                next_state = np.array([random.randint(0,20), random.randint(0,20), random.random(), random.random()])
-                done = False
-                self.replay_buffer.push(state, action, reward, next_state, done)
-                state = next_state
-                self.update()
-    
-    def get_optimal_signals(self, traffic_data, config):
-        rl_signals = {}
+
+    def train_agent(self, episodes=1000, steps_per_episode=10, num_envs=16, target_update=100, env=None):
+        """
+        Trains on episodes * steps_per_episode transitions. `num_envs`
+        environments are stepped in lockstep with one batched forward pass,
+        and each round of steps makes one gradient update on batch_size x
+        num_envs samples: as many samples as the original one update per
+        transition, in num_envs times fewer optimizer steps. The target
+        network is synchronised every `target_update` updates.
+        Returns throughput statistics.
+        """
+        env = env or RandomTrafficEnv(num_envs)
+        self.model.train()
+        self.inference_model = None
+        num_envs = env.num_envs
+        rounds = -(-episodes // num_envs) * steps_per_episode
+        start = time.perf_counter()
+        steps = 0
+        updates = 0
+        batch_size = self.batch_size * num_envs
+        for round_index in range(rounds):
+            if round_index % steps_per_episode == 0:
+                states = env.reset()
+            actions = self.choose_actions(states)
+            next_states, rewards, dones = env.step(actions)
+            self.replay_buffer.push_batch(states, actions, rewards, next_states, dones)
+            states = next_states
+            steps += num_envs
+            self.update(batch_size)
+            updates += 1
+            if updates % target_update == 0:
+                self.sync_target()
+        elapsed = time.perf_counter() - start
+        stats = {"steps": steps, "updates": updates, "seconds": elapsed,
+                 "steps_per_second": steps / elapsed if elapsed else 0.0}
+        print(f"DRL training: {steps} steps, {updates} updates in {elapsed:.1f}s "
+              f"({stats['steps_per_second']:.0f} steps/s)")
+        return stats
+
+    def freeze(self):
+        """
+        Switches the agent to inference-only mode: the current weights are traced
+        and frozen into a TorchScript module and exploration is turned off.
+        """
+        self.model.eval()
+        example = torch.zeros((1, self.input_dim), device=self.device)
+        with torch.no_grad(), warnings.catch_warnings():
+            # Newer torch releases flag TorchScript as deprecated; it still works here.
+            warnings.simplefilter("ignore", FutureWarning)
+            self.inference_model = torch.jit.freeze(torch.jit.trace(self.model, example))
+        self.inference_only = True
+
+    def get_optimal_actions(self, ns, ew, config):
+        """
+        Chooses an action for every intersection from arrays of north-south and
+        east-west car counts with a single batched forward pass. Returns the
+        actions (0 = north-south green, 1 = east-west green) and the matching
+        green durations. The input tensor is reused between calls.
+        """
         base_duration = config.get("base_duration", 10)
         extension_factor = config.get("extension_factor", 0.5)
         max_extension = config.get("max_extension", 20)
-        for inter_no, roads in traffic_data.items():
-            ns = roads.get("north", {}).get("car", 0) + roads.get("south", {}).get("car", 0)
-            ew = roads.get("east", {}).get("car", 0) + roads.get("west", {}).get("car", 0)
-            weather = random.random()
-            connected = random.random()
-            state = np.array([ns, ew, weather, connected])
-            action = self.choose_action(state)
-            effective_count = ns if action == 1 else ew
-            dynamic_duration = base_duration + min(effective_count * extension_factor, max_extension)
+        ns = np.asarray(ns, dtype=np.float32)
+        ew = np.asarray(ew, dtype=np.float32)
+        n = len(ns)
+        if self.input_buffer is None or self.input_buffer.shape[0] < n:
+            self.input_buffer = torch.empty((max(n, 1), self.input_dim), dtype=torch.float32, device=self.device)
+        states = self.input_buffer[:n]
+        states[:, 0].copy_(torch.from_numpy(ns))
+        states[:, 1].copy_(torch.from_numpy(ew))
+        # Weather and connectivity are not measured yet and stay random, as before.
+        states[:, 2:].uniform_()
+        model = self.inference_model if self.inference_model is not None else self.model
+        with torch.inference_mode():
+            actions = model(states).argmax(dim=1).cpu().numpy()
+        if not self.inference_only:
+            explore = np.random.random(n) < self.epsilon
+            actions[explore] = np.random.randint(0, self.output_dim, int(explore.sum()))
+        effective_count = np.where(actions == 1, ns, ew).astype(np.float64)
+        durations = base_duration + np.minimum(effective_count * extension_factor, max_extension)
+        return actions, durations
+
+    def get_optimal_signals(self, traffic_data, config):
+        rl_signals = {}
+        ns = np.array([roads.get("north", {}).get("car", 0) + roads.get("south", {}).get("car", 0)
+                       for roads in traffic_data.values()])
+        ew = np.array([roads.get("east", {}).get("car", 0) + roads.get("west", {}).get("car", 0)
+                       for roads in traffic_data.values()])
+        actions, durations = self.get_optimal_actions(ns, ew, config)
+        for (inter_no, roads), action, dynamic_duration in zip(traffic_data.items(), actions, durations):
             rl_signals[inter_no] = {}
             for road in roads.keys():
                 if (action == 0 and road in ["north", "south"]) or (action == 1 and road in ["east", "west"]):
@@ -109,7 +236,7 @@ class DeepRLAgent:
                     signal = "RED"
                 rl_signals[inter_no][road] = {
                     "signal": signal,
-                    "dynamic_duration": round(dynamic_duration, 1)
+                    "dynamic_duration": round(float(dynamic_duration), 1)
                 }
         return rl_signals
 
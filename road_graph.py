@@ -0,0 +1,107 @@
+import numpy as np
+
+DEFAULT_WEIGHT = 0.5
+
+def grid_edges(rows, cols):
+    """Undirected edges between horizontally and vertically adjacent grid intersections."""
+    edges = []
+    for row in range(rows):
+        for col in range(cols):
+            inter_id = row * cols + col + 1
+            if col < cols - 1:
+                edges.append((str(inter_id), str(inter_id + 1)))
+            if row < rows - 1:
+                edges.append((str(inter_id), str(inter_id + cols)))
+    return edges
+
+class RoadGraph:
+    """
+    Road network of a set of intersections compiled once into CSR arrays.
+    The intersections whose traffic influences row i are
+    indices[indptr[i]:indptr[i + 1]], each with its weight, so neighbour
+    aggregation is a sparse matrix-vector product. The transposed CSR
+    (rev_indptr / rev_indices) lists the intersections each one influences,
+    which is what a count change makes stale.
+    Edges are (a, b) or (a, b, weight); undirected edges influence both ways.
+    Edges to intersections outside `inter_ids` are ignored.
+    """
+    def __init__(self, inter_ids, edges, directed=False, default_weight=DEFAULT_WEIGHT):
+        self.inter_ids = [str(inter_id) for inter_id in inter_ids]
+        self.index = {inter_id: i for i, inter_id in enumerate(self.inter_ids)}
+        n = len(self.inter_ids)
+        targets, sources, weights = [], [], []
+        for edge in edges:
+            a, b = str(edge[0]), str(edge[1])
+            if a not in self.index or b not in self.index:
+                continue
+            weight = float(edge[2]) if len(edge) > 2 else default_weight
+            # An edge a -> b means the traffic at a influences the decision at b.
+            targets.append(self.index[b])
+            sources.append(self.index[a])
+            weights.append(weight)
+            if not directed:
+                targets.append(self.index[a])
+                sources.append(self.index[b])
+                weights.append(weight)
+        targets = np.array(targets, dtype=np.int64)
+        sources = np.array(sources, dtype=np.int64)
+        weights = np.array(weights, dtype=np.float64)
+
+        order = np.lexsort((sources, targets))
+        self.rows = targets[order]
+        self.indices = sources[order]
+        self.weights = weights[order]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.rows, minlength=n), out=self.indptr[1:])
+
+        order = np.lexsort((targets, sources))
+        self.rev_indices = targets[order]
+        self.rev_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=self.rev_indptr[1:])
+
+    def __len__(self):
+        return len(self.inter_ids)
+
+    @property
+    def edge_count(self):
+        return len(self.indices)
+
+    @classmethod
+    def from_config(cls, inter_ids, config):
+        """
+        The graph described by config["road_graph"]; without edges there it
+        falls back to config["adjacency"] (id -> neighbour ids) and then to
+        the rows x cols grid. Returns None when the config describes no graph.
+        """
+        graph_config = config.get("road_graph", {})
+        weight = graph_config.get("weight", DEFAULT_WEIGHT)
+        if graph_config.get("edges"):
+            return cls(inter_ids, graph_config["edges"], graph_config.get("directed", False), weight)
+        if "adjacency" in config:
+            edges = [(adj, inter_no) for inter_no, adj_ids in config["adjacency"].items() for adj in adj_ids]
+            return cls(inter_ids, edges, directed=True, default_weight=weight)
+        if "grid" in config:
+            return cls(inter_ids, grid_edges(config["grid"]["rows"], config["grid"]["cols"]), False, weight)
+        return None
+
+    def edge_positions(self, rows, indptr):
+        """Positions in the CSR arrays of all entries of `rows`, and the row each belongs to."""
+        starts = indptr[rows]
+        lengths = indptr[rows + 1] - starts
+        owner = np.repeat(np.arange(len(rows)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return starts[owner] + offsets, owner
+
+    def neighbour_sum(self, values, rows=None):
+        """Weighted sum of `values` over the neighbours of every row (or of `rows` only)."""
+        if rows is None:
+            return np.bincount(self.rows, weights=self.weights * values[self.indices], minlength=len(self))
+        positions, owner = self.edge_positions(np.asarray(rows, dtype=np.int64), self.indptr)
+        return np.bincount(owner, weights=self.weights[positions] * values[self.indices[positions]],
+                           minlength=len(rows))
+
+    def influenced(self, rows):
+        """`rows` plus every intersection whose decision depends on one of them."""
+        rows = np.asarray(rows, dtype=np.int64)
+        positions, _ = self.edge_positions(rows, self.rev_indptr)
+        return np.union1d(rows, self.rev_indices[positions])
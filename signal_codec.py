@@ -0,0 +1,243 @@
+import json
+import struct
+import time
+from traffic_state import ROADS, ROAD_INDEX, CONGESTION_LEVELS
+
+# Binary wire format of the signal output (the list of per-road items that
+# optimize_intersections returns). A frame is a header followed by one
+# record per intersection, each followed by one record per road:
+#   header        magic, version, kind, sequence, timestamp, intersections, id table bytes
+#   id table      keyframes only: the intersection ids, UTF-8, separated by newlines, then, if
+#                 any road is not one of ROADS, a NUL and those road names (codes 4, 5, ...)
+#   intersection  id table index, green duration (tenths of s), lane green times, congestion, mode, roads
+#   road          road, signal, cars, ambulances, schoolbuses, accidents, predicted cars (tenths)
+# Keyframes carry every intersection; delta frames only those whose record
+# changed since the previous frame. All integers are little-endian.
+MAGIC = b"TS"
+VERSION = 1
+KEYFRAME, DELTA = 0, 1
+HEADER = struct.Struct("<2sBBIdII")
+INTERSECTION = struct.Struct("<IHffBBB")
+ROAD = struct.Struct("<BBHHHHH")
+FRAME_LENGTH = struct.Struct("<I")
+CONTENT_TYPE = "application/vnd.traffic-signals"
+
+SIGNALS = ("RED", "GREEN")
+MODES = ("Normal", "ML Predictive", "DRL Optimized")
+CONGESTION_CODES = {level: i for i, level in enumerate(CONGESTION_LEVELS)}
+MODE_CODES = {mode: i for i, mode in enumerate(MODES)}
+UINT16_MAX = 0xFFFF
+
+def uint16(value):
+    return value if 0 <= value <= UINT16_MAX else min(max(int(value), 0), UINT16_MAX)
+
+def tenths(value):
+    return uint16(int(round(value * 10)))
+
+# One compiled struct per number of roads, so an intersection is packed in a single call.
+RECORDS = [struct.Struct(INTERSECTION.format + ROAD.format[1:] * roads) for roads in range(len(ROADS) + 1)]
+
+def encode_intersection(index, items, road_codes=ROAD_INDEX):
+    """Intersection record plus road records of one intersection's output items."""
+    first = items[0]
+    green_a, green_b = first["lane_green_times"]
+    values = [index, tenths(first["dynamic_green_duration"]), green_a, green_b,
+              CONGESTION_CODES[first["congestion_level"]], MODE_CODES[first["mode"]], len(items)]
+    for item in items:
+        values += (road_codes[item["road"]], item["signal"] == "GREEN", uint16(item["cars"]),
+                   uint16(item["ambulances"]), uint16(item["schoolbuses"]), uint16(item["accidents"]),
+                   tenths(item["predicted_cars"]))
+    if len(items) < len(RECORDS):
+        return RECORDS[len(items)].pack(*values)
+    return struct.pack(INTERSECTION.format + ROAD.format[1:] * len(items), *values)
+
+def pack_frames(frames):
+    """Length-prefixed concatenation of encoded frames, the body of one upload."""
+    return b"".join(FRAME_LENGTH.pack(len(frame)) + frame for frame in frames)
+
+def unpack_frames(body):
+    frames = []
+    offset = 0
+    while offset < len(body):
+        (length,) = FRAME_LENGTH.unpack_from(body, offset)
+        offset += FRAME_LENGTH.size
+        frames.append(body[offset:offset + length])
+        offset += length
+    return frames
+
+class SignalEncoder:
+    """
+    Encodes successive signal outputs into binary frames. A keyframe is sent
+    first, whenever the set of intersections changes, when requested and
+    every keyframe_interval frames; the frames in between are deltas with
+    only the intersections whose record changed. Intersections whose output
+    items are the very objects of the previous frame (as IncrementalOptimizer
+    returns for reused decisions) are not encoded again. A road name outside
+    ROADS gets the next free road code and forces a keyframe, which carries
+    the extra names.
+    """
+    def __init__(self, keyframe_interval=100):
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.sequence = 0
+        self.since_keyframe = 0
+        self.inter_ids = None
+        self.index = {}
+        self.records = {}
+        self.road_codes = dict(ROAD_INDEX)
+        self.stats = {"frames": 0, "keyframes": 0, "bytes": 0, "sent": 0, "unchanged": 0}
+
+    def encode(self, signals, timestamp=None, keyframe=False):
+        groups = {}
+        for item in signals:
+            groups.setdefault(item["intersection"], []).append(item)
+        inter_ids = [str(inter_no) for inter_no in groups]
+        if inter_ids != self.inter_ids:
+            self.inter_ids = inter_ids
+            self.index = {inter_no: i for i, inter_no in enumerate(groups)}
+            self.records = {}
+            keyframe = True
+        keyframe = keyframe or self.since_keyframe + 1 >= self.keyframe_interval
+
+        changed = []
+        for inter_no, items in groups.items():
+            cached = self.records.get(inter_no)
+            if cached is not None and cached[0] is items[0] and cached[1] == len(items):
+                continue
+            for item in items:
+                if item["road"] not in self.road_codes:
+                    self.road_codes[item["road"]] = len(self.road_codes)
+                    keyframe = True
+            record = encode_intersection(self.index[inter_no], items, self.road_codes)
+            if cached is None or cached[2] != record:
+                changed.append(inter_no)
+            self.records[inter_no] = (items[0], len(items), record)
+
+        sent = list(groups) if keyframe else changed
+        id_table = b""
+        if keyframe:
+            id_table = "\n".join(inter_ids)
+            if len(self.road_codes) > len(ROADS):
+                id_table += "\0" + "\n".join(list(self.road_codes)[len(ROADS):])
+            id_table = id_table.encode()
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        header = HEADER.pack(MAGIC, VERSION, KEYFRAME if keyframe else DELTA, self.sequence,
+                             time.time() if timestamp is None else timestamp, len(sent), len(id_table))
+        frame = b"".join([header, id_table] + [self.records[inter_no][2] for inter_no in sent])
+        self.since_keyframe = 0 if keyframe else self.since_keyframe + 1
+        stats = self.stats
+        stats["frames"] += 1
+        stats["keyframes"] += keyframe
+        stats["bytes"] += len(frame)
+        stats["sent"] += len(sent)
+        stats["unchanged"] += len(groups) - len(sent)
+        return frame
+
+    def format_stats(self):
+        frames = max(self.stats["frames"], 1)
+        total = self.stats["sent"] + self.stats["unchanged"]
+        ratio = self.stats["sent"] / total if total else 0.0
+        return (f"{self.stats['frames']} frames ({self.stats['keyframes']} keyframes), "
+                f"{self.stats['bytes'] / frames:.0f} B/frame, {ratio:.0%} of intersections sent")
+
+class SignalDecoder:
+    """
+    Rebuilds the signal output from the frames of a SignalEncoder. Lane
+    green times come back at float32 precision (rounded to 0.01 s); every
+    other field is exact. A delta that does not directly follow the last
+    decoded frame raises ValueError, and so do all frames until the next
+    keyframe.
+    """
+    def __init__(self):
+        self.inter_ids = None
+        self.roads = ROADS
+        self.signals = {}
+        self.sequence = None
+
+    def decode(self, frame):
+        """Returns the timestamp and the full signal output after applying `frame`."""
+        magic, version, kind, sequence, timestamp, count, id_bytes = HEADER.unpack_from(frame)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a version 1 signal frame")
+        offset = HEADER.size
+        if kind == KEYFRAME:
+            ids, _, roads = frame[offset:offset + id_bytes].decode().partition("\0")
+            self.inter_ids = ids.split("\n") if ids else []
+            self.roads = ROADS + tuple(roads.split("\n")) if roads else ROADS
+            self.signals = {}
+            offset += id_bytes
+        elif self.inter_ids is None or sequence != (self.sequence + 1) & 0xFFFFFFFF:
+            self.inter_ids = None
+            raise ValueError(f"Signal frame {sequence} does not follow frame {self.sequence}; waiting for a keyframe")
+
+        for _ in range(count):
+            index, duration, green_a, green_b, congestion, mode, roads = INTERSECTION.unpack_from(frame, offset)
+            offset += INTERSECTION.size
+            inter_no = self.inter_ids[index]
+            common = {"dynamic_green_duration": duration / 10,
+                      "lane_green_times": [round(green_a, 2), round(green_b, 2)],
+                      "congestion_level": CONGESTION_LEVELS[congestion], "mode": MODES[mode]}
+            items = []
+            for _ in range(roads):
+                road, signal, cars, ambulances, schoolbuses, accidents, predicted = ROAD.unpack_from(frame, offset)
+                offset += ROAD.size
+                items.append({"intersection": inter_no, "road": self.roads[road], "cars": cars, "ambulances": ambulances,
+                              "schoolbuses": schoolbuses, "accidents": accidents, "predicted_cars": predicted / 10,
+                              "signal": SIGNALS[signal], **common})
+            self.signals[inter_no] = items
+        self.sequence = sequence
+
+        output = []
+        for inter_no in self.inter_ids:
+            output.extend(self.signals.get(inter_no, ()))
+        return timestamp, output
+
+    def decode_body(self, body):
+        """(timestamp, signals) of every frame in an upload body."""
+        return [self.decode(frame) for frame in unpack_frames(body)]
+
+class SignalLogger:
+    """
+    Rate-limited replacement for dumping every frame's signals to the
+    console: at most one line every `interval` seconds, with a JSON summary
+    of the latest frame and the intersections whose signals changed since
+    the previous line (up to max_intersections of them).
+    """
+    def __init__(self, interval=5.0, max_intersections=10):
+        self.interval = interval
+        self.max_intersections = max_intersections
+        self.frames = 0
+        self.last_time = None
+        self.last_states = {}
+
+    @classmethod
+    def from_config(cls, config):
+        log_config = config.get("signal_log", {})
+        return cls(log_config.get("interval", 5.0), log_config.get("max_intersections", 10))
+
+    def log(self, signals, now=None):
+        self.frames += 1
+        now = time.time() if now is None else now
+        if self.last_time is not None and now - self.last_time < self.interval:
+            return False
+        roads = {}
+        congestion = dict.fromkeys(CONGESTION_LEVELS, 0)
+        modes = {}
+        green = 0
+        for item in signals:
+            inter_no = item["intersection"]
+            if inter_no not in roads:
+                roads[inter_no] = [f"{item['dynamic_green_duration']}s"]
+                congestion[item["congestion_level"]] += 1
+                modes[item["mode"]] = modes.get(item["mode"], 0) + 1
+            roads[inter_no].append(f"{item['road'][0].upper()}:{item['signal'][0]}{item['cars']}")
+            green += item["signal"] == "GREEN"
+        states = {inter_no: " ".join(parts[1:] + parts[:1]) for inter_no, parts in roads.items()}
+        changed = [inter_no for inter_no, state in states.items() if self.last_states.get(inter_no) != state]
+        record = {"frames": self.frames, "intersections": len(states), "green_roads": green,
+                  "congestion": congestion, "modes": modes, "changed": len(changed),
+                  "changes": {str(inter_no): states[inter_no] for inter_no in changed[:self.max_intersections]}}
+        print("Signals: " + json.dumps(record, separators=(",", ":")))
+        self.frames = 0
+        self.last_time = now
+        self.last_states = states
+        return True
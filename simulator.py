@@ -0,0 +1,258 @@
+import argparse
+import datetime
+import json
+import time
+import numpy as np
+from algorithm import optimize_arrays
+from road_graph import RoadGraph
+from traffic_state import TrafficState, ROADS, CLASS_INDEX, PHASE_A, PHASE_B, PHASE_EMERGENCY, PHASE_ROADS
+
+def demand_profile(hour):
+    """Share of the peak arrival rate at a given hour of the day, with morning and evening peaks."""
+    return 0.25 + 0.75 * np.maximum(np.exp(-0.5 * ((hour - 8.0) / 1.5) ** 2),
+                                    np.exp(-0.5 * ((hour - 17.5) / 1.5) ** 2))
+
+class TrafficSimulator:
+    """
+    Queue model of `n` independent intersections stepped together with NumPy.
+    Every road has a queue fed by Poisson arrivals following demand_profile.
+    A road on the green phase discharges at saturation_flow vehicles per
+    second, reduced by the weather; no road discharges during the lost
+    time after a phase switch. Emergency vehicles appear on a random road
+    and wait until it is green. Arrivals and events are drawn from their own
+    generators independently of the state, so two controllers run on the
+    same seed see exactly the same traffic.
+    """
+    def __init__(self, n, seed=None, step_seconds=1.0, saturation_flow=0.5, lost_time=4.0, min_rate=0.02,
+                 max_rate=0.12, emergency_rate_per_day=2.0, weather_slowdown=0.4, start_hour=0.0,
+                 weather=None):
+        self.n = n
+        self.step_seconds = step_seconds
+        self.saturation_flow = saturation_flow
+        self.lost_time = lost_time
+        self.emergency_rate = emergency_rate_per_day / 86400.0
+        self.weather_slowdown = weather_slowdown
+        self.start_hour = start_hour
+        seeds = np.random.SeedSequence(seed).spawn(3)
+        setup_rng = np.random.default_rng(seeds[0])
+        self.arrival_rng = np.random.default_rng(seeds[1])
+        self.event_rng = np.random.default_rng(seeds[2])
+        # Peak arrival rates per road, in vehicles per second.
+        self.base_rates = setup_rng.uniform(min_rate, max_rate, size=(n, len(ROADS)))
+        self.weather = np.zeros(n) if weather is None else np.broadcast_to(np.asarray(weather, dtype=np.float64), n)
+        self.queues = np.zeros((n, len(ROADS)))
+        self.phase = np.full(n, PHASE_A, dtype=np.int8)
+        self.lost = np.zeros(n)
+        self.emergency_road = np.full(n, -1, dtype=np.int64)
+        self.time = 0.0
+        self.totals = {"arrived": 0.0, "departed": 0.0, "delay": 0.0, "switches": 0,
+                       "emergencies": 0, "emergency_wait": 0.0}
+
+    @classmethod
+    def from_config(cls, n, config, seed=None, **overrides):
+        params = dict(config.get("simulator", {}))
+        params.pop("decision_interval", None)
+        params.update(overrides)
+        return cls(n, seed, **params)
+
+    def hour(self):
+        return (self.start_hour + self.time / 3600.0) % 24
+
+    def set_phase(self, phase):
+        """Switches the intersections whose phase differs; each switch costs lost_time."""
+        changed = phase != self.phase
+        self.lost[changed] = self.lost_time
+        self.totals["switches"] += int(changed.sum())
+        self.phase = np.asarray(phase, dtype=np.int8)
+
+    def step(self):
+        dt = self.step_seconds
+        arrivals = self.arrival_rng.poisson(self.base_rates * (demand_profile(self.hour()) * dt))
+        self.queues += arrivals
+
+        green = PHASE_ROADS[self.phase]
+        service_time = np.clip(dt - self.lost, 0.0, dt)
+        self.lost = np.maximum(self.lost - dt, 0.0)
+        capacity = (self.saturation_flow * (1 - self.weather_slowdown * self.weather) * service_time)[:, None] * green
+        departed = np.minimum(self.queues, capacity)
+        self.queues -= departed
+
+        # Emergency vehicles: at most one waiting per intersection.
+        appear = self.event_rng.random(self.n) < self.emergency_rate * dt
+        roads = self.event_rng.integers(0, len(ROADS), self.n)
+        new = appear & (self.emergency_road < 0)
+        self.emergency_road[new] = roads[new]
+        waiting = self.emergency_road >= 0
+        served = waiting & green[np.arange(self.n), self.emergency_road] & (service_time > 0)
+        self.emergency_road[served] = -1
+
+        totals = self.totals
+        totals["arrived"] += float(arrivals.sum())
+        totals["departed"] += float(departed.sum())
+        totals["delay"] += float(self.queues.sum()) * dt
+        totals["emergencies"] += int(new.sum())
+        totals["emergency_wait"] += float((waiting & ~served).sum()) * dt
+        self.time += dt
+        return departed
+
+    def observe(self, state):
+        """Writes the queues (as car counts) and waiting emergency vehicles into a TrafficState."""
+        state.counts.fill(0)
+        state.counts[:, :, CLASS_INDEX["car"]] = np.rint(self.queues)
+        waiting = np.flatnonzero(self.emergency_road >= 0)
+        state.counts[waiting, self.emergency_road[waiting], CLASS_INDEX["ambulance"]] = 1
+        state.present.fill(True)
+        return state
+
+    def metrics(self):
+        totals = self.totals
+        departed = max(totals["departed"], 1.0)
+        return {
+            "simulated_hours": round(self.time / 3600.0, 2),
+            "intersections": self.n,
+            "throughput": int(totals["departed"]),
+            "total_delay_vehicle_hours": round(totals["delay"] / 3600.0, 1),
+            "mean_delay_s": round(totals["delay"] / departed, 2),
+            "queued_at_end": int(self.queues.sum()),
+            "switches": totals["switches"],
+            "emergencies": totals["emergencies"],
+            "mean_emergency_wait_s": round(totals["emergency_wait"] / max(totals["emergencies"], 1), 2)
+        }
+
+class SimulatedController:
+    """
+    Drives a TrafficSimulator with optimize_arrays in one operation mode, the
+    way SignalController drives the live signals: counts are smoothed into
+    predictions, and a phase that was switched to is held for its dynamic
+    green duration (at least min_phase_duration) unless an emergency
+    needs the other one. "fuzzy" is normal mode with fuzzy logic.
+    """
+    def __init__(self, config, mode, inter_ids, rl_agent=None, ml_model=None):
+        self.config = dict(config, use_fuzzy_logic=(mode == "fuzzy"))
+        self.operation_mode = "normal" if mode == "fuzzy" else mode
+        self.rl_agent = rl_agent
+        self.ml_model = ml_model
+        self.state = TrafficState(inter_ids)
+        self.graph = RoadGraph.from_config(self.state.inter_ids, config)
+        self.alpha = config.get("prediction_alpha", 0.7)
+        self.min_phase_duration = config.get("min_phase_duration", 5)
+        self.predictions = np.zeros((len(inter_ids), len(ROADS)))
+        self.hold_until = np.zeros(len(inter_ids))
+
+    def decide(self, simulator, current_time):
+        state = simulator.observe(self.state)
+        self.predictions = self.alpha * state.cars() + (1 - self.alpha) * self.predictions
+        state.predictions[:] = self.predictions
+        decisions = optimize_arrays(state, self.config, current_time, self.rl_agent, self.ml_model, self.graph,
+                                    self.operation_mode)
+        target = np.where(decisions.green[:, 0] | decisions.green[:, 1], PHASE_A, PHASE_B)
+        emergency = decisions.phase == PHASE_EMERGENCY
+        switch = ((simulator.time >= self.hold_until) | emergency) & (target != simulator.phase)
+        hold = simulator.lost_time + np.maximum(decisions.dynamic_duration, self.min_phase_duration)
+        self.hold_until = np.where(switch, simulator.time + hold, self.hold_until)
+        simulator.set_phase(np.where(switch, target, simulator.phase))
+
+def grid_ids(config):
+    return [str(i + 1) for i in range(config["grid"]["rows"] * config["grid"]["cols"])]
+
+def evaluate(config, modes, hours=24.0, seed=0, models=None):
+    """Simulates `hours` of traffic on the configured grid once per mode; returns the metrics per mode."""
+    models = models or {}
+    inter_ids = grid_ids(config)
+    decision_interval = config.get("simulator", {}).get("decision_interval", 5.0)
+    day = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    results = {}
+    for mode in modes:
+        simulator = TrafficSimulator.from_config(len(inter_ids), config, seed)
+        controller = SimulatedController(config, mode, inter_ids, models.get("rl"), models.get("ml"))
+        steps = int(hours * 3600 / simulator.step_seconds)
+        every = max(1, int(round(decision_interval / simulator.step_seconds)))
+        started = time.perf_counter()
+        for step in range(steps):
+            if step % every == 0:
+                current_time = day + datetime.timedelta(hours=simulator.start_hour, seconds=simulator.time)
+                controller.decide(simulator, current_time)
+            simulator.step()
+        results[mode] = dict(simulator.metrics(), runtime_s=round(time.perf_counter() - started, 2))
+    return results
+
+class SimulatorEnv:
+    """
+    TrafficSimulator as a training environment for DeepRLAgent.train_agent:
+    `num_envs` independent intersections stepped in lockstep. An action
+    (0 = north-south green, 1 = east-west green) is held for one decision
+    interval, and the reward is minus the average number of queued
+    vehicles over it, divided by 10. States keep the DQN layout:
+    north-south and east-west queues, then weather (which slows discharge
+    here) and connectivity (not modelled; random, as at inference time).
+    Every reset starts new intersections at a random time of day with
+    random queues and weather.
+    """
+    def __init__(self, num_envs=16, config=None, seed=None):
+        self.num_envs = num_envs
+        self.config = config or {}
+        self.rng = np.random.default_rng(seed)
+        self.decision_interval = self.config.get("simulator", {}).get("decision_interval", 5.0)
+        self.simulator = None
+
+    def reset(self):
+        n = self.num_envs
+        self.simulator = TrafficSimulator.from_config(n, self.config, int(self.rng.integers(2**31)),
+                                                      start_hour=float(self.rng.uniform(0, 24)),
+                                                      weather=self.rng.random(n))
+        self.simulator.queues[:] = self.rng.integers(0, 21, size=(n, len(ROADS)))
+        self.simulator.phase = self.rng.integers(0, 2, n).astype(np.int8)
+        return self.observe()
+
+    def observe(self):
+        queues = self.simulator.queues
+        return np.column_stack([queues[:, 0] + queues[:, 1], queues[:, 2] + queues[:, 3],
+                                self.simulator.weather, self.rng.random(self.num_envs)]).astype(np.float32)
+
+    def step(self, actions):
+        simulator = self.simulator
+        simulator.set_phase(np.where(np.asarray(actions) == 0, PHASE_A, PHASE_B))
+        steps = max(1, int(round(self.decision_interval / simulator.step_seconds)))
+        queued = np.zeros(self.num_envs)
+        for _ in range(steps):
+            simulator.step()
+            queued += simulator.queues.sum(axis=1)
+        rewards = -(queued / steps) / 10.0
+        return self.observe(), rewards.astype(np.float32), np.zeros(self.num_envs, dtype=np.float32)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the signal controllers on simulated traffic.")
+    parser.add_argument("--config", default="config.json", help="Path to the configuration file.")
+    parser.add_argument("--modes", default="normal,fuzzy,ml,rl", help="Comma-separated controllers to evaluate.")
+    parser.add_argument("--grid", help="Grid to simulate as ROWSxCOLS; defaults to the configured grid.")
+    parser.add_argument("--hours", type=float, default=24.0, help="Simulated hours per controller.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the simulated traffic.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    return parser.parse_args(argv)
+
+def run(args):
+    from main import load_config, load_rl_agent, load_ml_model
+    config = load_config(args.config)
+    if args.grid:
+        rows, cols = args.grid.lower().split("x")
+        config["grid"] = dict(config.get("grid", {}), rows=int(rows), cols=int(cols))
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    models = {}
+    if "rl" in modes:
+        models["rl"] = load_rl_agent(config)
+    if "ml" in modes:
+        models["ml"] = load_ml_model(config)
+    results = evaluate(config, modes, args.hours, args.seed, models)
+    print(f"{'controller':<10}{'delay veh-h':>14}{'mean delay s':>14}{'throughput':>12}"
+          f"{'switches':>10}{'emerg. wait s':>15}{'runtime s':>11}")
+    for mode, result in results.items():
+        print(f"{mode:<10}{result['total_delay_vehicle_hours']:>14}{result['mean_delay_s']:>14}"
+              f"{result['throughput']:>12}{result['switches']:>10}{result['mean_emergency_wait_s']:>15}"
+              f"{result['runtime_s']:>11}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+if __name__ == "__main__":
+    run(parse_args())
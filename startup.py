@@ -0,0 +1,99 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Taken when this module is first imported; main.py imports it before anything
+# else so the profile also covers the module imports.
+PROCESS_STARTED = time.perf_counter()
+
+class StartupProfiler:
+    """
+    Records how long each import and initialisation step takes until the
+    first decision, and prints them as one table. Components loaded later in
+    the background are recorded and reported as they finish.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.timings = [("module imports", time.perf_counter() - PROCESS_STARTED)]
+        self.lock = threading.Lock()
+        self.reported = False
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.timings.append((name, seconds))
+        if self.reported and self.enabled:
+            print(f"Startup profile: {name} took {seconds * 1000:.1f} ms")
+
+    def elapsed(self):
+        return time.perf_counter() - PROCESS_STARTED
+
+    def report(self, label="first decision"):
+        self.reported = True
+        if not self.enabled:
+            return
+        with self.lock:
+            timings = list(self.timings)
+        print("Startup profile:")
+        for name, seconds in timings:
+            print(f"  {name:<24}{seconds * 1000:10.1f} ms")
+        print(f"  {'until ' + label:<24}{self.elapsed() * 1000:10.1f} ms")
+
+class LazyComponent:
+    """
+    A model or subsystem built on first use. `get()` never blocks and returns
+    None until the component is ready; `load()` builds it in the calling
+    thread and `load_in_background()` in a daemon thread, so a mode switch
+    does not stall the frame loop. A failed background load is reported and
+    kept in `error`; the next `load_in_background()` retries it.
+    """
+    def __init__(self, name, loader, profiler=None):
+        self.name = name
+        self.loader = loader
+        self.profiler = profiler
+        self.value = None
+        self.error = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.value is not None
+
+    def get(self):
+        return self.value
+
+    def load(self):
+        with self.lock:
+            if self.value is None:
+                start = time.perf_counter()
+                value = self.loader()
+                if self.profiler is not None:
+                    self.profiler.record(self.name, time.perf_counter() - start)
+                self.value = value
+        return self.value
+
+    def load_in_background(self):
+        if self.value is not None or self.thread is not None:
+            return
+        print(f"Loading {self.name} in the background ...")
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name=f"load-{self.name}", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.load()
+            print(f"{self.name} ready.")
+        except Exception as e:
+            self.error = e
+            print(f"Failed to load {self.name}: {e}")
+            # A later call starts a new attempt.
+            self.thread = None
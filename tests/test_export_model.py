@@ -0,0 +1,24 @@
+import numpy as np
+from export_model import calibration_batches
+from model import ExportedBackend
+
+def test_calibration_batches_match_inference_preprocessing():
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (360, 640, 3), dtype=np.uint8) for _ in range(2)]
+    batches = list(calibration_batches(frames, 320))
+    assert len(batches) == 2
+    batch = batches[0]
+    assert batch.shape == (1, 3, 192, 320)
+    assert batch.dtype == np.float32
+    assert 0.0 <= batch.min() and batch.max() <= 1.0
+
+    # A dynamic export is fed exactly the same tensors at inference time.
+    backend = ExportedBackend(imgsz=320)
+    backend.dynamic = True
+    expected, _ = backend.preprocess([frames[0]])
+    np.testing.assert_array_equal(batch, expected)
+
+def test_calibration_batches_of_a_square_frame():
+    frame = np.zeros((100, 100, 3), dtype=np.uint8)
+    (batch,) = calibration_batches([frame], 64)
+    assert batch.shape == (1, 3, 64, 64)
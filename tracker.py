@@ -0,0 +1,225 @@
+import collections
+import numpy as np
+from model import DETECTION_DTYPE
+from traffic_state import ROADS, PHASE_NAMES, PHASE_ROADS
+
+def box_array(detections):
+    return np.stack([detections["x1"], detections["y1"], detections["x2"], detections["y2"]],
+                    axis=1).astype(np.float64).reshape(-1, 4)
+
+def iou_matrix(a, b):
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+def greedy_match(ious, threshold):
+    """One-to-one (row, column) pairs in decreasing IoU order, down to threshold."""
+    rows, cols = [], []
+    if ious.size == 0:
+        return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+    used_rows, used_cols = set(), set()
+    for flat in np.argsort(-ious, axis=None):
+        r, c = divmod(int(flat), ious.shape[1])
+        if ious[r, c] < threshold:
+            break
+        if r in used_rows or c in used_cols:
+            continue
+        used_rows.add(r)
+        used_cols.add(c)
+        rows.append(r)
+        cols.append(c)
+    return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+class RoiTracker:
+    """
+    IoU tracker for the vehicles of one ROI. Every track moves at a constant
+    velocity between detector runs; on a run the velocity is corrected by
+    `smoothing` times the prediction error (a fixed-gain alpha-beta filter)
+    and the box snaps to the detection. Boxes are in ROI-local coordinates.
+    Tracks that stay unmatched for more than max_misses detector runs are
+    dropped; tracks whose centre leaves the ROI are dropped and, if they were
+    matched more than once, counted as departures.
+    """
+    FIELDS = ("boxes", "velocity", "class_id", "confidence", "speed", "hits", "misses")
+
+    def __init__(self, roi_size, iou_threshold=0.3, max_misses=2, smoothing=0.5):
+        self.width, self.height = roi_size
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.smoothing = smoothing
+        self.boxes = np.zeros((0, 4), dtype=np.float64)
+        self.velocity = np.zeros((0, 4), dtype=np.float64)
+        self.class_id = np.zeros(0, dtype=np.uint16)
+        self.confidence = np.zeros(0, dtype=np.float32)
+        self.speed = np.zeros(0, dtype=np.float32)
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.misses = np.zeros(0, dtype=np.int64)
+        self.last_frame = None
+        self.departures = 0
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def advance(self, frame_index):
+        """Moves the tracks to frame_index; returns the number of frames elapsed."""
+        steps = 0 if self.last_frame is None else max(frame_index - self.last_frame, 0)
+        self.last_frame = frame_index
+        if steps and len(self.boxes):
+            self.boxes += self.velocity * steps
+            cx = (self.boxes[:, 0] + self.boxes[:, 2]) / 2
+            cy = (self.boxes[:, 1] + self.boxes[:, 3]) / 2
+            self.drop((cx < 0) | (cx >= self.width) | (cy < 0) | (cy >= self.height), departed=True)
+        return steps
+
+    def drop(self, mask, departed=False):
+        if mask.any():
+            if departed:
+                # Tracks seen only once are more likely false positives than vehicles.
+                self.departures += int((mask & (self.hits > 1)).sum())
+            keep = ~mask
+            for name in self.FIELDS:
+                setattr(self, name, getattr(self, name)[keep])
+
+    def predict(self, frame_index):
+        self.advance(frame_index)
+        return self.detections()
+
+    def update(self, detections, frame_index):
+        steps = self.advance(frame_index)
+        observed = box_array(detections)
+        tracks, matched = greedy_match(iou_matrix(self.boxes, observed), self.iou_threshold)
+
+        # A track's second hit measures its velocity; later hits correct it.
+        gain = np.where(self.hits[tracks] == 1, 1.0, self.smoothing)[:, None]
+        self.velocity[tracks] += gain * (observed[matched] - self.boxes[tracks]) / max(steps, 1)
+        self.boxes[tracks] = observed[matched]
+        self.class_id[tracks] = detections["class_id"][matched]
+        self.confidence[tracks] = detections["confidence"][matched]
+        self.speed[tracks] = detections["speed"][matched]
+        self.hits[tracks] += 1
+        self.misses += 1
+        self.misses[tracks] = 0
+        self.drop(self.misses > self.max_misses)
+
+        new = np.ones(len(detections), dtype=bool)
+        new[matched] = False
+        count = int(new.sum())
+        if count:
+            self.boxes = np.concatenate([self.boxes, observed[new]])
+            self.velocity = np.concatenate([self.velocity, np.zeros((count, 4))])
+            self.class_id = np.concatenate([self.class_id, detections["class_id"][new]])
+            self.confidence = np.concatenate([self.confidence, detections["confidence"][new]])
+            self.speed = np.concatenate([self.speed, detections["speed"][new]])
+            self.hits = np.concatenate([self.hits, np.ones(count, dtype=np.int64)])
+            self.misses = np.concatenate([self.misses, np.zeros(count, dtype=np.int64)])
+        return self.detections()
+
+    def detections(self):
+        """Current tracks as a DETECTION_DTYPE array, clipped to the ROI."""
+        result = np.zeros(len(self.boxes), dtype=DETECTION_DTYPE)
+        for i, (field, limit) in enumerate((("x1", self.width), ("y1", self.height),
+                                            ("x2", self.width), ("y2", self.height))):
+            result[field] = np.clip(np.rint(self.boxes[:, i]), 0, limit)
+        result["confidence"] = self.confidence
+        result["class_id"] = self.class_id
+        result["speed"] = self.speed
+        return result
+
+    def centre_speed(self):
+        """Pixels per frame each track's centre moves."""
+        return np.hypot(self.velocity[:, 0] + self.velocity[:, 2], self.velocity[:, 1] + self.velocity[:, 3]) / 2
+
+    def queue_length(self, max_speed=0.5):
+        # Only tracks seen at least twice have a measured velocity.
+        return int(((self.hits > 1) & (self.centre_speed() <= max_speed)).sum())
+
+class TrackerBank:
+    """
+    One RoiTracker per ROI plus the detection schedule of each ROI. The
+    detector runs on an ROI every `stride` frames, where the stride adapts
+    to the motion in it: tracks may move at most max_shift pixels between
+    detector runs, new (unmeasured) tracks force min_stride and an empty ROI
+    is checked every max_stride frames. Between runs the tracks are
+    propagated, so counts stay stable and inference cost falls with the stride.
+    """
+    def __init__(self, tracking_config):
+        self.iou_threshold = tracking_config.get("iou_threshold", 0.3)
+        self.max_misses = tracking_config.get("max_misses", 2)
+        self.smoothing = tracking_config.get("smoothing", 0.5)
+        self.min_stride = max(1, tracking_config.get("min_stride", 1))
+        self.max_stride = max(self.min_stride, tracking_config.get("max_stride", 5))
+        self.max_shift = tracking_config.get("max_shift", 8.0)
+        self.queue_speed = tracking_config.get("queue_speed", 0.5)
+        self.throughput_window = tracking_config.get("throughput_window", 60.0)
+        self.trackers = {}
+        self.next_detection = {}
+        self.departures = {}
+        self.started = None
+        self.stats = {"detected": 0, "propagated": 0}
+
+    def due(self, key, frame_index):
+        return frame_index >= self.next_detection.get(key, frame_index)
+
+    def stride(self, tracker):
+        if len(tracker) == 0:
+            return self.max_stride
+        if (tracker.hits < 2).any():
+            return self.min_stride
+        fastest = tracker.centre_speed().max()
+        if fastest <= 0:
+            return self.max_stride
+        return int(np.clip(self.max_shift // fastest, self.min_stride, self.max_stride))
+
+    def update(self, key, roi_size, frame_index, timestamp, detections=None):
+        """Tracks of one ROI at frame_index, updated with `detections` when the detector ran."""
+        tracker = self.trackers.get(key)
+        if tracker is None:
+            tracker = self.trackers[key] = RoiTracker(roi_size, self.iou_threshold, self.max_misses,
+                                                      self.smoothing)
+        departed = tracker.departures
+        if detections is None:
+            tracked = tracker.predict(frame_index)
+            self.stats["propagated"] += 1
+        else:
+            tracked = tracker.update(detections, frame_index)
+            self.next_detection[key] = frame_index + self.stride(tracker)
+            self.stats["detected"] += 1
+        if self.started is None:
+            self.started = timestamp
+        history = self.departures.setdefault(key, collections.deque())
+        history.extend([timestamp] * (tracker.departures - departed))
+        while history and history[0] < timestamp - self.throughput_window:
+            history.popleft()
+        return tracked
+
+    def road_flow(self, key, now):
+        """Queued vehicles and departures per minute of one ROI."""
+        tracker = self.trackers.get(key)
+        window = min(self.throughput_window, max(now - (self.started or now), 1.0))
+        return {"queue_length": tracker.queue_length(self.queue_speed) if tracker is not None else 0,
+                "throughput": round(len(self.departures.get(key, ())) * 60.0 / window, 2)}
+
+    def flow(self, intersections_config, now):
+        """Per-road and per-phase queue length and throughput (vehicles per minute)."""
+        flow = {}
+        for inter_no, inter_data in intersections_config.items():
+            roads = {road_no: self.road_flow((inter_no, road_no), now) for road_no in inter_data.get("roads", {})}
+            phases = {}
+            for phase, served in zip(PHASE_NAMES, PHASE_ROADS):
+                members = [roads[road] for road, on in zip(ROADS, served) if on and road in roads]
+                phases[phase] = {"queue_length": sum(road["queue_length"] for road in members),
+                                 "throughput": round(sum(road["throughput"] for road in members), 2)}
+            flow[inter_no] = {"roads": roads, "phases": phases}
+        return flow
+
+    def format_stats(self):
+        total = self.stats["detected"] + self.stats["propagated"]
+        ratio = self.stats["detected"] / total if total else 0.0
+        queued = sum(tracker.queue_length(self.queue_speed) for tracker in self.trackers.values())
+        tracks = sum(len(tracker) for tracker in self.trackers.values())
+        return f"detector ran on {ratio:.0%} of ROI frames, {tracks} tracks, {queued} queued"
@@ -0,0 +1,114 @@
+import numpy as np
+
+ROADS = ("north", "south", "east", "west")
+CLASSES = ("car", "ambulance", "schoolbus", "accident")
+ROAD_INDEX = {road: i for i, road in enumerate(ROADS)}
+CLASS_INDEX = {name: i for i, name in enumerate(CLASSES)}
+
+# Phase A serves north-south, phase B serves east-west.
+PHASE_A, PHASE_B, PHASE_EMERGENCY = 0, 1, 2
+PHASE_NAMES = ("A", "B", "EMERGENCY")
+PHASE_ROADS = np.array([[True, True, False, False],
+                        [False, False, True, True]])
+CONGESTION_LEVELS = ("low", "medium", "high")
+
+UNKNOWN_ROADS = set()
+
+def unknown_road(inter_no, road_no):
+    """Warns once per road name outside ROADS; such roads are left out of the state, as they never get a green phase."""
+    if road_no not in UNKNOWN_ROADS:
+        UNKNOWN_ROADS.add(road_no)
+        print(f"Warning: road '{road_no}' at intersection {inter_no} is not one of {', '.join(ROADS)}; it stays RED.")
+
+class TrafficState:
+    """
+    Traffic counts of a set of intersections as NumPy arrays.
+    `counts` is shaped intersections x roads x classes, `predictions` holds the
+    predicted car count per road and `present` marks which roads exist.
+    Roads and classes follow the order of ROADS and CLASSES.
+    """
+    def __init__(self, inter_ids):
+        self.inter_ids = [str(inter_id) for inter_id in inter_ids]
+        self.index = {inter_id: i for i, inter_id in enumerate(self.inter_ids)}
+        n = len(self.inter_ids)
+        self.counts = np.zeros((n, len(ROADS), len(CLASSES)), dtype=np.int64)
+        self.predictions = np.zeros((n, len(ROADS)), dtype=np.float64)
+        self.present = np.zeros((n, len(ROADS)), dtype=bool)
+
+    def __len__(self):
+        return len(self.inter_ids)
+
+    @classmethod
+    def from_dicts(cls, traffic_data, prediction_data=None):
+        state = cls(traffic_data.keys())
+        state.update(traffic_data, prediction_data)
+        return state
+
+    def update(self, traffic_data, prediction_data=None):
+        counts, predictions, present = self.counts, self.predictions, self.present
+        counts.fill(0)
+        predictions.fill(0.0)
+        present.fill(False)
+        for inter_no, roads in traffic_data.items():
+            i = self.index[inter_no]
+            for road_no, road_counts in roads.items():
+                r = ROAD_INDEX.get(road_no)
+                if r is None:
+                    unknown_road(inter_no, road_no)
+                    continue
+                present[i, r] = True
+                for name, value in road_counts.items():
+                    c = CLASS_INDEX.get(name)
+                    if c is not None:
+                        counts[i, r, c] = value
+            if prediction_data is not None:
+                for road_no, pred in prediction_data.get(inter_no, {}).items():
+                    r = ROAD_INDEX.get(road_no)
+                    if r is not None:
+                        predictions[i, r] = pred.get("car", 0)
+        return self
+
+    def set_row(self, i, inter_no, roads, predictions):
+        """Fills row i from one intersection's road counts and predictions."""
+        counts, present = self.counts[i], self.present[i]
+        counts.fill(0)
+        self.predictions[i] = 0.0
+        present.fill(False)
+        for road_no, road_counts in roads.items():
+            r = ROAD_INDEX.get(road_no)
+            if r is None:
+                unknown_road(inter_no, road_no)
+                continue
+            present[r] = True
+            for name, value in road_counts.items():
+                c = CLASS_INDEX.get(name)
+                if c is not None:
+                    counts[r, c] = value
+        for road_no, pred in predictions.items():
+            r = ROAD_INDEX.get(road_no)
+            if r is not None:
+                self.predictions[i, r] = pred.get("car", 0)
+
+    def take(self, rows):
+        """A new TrafficState with only the given rows."""
+        state = TrafficState([self.inter_ids[i] for i in rows])
+        state.counts[:] = self.counts[rows]
+        state.predictions[:] = self.predictions[rows]
+        state.present[:] = self.present[rows]
+        return state
+
+    def cars(self):
+        return self.counts[:, :, CLASS_INDEX["car"]]
+
+class Decisions:
+    """Per-intersection result of the vectorized optimisation."""
+    def __init__(self, n):
+        self.phase = np.zeros(n, dtype=np.int8)
+        self.emergency_phase = np.zeros(n, dtype=np.int8)
+        self.dynamic_duration = np.zeros(n, dtype=np.float64)
+        self.green_times = np.zeros((n, 2), dtype=np.float64)
+        self.congestion = np.zeros(n, dtype=np.int8)
+        self.green = np.zeros((n, len(ROADS)), dtype=bool)
+        # Phase forced because the other direction is empty: -1 none, else the phase.
+        self.forced_phase = np.full(n, -1, dtype=np.int8)
+        self.rl_override = False
@@ -0,0 +1,137 @@
+import json
+import os
+import time
+import numpy as np
+from congestion_store import CongestionReader
+
+SLOTS_PER_DAY = 24 * 60
+
+def minute_of_day(timestamps):
+    """Vectorized "%Y-%m-%d %H:%M:%S" -> minute of the day."""
+    stamps = np.asarray(timestamps, dtype="datetime64[s]")
+    return ((stamps - stamps.astype("datetime64[D]")).astype("timedelta64[m]").astype(np.int64))
+
+class CongestionAggregates:
+    """
+    Per-intersection, per-minute-of-day congestion totals built incrementally
+    from the congestion history. The congestion of an intersection in one
+    logged frame is its total number of cars over all roads; each time slot
+    keeps the sum and the number of such samples so averages can be updated
+    without revisiting old data. A cursor remembers how far every source has
+    been read, so the next run only processes what was appended since.
+    """
+    def __init__(self, path="training_aggregates"):
+        self.path = path
+        self.ids = []
+        self.index = {}
+        self.sums = np.zeros((0, SLOTS_PER_DAY), dtype=np.float64)
+        self.counts = np.zeros((0, SLOTS_PER_DAY), dtype=np.int64)
+        self.cursor = {"text_logs": {}, "stores": {}}
+
+    @classmethod
+    def load(cls, path="training_aggregates"):
+        aggregates = cls(path)
+        state_path = os.path.join(path, "aggregates.npz")
+        if os.path.exists(state_path):
+            with np.load(state_path) as data:
+                aggregates.sums = data["sums"]
+                aggregates.counts = data["counts"]
+            with open(os.path.join(path, "cursor.json")) as f:
+                meta = json.load(f)
+            aggregates.ids = meta["ids"]
+            aggregates.index = {inter_id: i for i, inter_id in enumerate(aggregates.ids)}
+            aggregates.cursor = meta["cursor"]
+        return aggregates
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        state_path = os.path.join(self.path, "aggregates.npz")
+        np.savez(state_path + ".tmp.npz", sums=self.sums, counts=self.counts)
+        with open(os.path.join(self.path, "cursor.json.tmp"), "w") as f:
+            json.dump({"ids": self.ids, "cursor": self.cursor}, f)
+        os.replace(state_path + ".tmp.npz", state_path)
+        os.replace(os.path.join(self.path, "cursor.json.tmp"), os.path.join(self.path, "cursor.json"))
+
+    def rows_for(self, inter_ids):
+        new_ids = [inter_id for inter_id in dict.fromkeys(inter_ids) if inter_id not in self.index]
+        if new_ids:
+            for inter_id in new_ids:
+                self.index[inter_id] = len(self.ids)
+                self.ids.append(inter_id)
+            grow = np.zeros((len(new_ids), SLOTS_PER_DAY))
+            self.sums = np.vstack([self.sums, grow])
+            self.counts = np.vstack([self.counts, grow.astype(np.int64)])
+        return np.array([self.index[inter_id] for inter_id in inter_ids], dtype=np.int64)
+
+    def add(self, inter_ids, minutes, congestion):
+        if len(inter_ids) == 0:
+            return
+        rows = self.rows_for(inter_ids)
+        np.add.at(self.sums, (rows, minutes), congestion)
+        np.add.at(self.counts, (rows, minutes), 1)
+
+    def ingest_text_log(self, path="congestion_log.txt", chunk_lines=20000):
+        """Reads the lines appended to a log_congestion text log since the last run."""
+        if not os.path.exists(path):
+            return 0
+        cursor = self.cursor["text_logs"].get(path, {"offset": 0})
+        offset = cursor["offset"]
+        if os.path.getsize(path) < offset:
+            # The log was truncated or replaced; start over.
+            offset = 0
+        processed = 0
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                lines = f.readlines(chunk_lines * 200)
+                if not lines:
+                    break
+                if not lines[-1].endswith(b"\n"):
+                    # Incomplete last line, still being written; pick it up next time.
+                    lines.pop()
+                    if not lines:
+                        break
+                stamps, inter_ids, congestion = [], [], []
+                for line in lines:
+                    entry = json.loads(line)
+                    for inter_no, roads in entry["traffic_data"].items():
+                        stamps.append(entry["timestamp"])
+                        inter_ids.append(inter_no)
+                        congestion.append(sum(counts.get("car", 0) for counts in roads.values()))
+                self.add(inter_ids, minute_of_day(stamps), np.array(congestion, dtype=np.float64))
+                offset += sum(len(line) for line in lines)
+                processed += len(lines)
+        self.cursor["text_logs"][path] = {"offset": offset}
+        return processed
+
+    def ingest_store(self, path="congestion_store"):
+        """Reads the records appended to a CongestionStore since the last run."""
+        reader = CongestionReader(path)
+        consumed = self.cursor["stores"].setdefault(path, {})
+        processed = 0
+        for bin_path, _ in reader.segments():
+            name = os.path.basename(bin_path)
+            records = reader.records(bin_path)
+            start = consumed.get(name, 0)
+            if start >= len(records):
+                continue
+            new = np.array(records[start:])
+            # Records of one intersection in one frame are contiguous; sum their cars.
+            key_change = np.flatnonzero((np.diff(new["timestamp"]) != 0) |
+                                        (np.diff(new["intersection"]) != 0)) + 1
+            starts = np.concatenate([[0], key_change])
+            congestion = np.add.reduceat(new["car"].astype(np.float64), starts)
+            timestamps = new["timestamp"][starts]
+            utc_offset = time.localtime(float(timestamps[0])).tm_gmtoff
+            minutes = ((timestamps + utc_offset) // 60 % SLOTS_PER_DAY).astype(np.int64)
+            inter_ids = [reader.ids[code] for code in new["intersection"][starts]]
+            self.add(inter_ids, minutes, congestion)
+            consumed[name] = len(records)
+            processed += len(starts)
+        return processed
+
+    def training_rows(self):
+        """(intersection ids, hour, minute, average congestion) for every slot with data."""
+        rows, minutes = np.nonzero(self.counts)
+        average = self.sums[rows, minutes] / self.counts[rows, minutes]
+        return np.array(self.ids, dtype=object)[rows], minutes // 60, minutes % 60, average
@@ -0,0 +1,238 @@
+import asyncio
+import collections
+import json
+import os
+import random
+import time
+import aiohttp
+import metrics
+from signal_codec import SignalEncoder, CONTENT_TYPE, pack_frames
+
+class TelemetryUploader:
+    """
+    Sends signal data to the backend from a bounded in-memory queue.
+    Several frames are coalesced into one POST, at most `max_concurrency`
+    requests are in flight, failed requests are retried with exponential
+    backoff, and batches that still fail are written to an on-disk spool that
+    is drained once the backend answers again.
+
+    The JSON request body keeps the old "data" field (the newest frame) and
+    adds "frames", the list of all coalesced frames with their timestamps.
+    With wire_format "binary" the body is instead the frames encoded by
+    signal_codec, a keyframe followed by deltas, so every request (including
+    one drained from the spool later) can be decoded on its own.
+    """
+    def __init__(self, session, url, max_queue=100, batch_size=10, flush_interval=1.0,
+                 max_concurrency=2, max_retries=3, backoff_base=0.5, backoff_max=30.0,
+                 timeout=5, spool_dir="upload_spool", spool_max_bytes=50 * 1024 * 1024, wire_format="json",
+                 keyframe_interval=100):
+        self.session = session
+        self.endpoint = url + "traffic/signal-data"
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.spool_dir = spool_dir
+        self.spool_max_bytes = spool_max_bytes
+        self.encoder = SignalEncoder(keyframe_interval) if wire_format == "binary" else None
+        self.pending = collections.deque()
+        self.wakeup = asyncio.Event()
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.in_flight = set()
+        self.offline_until = 0.0
+        self.draining = False
+        self.closing = False
+        self.task = None
+        self.stats = {"submitted": 0, "sent": 0, "requests": 0, "retries": 0, "failed": 0, "rejected": 0,
+                      "dropped": 0, "spooled": 0, "drained": 0, "bytes": 0}
+
+    @classmethod
+    def from_config(cls, session, url, config):
+        upload_config = config.get("uploader", {})
+        return cls(session, url,
+                   max_queue=upload_config.get("max_queue", 100),
+                   batch_size=upload_config.get("batch_size", 10),
+                   flush_interval=upload_config.get("flush_interval", 1.0),
+                   max_concurrency=upload_config.get("max_concurrency", 2),
+                   max_retries=upload_config.get("max_retries", 3),
+                   backoff_base=upload_config.get("backoff_base", 0.5),
+                   backoff_max=upload_config.get("backoff_max", 30.0),
+                   timeout=upload_config.get("timeout", 5),
+                   spool_dir=upload_config.get("spool_dir", "upload_spool"),
+                   spool_max_bytes=upload_config.get("spool_max_bytes", 50 * 1024 * 1024),
+                   wire_format=upload_config.get("format", "json"),
+                   keyframe_interval=upload_config.get("keyframe_interval", 100))
+
+    def count(self, event, n=1):
+        self.stats[event] += n
+        metrics.registry.inc("uploads_total", n, event=event)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        if self.spool_files():
+            self.schedule_drain()
+        return self
+
+    def submit(self, data):
+        # Never blocks the frame loop: when the queue is full the oldest frame is dropped.
+        self.pending.append({"timestamp": time.time(), "data": data})
+        self.count("submitted")
+        if len(self.pending) > self.max_queue:
+            self.pending.popleft()
+            self.count("dropped")
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+    async def run(self):
+        while not (self.closing and not self.pending):
+            if len(self.pending) < self.batch_size and not self.closing:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self.wakeup.clear()
+            if not self.pending:
+                continue
+            batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+            await self.slots.acquire()
+            task = asyncio.create_task(self.send_batch(batch))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def send_batch(self, batch):
+        try:
+            if time.time() < self.offline_until:
+                await self.spool(batch)
+                return
+            result = await self.post_with_retry(self.payload(batch))
+            if result != "failed":
+                self.count("sent" if result == "ok" else "rejected", len(batch))
+                self.offline_until = 0.0
+                if self.spool_files():
+                    self.schedule_drain()
+            else:
+                # Back off from the backend for a while; new batches go straight to the spool.
+                self.offline_until = time.time() + self.backoff_max
+                await self.spool(batch)
+        finally:
+            self.slots.release()
+
+    def payload(self, batch):
+        """Request body and content type of a batch."""
+        if self.encoder is not None:
+            frames = [self.encoder.encode(item["data"], item["timestamp"], keyframe=(i == 0))
+                      for i, item in enumerate(batch)]
+            return pack_frames(frames), CONTENT_TYPE
+        return json.dumps({"data": batch[-1]["data"], "frames": batch}, separators=(",", ":")).encode(), \
+            "application/json"
+
+    async def post(self, payload):
+        """Returns "ok", "retry" for transient failures, or "fail"."""
+        body, content_type = payload
+        self.count("requests")
+        self.stats["bytes"] += len(body)
+        metrics.registry.inc("upload_bytes_total", len(body))
+        try:
+            with metrics.registry.timer("upload.request"):
+                async with self.session.post(self.endpoint, data=body, headers={"Content-Type": content_type},
+                                             timeout=self.timeout) as response:
+                    if 200 <= response.status < 300:
+                        return "ok"
+                    if response.status == 429 or response.status >= 500:
+                        return "retry"
+                    print(f"Failed to send data. Status code: {response.status}")
+                    print(f"Response text: {await response.text()}")
+                    return "fail"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Upload error: {e.__class__.__name__}: {e}")
+            return "retry"
+
+    async def post_with_retry(self, payload, max_retries=None):
+        """
+        Returns "ok", "rejected" when the backend refused the data itself
+        (retrying or spooling will not help), or "failed" once the retries
+        are used up. Callers count the frames that were sent or rejected.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        for attempt in range(max_retries + 1):
+            result = await self.post(payload)
+            if result == "ok":
+                return "ok"
+            if result == "fail":
+                return "rejected"
+            if attempt < max_retries:
+                self.count("retries")
+                delay = min(self.backoff_base * 2 ** attempt, self.backoff_max)
+                await asyncio.sleep(delay * (0.5 + random.random() / 2))
+        self.count("failed")
+        return "failed"
+
+    def spool_files(self):
+        if not os.path.isdir(self.spool_dir):
+            return []
+        return sorted(os.path.join(self.spool_dir, name) for name in os.listdir(self.spool_dir)
+                      if name.endswith(".json"))
+
+    async def spool(self, batch):
+        await asyncio.to_thread(self.write_spool, batch)
+        self.count("spooled", len(batch))
+
+    def write_spool(self, batch):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.join(self.spool_dir, f"batch_{time.time_ns()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(batch, f)
+        os.replace(path + ".tmp", path)
+        # Keep the spool bounded by discarding the oldest batches.
+        files = self.spool_files()
+        sizes = [os.path.getsize(name) for name in files]
+        total = sum(sizes)
+        for name, size in zip(files, sizes):
+            if total <= self.spool_max_bytes:
+                break
+            os.remove(name)
+            total -= size
+            self.count("dropped")
+
+    def schedule_drain(self):
+        if not self.draining:
+            self.draining = True
+            task = asyncio.create_task(self.drain_spool())
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def drain_spool(self):
+        # Oldest batches first; stop at the first failure and keep the rest on disk.
+        try:
+            for path in self.spool_files():
+                with open(path) as f:
+                    batch = json.load(f)
+                async with self.slots:
+                    result = await self.post_with_retry(self.payload(batch), max_retries=1)
+                if result == "failed":
+                    self.offline_until = time.time() + self.backoff_max
+                    return
+                os.remove(path)
+                self.count("drained" if result == "ok" else "rejected", len(batch))
+        finally:
+            self.draining = False
+
+    async def close(self, timeout=10.0):
+        """Flushes the queue, waits for in-flight requests and spools whatever is left."""
+        self.closing = True
+        self.wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self.task), timeout)
+            if self.in_flight:
+                await asyncio.wait(set(self.in_flight), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        if self.pending:
+            await self.spool(list(self.pending))
+            self.pending.clear()
+
+    def format_stats(self):
+        return " ".join(f"{name}={value}" for name, value in self.stats.items()) + f" queued={len(self.pending)}"
@@ -1,5 +1,7 @@
 import cv2
 import json
+import queue
+import threading
 import datetime
 
 def draw_roi(frame, roi, inter_no, road_no, counts, signal, dynamic_duration=None, mode="Normal"):
@@ -23,10 +25,79 @@ def draw_roi(frame, roi, inter_no, road_no, counts, signal, dynamic_duration=Non
     text_y = max(y - 10, 20)
     cv2.putText(frame, text, (x, text_y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
 
-def draw_detections(frame, detections):
-    for detection in detections:
-        x1, y1, x2, y2 = detection['bbox']
-        cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 255, 0), 2)
+def draw_detections(frame, detections, offset=(0, 0), scale=1.0):
+    # Accepts a DETECTION_DTYPE array or the older list of detection dicts.
+    # Boxes are relative to `offset` (the ROI origin) and drawn scaled by `scale`.
+    if hasattr(detections, "dtype"):
+        boxes = zip(detections["x1"].tolist(), detections["y1"].tolist(),
+                    detections["x2"].tolist(), detections["y2"].tolist())
+    else:
+        boxes = (detection['bbox'] for detection in detections)
+    ox, oy = offset
+    for x1, y1, x2, y2 in boxes:
+        cv2.rectangle(frame, (int((x1 + ox) * scale), int((y1 + oy) * scale)),
+                      (int((x2 + ox) * scale), int((y2 + oy) * scale)), (255, 255, 0), 2)
+
+def scale_for_display(frame, scale_factor):
+    """The frame resized for display; only rendered frames pay for the resize."""
+    if scale_factor == 1:
+        return frame
+    return cv2.resize(frame, None, fx=scale_factor, fy=scale_factor, interpolation=cv2.INTER_LINEAR)
+
+def annotate_frame(frame, intersections_config, scale_factor, crops, detections, traffic_data, output_signals):
+    # ROIs and detections are in native frame coordinates; `frame` is the
+    # display frame, scale_factor times the native size.
+    for (inter_no, road_no), (x, y, w, h) in crops.items():
+        draw_detections(frame, detections.get((inter_no, road_no), []), (x, y), scale_factor)
+    decisions = {(item["intersection"], item["road"]): item for item in output_signals}
+    for inter_no, inter_data in intersections_config.items():
+        for road_no, roi in inter_data.get("roads", {}).items():
+            x, y, w, h = [int(coord * scale_factor) for coord in roi]
+            decision = decisions.get((inter_no, road_no))
+            signal = decision["signal"] if decision else "UNKNOWN"
+            dynamic_duration = decision.get("dynamic_green_duration") if decision else None
+            counts = traffic_data[inter_no].get(road_no, {"car": 0, "ambulance": 0, "schoolbus": 0, "accident": 0})
+            mode = decision.get("mode", "Normal") if decision else "Normal"
+            draw_roi(frame, (x, y, w, h), inter_no, road_no, counts, signal, dynamic_duration, mode)
+    return frame
+
+class BackgroundVideoWriter:
+    """
+    Writes preview frames to a video file from a background thread.
+    Frames are dropped rather than queued without bound if encoding falls behind.
+    """
+    def __init__(self, path, fps=10.0, max_pending=8):
+        self.path = path
+        self.fps = fps
+        self.frames = queue.Queue(max_pending)
+        self.written = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name="preview-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, frame):
+        try:
+            self.frames.put_nowait(frame)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        writer = None
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            if writer is None:
+                height, width = frame.shape[:2]
+                writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, (width, height))
+            writer.write(frame)
+            self.written += 1
+        if writer is not None:
+            writer.release()
+
+    def close(self):
+        self.frames.put(None)
+        self.thread.join()
 
 def log_congestion(traffic_data, current_time):
     log_entry = {